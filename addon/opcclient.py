@@ -42,6 +42,10 @@ try:
 	import json
 except ImportError:
 	import simplejson as json
+try:
+	import numpy
+except ImportError:
+	numpy = None
 
 
 class OPCclient(object):
@@ -78,6 +82,9 @@ class OPCclient(object):
 
 		self._socket = None  # will be None when we're not connected
 
+		# hyperion_recording.frame_recorder of the pixels sent, None if not recording
+		self.recorder = None
+
 		self.noDither = False
 		self.noInterp = False
 		self.manualLED = False
@@ -137,7 +144,7 @@ class OPCclient(object):
 	def send(self, packet):
 		self._debug('put_pixels: sending pixels to server')
 		try:
-			self._socket.send(packet)
+			self._socket.sendall(packet)
 		except socket.error:
 			self._debug('put_pixels: connection lost.  could not send pixels.')
 			self._socket = None
@@ -160,6 +167,9 @@ class OPCclient(object):
 			For example: [(255, 255, 255), (0, 0, 0), (127, 0, 0)]
 			Floats will be rounded down to integers.
 			Values outside the legal range will be clamped.
+			Flat (r, g, b) bytes and numpy uint8 arrays of shape (n, 3), as
+			rendered by hyperion_effects, are sent without conversion; numpy
+			arrays of other types are clamped and rounded down first.
 
 		Will establish a connection to the server as needed.
 
@@ -177,6 +187,20 @@ class OPCclient(object):
 			self._debug('put_pixels: not connected.  ignoring these pixels.')
 			return False
 
+		if numpy is not None and isinstance(pixels, numpy.ndarray):
+			if pixels.dtype != numpy.uint8:
+				pixels = numpy.asarray(pixels).clip(0, 255).astype(numpy.uint8)
+			data = pixels.tobytes()
+		elif isinstance(pixels, (bytes, bytearray, memoryview)):
+			data = bytes(pixels)
+		else:
+			data = None
+		if data is not None:
+			if self.recorder is not None:
+				self.recorder.record(data, channel)
+			self.send(struct.pack(">BBH", channel, 0, len(data)) + data)
+			return True
+
 		# build OPC message
 		len_hi_byte = int(len(pixels)*3 / 256)
 		len_lo_byte = (len(pixels)*3) % 256
@@ -188,7 +212,11 @@ class OPCclient(object):
 					 min(255, max(0, int(g))),
 					 min(255, max(0, int(b)))) for r, g, b in pixels ]
 
-		self.send( header + b''.join(pieces) )
+		data = b''.join(pieces)
+		if self.recorder is not None:
+			self.recorder.record(data, channel)
+
+		self.send( header + data )
 
 		return True
 
@@ -223,38 +251,24 @@ class OPCclient(object):
 
 
 if __name__ == "__main__":
-	import colorsys
+	import os
+	sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+	from hyperion_effects import play, rainbow_swirl
+	from hyperion_pacer import frame_pacer
 	opc = OPCclient()
-	
-		
+
 	ledCount = 128
-	ledData = ledCount * [(0,0,0)]
-	saturation = 1.0
 	brightness = 1.0
 	rotationTime = 3
-	
-	increment = 3
-	sleepTime = rotationTime / ledCount
-	while sleepTime < 0.05:
-		increment *= 2
-		sleepTime *= 2
-	increment %= ledCount
-	increment = -increment
-	
-	for i in range(ledCount):
-		hue = float(i)/ledCount
-		rgb = colorsys.hsv_to_rgb(hue, saturation, brightness)
-		ledData[i] =(int(255*rgb[0]), int(255*rgb[1]), int(255*rgb[2]))
 
 	#opc.setFirmwareConfig(noDither=False,noInterp=True,manualLED=True,ledOnOff=False)
 	#opc.setGlobalColorCorrection(1.1, (1.0, 1.0, 1.0) )
 
+	pacer = frame_pacer(60)
 	try:
-		while True:
-			opc.put_pixels(ledData)
-			ledData = ledData[-increment:] + ledData[:-increment]
-			time.sleep(sleepTime)
-	except:
+		play(rainbow_swirl(ledCount, rotation_time=rotationTime, brightness=brightness), opc.put_pixels, pacer=pacer)
+	except KeyboardInterrupt:
 		print()
-	
-	
\ No newline at end of file
+	stats = pacer.stats()
+	print('%.2f fps for %.2f, %d late and %d skipped frames, jitter p99 <= %.6f s' % (stats['achieved_fps'],
+		stats['fps'], stats['late'], stats['skipped'], stats['jitter']['p99'] or 0.0))
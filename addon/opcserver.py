@@ -5,6 +5,8 @@ from threading import Thread, Lock
 
 class OPCserver(Thread):
 	update_func = None
+	# hyperion_recording.frame_recorder of the pixels received, None if not recording
+	recorder = None
 	running = False
 	_standby = False
 	_lock = Lock()
@@ -16,18 +18,32 @@ class OPCserver(Thread):
 		def setup(self):
 			self.request.settimeout(10)
 
+		# ------------------------------------------------------
+		def recv_exact(self, size):
+			# recv may return part of a large frame: read until complete
+			data = self.request.recv(size)
+			if len(data) == size or not data:
+				return data
+			buffer = bytearray(data)
+			while len(buffer) < size:
+				data = self.request.recv(size - len(buffer))
+				if not data:
+					return b''
+				buffer += data
+			return bytes(buffer)
+
 		# ------------------------------------------------------
 		def handle(self):
 			while OPCserver.running:
 				try:
 					# recv header
-					data = self.request.recv(4).strip()
+					data = self.recv_exact(4)
 					if not data or not OPCserver.running: break
 					channel, cmd, hi, lo = data[:4]
 					length = hi*256 + lo
 
 					# recv data
-					data = self.request.recv(length)
+					data = self.recv_exact(length)
 					if not data or not OPCserver.running: break
 				except socket.timeout:
 					break
@@ -35,6 +51,8 @@ class OPCserver(Thread):
 				# process data
 				with OPCserver._lock:
 					if cmd == 0:
+						if OPCserver.recorder is not None:
+							OPCserver.recorder.record(data, channel)
 						if OPCserver.update_func is not None and len(data) >= 3:
 							led_data = []
 							for n in range(0,len(data),3):
@@ -76,10 +94,11 @@ class OPCserver(Thread):
 	# ======================================================
 
 	# ------------------------------------------------------
-	def __init__(self, upd_func=None, col_func=None, HOST='127.0.0.1', PORT=19444):
+	def __init__(self, upd_func=None, col_func=None, HOST='127.0.0.1', PORT=19444, recorder=None):
 		Thread.__init__(self)
 		OPCserver.update_func = upd_func
 		OPCserver.color_func = col_func
+		OPCserver.recorder = recorder
 		self.server = socketserver.TCPServer((HOST, int(PORT)), OPCserver.OPCHandler, False)
 		self.server.allow_reuse_address = True
 		self.server.socket.settimeout(3)
@@ -1,17 +1,76 @@
+import time
+_start_time = time.perf_counter()
+
+import argparse
+import logging
 import sys
 import PyQt5.QtWidgets as qtw # import QMainWindow, QApplication, QPushButton, QFrame, QVBoxLayout
 from PyQt5 import QtCore as qtc
 from functools import partial
 
 import hyperion_client
+from hyperion_config import json_port, load_config
+
+_log = logging.getLogger(__name__)
+
+# maximum time in seconds from the start of the process to the first paint of the window
+STARTUP_BUDGET = 1.0
+# time in milliseconds between two checks of the connection
+HEALTH_INTERVAL = 1000
+
+
+class connection_worker(qtc.QThread):
+    """Connect to the hyperion server and load the serverinfo without blocking the window."""
+
+    state = qtc.pyqtSignal(str)
+    connected = qtc.pyqtSignal()
+    info = qtc.pyqtSignal(dict)
+
+    def __init__(self, client, timeout=10, parent=None):
+        super().__init__(parent)
+        self.client = client
+        self.timeout = timeout
+        self._stop = False
+
+    def stop(self):
+        """Ask the thread to stop, without waiting: a connection attempt in progress still runs to its timeout."""
+        self._stop = True
+
+    def run(self):
+        target = "%s:%d" % (self.client.host, self.client.port)
+        while not self._stop:
+            self.state.emit("Connecting to %s..." % target)
+            try:
+                self.client.open_connection(timeout=self.timeout)
+                break
+            except OSError as exc:
+                retry_in = self.client.health()["retry_in"]
+                self.state.emit("Cannot connect to %s (%s), retrying in %.0f s" % (target, exc, retry_in))
+                # sleep in small steps so closing the window is not delayed
+                deadline = time.monotonic() + retry_in
+                while not self._stop and time.monotonic() < deadline:
+                    self.msleep(100)
+        if self._stop:
+            return
+        # the sliders emit far more values than the leds can show while dragging
+        self.client.enable_coalescing(max_rate=30)
+        self.connected.emit()
+        self.state.emit("Connected to %s, loading the server state..." % target)
+        try:
+            info = self.client.serverinfo()
+        except Exception as exc:
+            self.state.emit("Connected to %s, serverinfo failed: %s" % (target, exc))
+            return
+        self.info.emit(info)
+        self.state.emit("Connected to %s (%s)" % (target, info["info"].get("hostname", "hyperion")))
 
-h = hyperion_client.hyperion_client('192.168.0.109', 19444)
-h.open_connection(timeout=100)
 
 class MyMainWindow(qtw.QMainWindow):
 
-    def __init__(self):
+    def __init__(self, client, timeout=10):
         super().__init__()
+        self.client = client
+        self.startup_time = None
 
         self.button1 = qtw.QPushButton("Toggle White")
         self.button2 = qtw.QPushButton("SendRGB")
@@ -62,18 +121,96 @@ class MyMainWindow(qtw.QMainWindow):
         self.slider3.valueChanged.connect(self.valuechange)
         self.button2.clicked.connect(self.valuechange)
         self.setCentralWidget(self.frame)
+
+        # the controls are enabled once the server is connected
+        self.controls = (self.button1, self.button2, self.slider1, self.slider2, self.slider3)
+        for widget in self.controls:
+            widget.setEnabled(False)
+        self.statusBar().showMessage("Starting...")
+
+        self.worker = connection_worker(client, timeout, self)
+        self.worker.state.connect(self.statusBar().showMessage)
+        self.worker.connected.connect(self.on_connected)
+        self.worker.info.connect(self.on_info)
+        self.worker.finished.connect(self.on_worker_finished)
+        self.closing = False
+        # the connection can be lost later, e.g. when the server restarts
+        self.health_timer = qtc.QTimer(self)
+        self.health_timer.timeout.connect(self.check_health)
         self.show()
+        # connect once the window is on screen
+        qtc.QTimer.singleShot(0, self.worker.start)
+
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if self.startup_time is None:
+            self.startup_time = time.perf_counter() - _start_time
+            if self.startup_time > STARTUP_BUDGET:
+                _log.warning("First paint after %.3f s, over the %.3f s budget", self.startup_time, STARTUP_BUDGET)
+
+    def set_controls_enabled(self, enabled):
+        for widget in self.controls:
+            widget.setEnabled(enabled)
+
+    def on_connected(self):
+        self.set_controls_enabled(True)
+        self.health_timer.start(HEALTH_INTERVAL)
+
+    def check_health(self):
+        if self.worker.isRunning():
+            # the worker reports the state while it connects
+            return
+        health = self.client.health()
+        if health["connected"]:
+            # the client may have reconnected by itself while sending
+            if not self.button1.isEnabled():
+                self.set_controls_enabled(True)
+                self.statusBar().showMessage("Connected to %s:%d" % (self.client.host, self.client.port))
+            return
+        self.set_controls_enabled(False)
+        self.statusBar().showMessage("Connection to %s:%d lost (%s), reconnecting..." %
+                                     (self.client.host, self.client.port, health["last_error"]))
+        self.worker.start()
+
+    def on_info(self, info):
+        info = info["info"]
+        self.setWindowTitle("Hyperion - %s" % info.get("hostname", self.client.host))
+        colors = info.get("activeLedColor") or ()
+        if colors and "RGB Value" in colors[0]:
+            # show the current color without sending it back
+            for slider, value in zip((self.slider1, self.slider2, self.slider3), colors[0]["RGB Value"]):
+                slider.blockSignals(True)
+                slider.setValue(int(value))
+                slider.blockSignals(False)
+            self.label1.setText("(R, G, B): " + ", ".join(str(value) for value in colors[0]["RGB Value"]))
+
+    def on_worker_finished(self):
+        if self.closing:
+            self.close()
+
+    def closeEvent(self, event):
+        self.health_timer.stop()
+        if self.worker.isRunning():
+            # a connection attempt cannot be interrupted: hide the window now and close it once the
+            # attempt returns, instead of blocking the event loop until its timeout
+            self.closing = True
+            self.worker.stop()
+            self.hide()
+            event.ignore()
+            return
+        self.client.close_connection()
+        super().closeEvent(event)
 
     def button_pressed(self, caller, status):
         if status:
             # print("button {} is down".format(caller))
             self.label1.setText("(R, G, B): (150, 150, 150)")
-            h.send_led_data((150,150,150))
+            self.client.send_led_data((150,150,150))
 
         else:
             # print("button {} is up".format(caller))
             self.label1.setText("(R, G, B): (0, 0, 0)")
-            h.send_led_data((0, 0, 0))
+            self.client.send_led_data((0, 0, 0))
 
     def valuechange(self):
         # print("current value red:" + str(self.slider1.value()))
@@ -84,11 +221,37 @@ class MyMainWindow(qtw.QMainWindow):
         blue = self.slider3.value()
         self.label1.setText("(R, G, B): " + str(red)+", "+str(green)+", "+str(blue))
         # print(str(red)+", "+str(green)+", "+str(blue))
-        h.send_led_data((red, green, blue))
+        self.client.send_led_data((red, green, blue))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Control a hyperion server.")
+    parser.add_argument("--host", default="192.168.0.109", help="ip address of the hyperion server")
+    parser.add_argument("--port", type=int, default=None, help="json port of the hyperion server (default: 19444)")
+    parser.add_argument("--config", help="hyperion configuration file to read the json port from")
+    parser.add_argument("--timeout", type=float, default=10, help="connection timeout in seconds")
+    parser.add_argument("--measure-startup", action="store_true",
+                        help="print the time to the first paint and exit, with status 1 if over the budget")
+    args, _ = parser.parse_known_args(argv)
+    if args.port is None:
+        args.port = json_port(load_config(args.config)) if args.config else 19444
+    return args
 
 
 if __name__ == '__main__':
+    args = parse_args()
     app = qtw.QApplication(sys.argv)
-    GUI = MyMainWindow()
+    h = hyperion_client.hyperion_client(args.host, args.port)
+    GUI = MyMainWindow(h, args.timeout)
     GUI.show()
+    if args.measure_startup:
+        def report():
+            if GUI.startup_time is None:
+                qtc.QTimer.singleShot(10, report)
+                return
+            print("first paint after %.3f s (budget %.3f s)" % (GUI.startup_time, STARTUP_BUDGET))
+            GUI.close()
+            app.exit(0 if GUI.startup_time <= STARTUP_BUDGET else 1)
+        # the paint events are processed before the timers of the next loop iteration
+        qtc.QTimer.singleShot(0, lambda: qtc.QTimer.singleShot(0, report))
     sys.exit(app.exec_())
@@ -0,0 +1,431 @@
+"""
+hyperion_async_client.py module.
+
+Connect to the hyperion json interface from an asyncio event loop and send/receive messages.
+"""
+import asyncio
+import collections
+import json
+
+from hyperion_catalog import effect_catalog
+from hyperion_encoder import command_encoder, led_data_encoder
+
+_encoder = command_encoder()
+# maximum size of a reply line, the serverinfo of a server with many effects exceeds the 64 KiB default
+READ_LIMIT = 16 * 1024 * 1024
+
+
+class hyperion_async_client:
+    """Hyperion JSON interface asyncio client class.
+
+    Commands are written as soon as they are issued, so many of them can be in flight on the
+    same connection. Hyperion answers the commands in the order it received them: the replies
+    are matched to the pending commands by a reader task.
+    """
+
+    def __init__(self, host='127.0.0.1', port=19444):
+        """
+        Hyperion_async_client initializer.
+
+        :param host: ip address of the host
+        :param port: port number
+        """
+        self._host = str(host)
+        self._port = int(port)
+        self._reader = None
+        self._writer = None
+        self._reader_task = None
+        self._connect_lock = None
+        self._pending = collections.deque()
+        self._led_encoder = led_data_encoder()
+
+# -IP-
+    @property
+    def host(self):
+        """
+        Return ip address.
+
+        :return: ip address of the hyperion server host
+        """
+        return self._host
+
+    @host.setter
+    def host(self, host):
+        """
+        Set ip address.
+
+        :param host: ip address of the hyperion server host
+        """
+        self._host = str(host)
+
+# -PORT-
+    @property
+    def port(self):
+        """
+        Return port.
+
+        :return: port of the hyperion server host
+        """
+        return self._port
+
+    @port.setter
+    def port(self, port):
+        """
+        Set port.
+
+        :param port: port of the hyperion server host
+        """
+        self._port = int(port)
+
+# -CONNECTION-
+    @property
+    def connected(self):
+        """
+        Return connection status.
+
+        :return: boolean value of the connection status. True if connected
+        """
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def open_connection(self, timeout=10):
+        """
+        Open a stream connection to the server.
+
+        :param timeout: timeout in seconds
+        """
+        if self._connect_lock is None:
+            self._connect_lock = asyncio.Lock()
+        # the tasks making their first call at the same time share one connection and one reader
+        async with self._connect_lock:
+            if self.connected:
+                return
+            self._reader, self._writer = await asyncio.wait_for(
+                asyncio.open_connection(self._host, self._port, limit=READ_LIMIT), timeout)
+            self._reader_task = asyncio.ensure_future(self._read_replies())
+
+    async def close_connection(self, clean=False):
+        """
+        Close the stream connection to the server.
+
+        :param clean: if True -> clear all the effects/color on disconnection
+        """
+        if not self.connected:
+            return
+        if clean:
+            await self.clear_all()
+        self._writer.close()
+        await self._writer.wait_closed()
+        if self._reader_task is not None:
+            await self._reader_task
+        self._writer = None
+        self._reader_task = None
+
+    async def __aenter__(self):
+        await self.open_connection()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close_connection()
+
+    async def _read_replies(self):
+        """Resolve the pending commands with the newline-delimited replies of the server."""
+        try:
+            while True:
+                line = await self._reader.readline()
+                if not line:
+                    break
+                if not self._pending:
+                    continue
+                future = self._pending.popleft()
+                if not future.done():
+                    try:
+                        future.set_result(json.loads(line))
+                    except ValueError as exc:
+                        future.set_exception(exc)
+        except Exception as exc:
+            # e.g. a reply over READ_LIMIT: the stream cannot be resynchronized
+            error = exc
+        else:
+            error = ConnectionError("Connection closed by the hyperion server")
+        if not self._writer.is_closing():
+            self._writer.close()
+        # fail the commands that will never get a reply
+        while self._pending:
+            future = self._pending.popleft()
+            if not future.done():
+                future.set_exception(error)
+
+    async def send_message(self, message, wait=True):
+        """Send a command to the server.
+
+        :param message: dict with the json command or the already encoded command bytes
+        :param wait: if True -> wait for the reply of the server, otherwise return the future of the reply
+        :return: parsed reply of the server (or its future if wait is False)
+        """
+        if not self.connected:
+            await self.open_connection()
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append(future)
+        if isinstance(message, dict):
+            message = json.dumps(message, separators=(',', ':')).encode('utf-8') + b'\n'
+        self._writer.write(message)
+        await self._writer.drain()
+        if not wait:
+            return future
+        return await future
+
+###############################################################################
+
+    async def serverinfo(self):
+        """
+        Get informations from the hyperion json server.
+
+        :return: json structure containing infos from the hyperion json server
+        """
+        return await self.send_message(_encoder.serverinfo())
+
+    async def effects(self):
+        """
+        Get all the effects from the hyperion json server.
+
+        :return: json structure containing all the effects from hyperion.
+        """
+        return (await self.serverinfo())["info"]["effects"]
+
+    async def effects_names(self):
+        """
+        Get the name of all the effects from hyperion.
+
+        :return: array of effects names
+        """
+        return [str(e["name"]) for e in await self.effects()]
+
+    async def active_effects(self):
+        """
+        Get all the active effects from hyperion.
+
+        :return: json structure containing all the active effects
+        """
+        return (await self.serverinfo())["info"]["activeEffects"]
+
+    async def active_color(self, mode=None):
+        """
+        Get the active color from hyperion.
+
+        :param mode: format of the color ("RGB", "HEX", "HLS"). No param or falsey param = all the formats
+        :return: color value or list of color values
+        """
+        activeColor = (await self.serverinfo())["info"]["activeLedColor"]
+        if activeColor and mode in ("RGB", "HEX", "HLS"):
+            return activeColor[0][str(mode) + " Value"]
+        return activeColor
+
+    async def active_effects_names(self):
+        """
+        Get the name of all the active effects from hyperion.
+
+        :return: array of active effects names (closest known effect for custom args, None if no
+                 effect uses the script)
+        """
+        info = (await self.serverinfo())["info"]
+        catalog = effect_catalog(info["effects"])
+        names = []
+        for active in info["activeEffects"]:
+            effect, _ = catalog.resolve(active["script"], active.get("args"))
+            names.append(str(effect["name"]) if effect is not None else None)
+        return names
+
+    async def transform(self):
+        """
+        Get the transform values from hyperion.
+
+        :return: json structure containing transform values
+        """
+        return (await self.serverinfo())["info"]["transform"]
+
+    async def temperature(self):
+        """
+        Get the temperature values from hyperion.
+
+        :return: json structure containing temperature values
+        """
+        return (await self.serverinfo())["info"]["temperature"]
+
+    async def adjustment(self):
+        """
+        Get the adjustment values from hyperion.
+
+        :return: json structure containing adjustment values
+        """
+        return (await self.serverinfo())["info"]["adjustment"]
+
+    async def correction(self):
+        """
+        Get the correction values from hyperion.
+
+        :return: json structure containing correction values
+        """
+        return (await self.serverinfo())["info"]["correction"]
+
+    async def priorities(self):
+        """
+        Get the property values from hyperion.
+
+        :return: json structure containing priority values
+        """
+        return (await self.serverinfo())["info"]["priorities"]
+
+    async def hostname(self):
+        """
+        Get the hostname from hyperion.
+
+        :return: name of the host of hyperion
+        """
+        return (await self.serverinfo())["info"]["hostname"]
+
+    async def hyperion_build(self):
+        """
+        Get the hyperion build info from hyperion.
+
+        :return: json structure containing the build versions of hyperion
+        """
+        return (await self.serverinfo())["info"]["hyperion_build"]
+
+###############################################################################
+
+    async def set_RGBcolor(self, red, green, blue, priority=100, duration=0, wait=True):
+        """
+        Send color to the hyperion json server.
+
+        :param red: red value in RGB format [0-255]
+        :param green: green value in RGB format [0-255]
+        :param blue: blue value in RGB format [0-255]
+        :param priority: priority value
+        :param duration: duration in milliseconds
+        :param wait: if True -> wait for the reply of the server
+        """
+        message = _encoder.color(priority=priority, color=(red, green, blue), duration=duration)
+        return await self.send_message(message, wait)
+
+    async def set_effect(self, effectName, priority=100, effectArgs=None, duration=0, wait=True):
+        """
+        Send effect to the hyperion json server.
+
+        :param effectName: Name of the effect
+        :param priority: priority value
+        :param effectArgs: Custom arguments for the effect
+        :param duration: duration in milliseconds
+        :param wait: if True -> wait for the reply of the server
+        """
+        message = _encoder.effect(effectName=effectName, effectArgs=effectArgs or None, priority=priority,
+                                  duration=duration)
+        return await self.send_message(message, wait)
+
+    async def clear(self, priority=100, wait=True):
+        """
+        Clear the highest priority effect/color (with lower priority value).
+
+        :param priority: clear priority value
+        :param wait: if True -> wait for the reply of the server
+        """
+        return await self.send_message(_encoder.clear(priority=priority), wait)
+
+    async def clear_all(self, wait=True):
+        """
+        Clear all the effects/color.
+
+        :param wait: if True -> wait for the reply of the server
+        """
+        return await self.send_message(_encoder.clearall(), wait)
+
+    async def set_image(self, image_data, width, height, priority=100, duration=0, wait=True):
+        """
+        Set leds to the color of the image border.
+
+        :param image_data: base64 RGB888 image data
+        :param width: width of the image
+        :param height: height of the image
+        :param priority: priority value
+        :param duration: duration in milliseconds
+        :param wait: if True -> wait for the reply of the server
+        """
+        message = _encoder.image(width=width, height=height, image_data=image_data, priority=priority,
+                                 duration=duration)
+        return await self.send_message(message, wait)
+
+    async def set_transform(self, identifier, blacklevel, gamma, luminanceGain, luminanceMinimum, saturationGain,
+                            saturationLGain, threshold, valueGain, whitelevel, wait=True):
+        """
+        Send the transform values to the hyperion json server.
+
+        :param identifier: transform id for the hyperion server to identify it
+        :param blacklevel: black level value
+        :param gamma: gamma value
+        :param luminanceGain: luminance gain value
+        :param luminanceMinimum: luminance minimum value
+        :param saturationGain: saturation gain value
+        :param saturationLGain: saturationLGain value
+        :param threshold: threshold
+        :param valueGain: value gain
+        :param whitelevel: white level value
+        :param wait: if True -> wait for the reply of the server
+        """
+        message = _encoder.transform(
+            identifier=identifier, blacklevel=blacklevel, gamma=gamma, luminanceGain=luminanceGain,
+            luminanceMinimum=luminanceMinimum, saturationGain=saturationGain, saturationLGain=saturationLGain,
+            threshold=threshold, valueGain=valueGain, whitelevel=whitelevel)
+        return await self.send_message(message, wait)
+
+    async def set_correction(self, identifier, red, green, blue, wait=True):
+        """
+        Send the correction values to the hyperion json server.
+
+        :param identifier: correction's id for the hyperion server to identify it
+        :param red: red value in RGB format [0-255]
+        :param green: green value in RGB format [0-255]
+        :param blue: blue value in RGB format [0-255]
+        :param wait: if True -> wait for the reply of the server
+        """
+        message = _encoder.correction(identifier=identifier, correctionValues=(red, green, blue))
+        return await self.send_message(message, wait)
+
+    async def set_temperature(self, identifier, red, green, blue, wait=True):
+        """
+        Send the temperature values to the hyperion json server.
+
+        :param identifier: temperature's id for the hyperion server to identify it
+        :param red: red value in RGB format [0-255]
+        :param green: green value in RGB format [0-255]
+        :param blue: blue value in RGB format [0-255]
+        :param wait: if True -> wait for the reply of the server
+        """
+        message = _encoder.temperature(identifier=identifier, correctionValues=(red, green, blue))
+        return await self.send_message(message, wait)
+
+    async def set_adjustment(self, identifier, redAdjust, greenAdjust, blueAdjust, wait=True):
+        """
+        Send the adjustment values to the hyperion json server.
+
+        :param identifier: adjustment's id for the hyperion server to identify it
+        :param redAdjust: value of the red adjustment in RGB format [0-255]
+        :param greenAdjust: value of the green adjustment in RGB format [0-255]
+        :param blueAdjust: value of the blue adjustment in RGB format [0-255]
+        :param wait: if True -> wait for the reply of the server
+        """
+        message = _encoder.adjustment(identifier=identifier, redAdjust=redAdjust, greenAdjust=greenAdjust,
+                                      blueAdjust=blueAdjust)
+        return await self.send_message(message, wait)
+
+    async def send_led_data(self, led_data, priority=100, duration=0, wait=True):
+        """
+        Send the led data in a message format that hyperion can understand.
+
+        :param led_data: led data (r,g,b) * hyperion.ledcount as bytes, bytearray, memoryview,
+                         numpy uint8 array or sequence of ints
+        :param priority: priority value
+        :param duration: duration in milliseconds
+        :param wait: if True -> wait for the reply of the server
+        """
+        # the transport may keep the data buffered: copy it out of the reused encoder buffer
+        message = bytes(self._led_encoder.encode(led_data, priority, duration))
+        return await self.send_message(message, wait)
@@ -0,0 +1,406 @@
+"""
+hyperion_benchmark.py module.
+
+Benchmark the client send paths and the OPC server ingest against loopback stand-in servers.
+
+Run "python hyperion_benchmark.py --output results.json" to write the results as json and
+"python hyperion_benchmark.py --compare old.json" to compare a run with a previous one.
+"python hyperion_benchmark.py --replay show.hled" sends the frames of a recording (see
+hyperion_recording) instead of the synthetic frames.
+"""
+import argparse
+import contextlib
+import gc
+import io
+import json
+import os
+import platform
+import socket
+import socketserver
+import sys
+import threading
+import time
+import tracemalloc
+
+from hyperion_client import hyperion_client
+from hyperion_recording import frame_replay
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "addon"))
+from opcclient import OPCclient  # noqa: E402
+from opcserver import OPCserver  # noqa: E402
+
+LED_COUNTS = (100, 1000, 10000, 21000)
+# number of frames measured with tracemalloc, which slows every allocation down
+ALLOC_FRAMES = 50
+# maximum number of frames of a recording loaded as workload
+REPLAY_FRAMES = 256
+
+# frames of a recording sent instead of the synthetic frames, see run()
+_workload = None
+
+_SERVERINFO_REPLY = {"success": True,
+                     "info": {"hostname": "benchmark", "hyperion_build": [{"version": "benchmark", "time": ""}],
+                              "priorities": [{"priority": 100}, {"priority": 255}],
+                              "activeEffects": [{"script": "effects/knight-rider.py", "args": {"speed": 1.0},
+                                                 "priority": 255}],
+                              "activeLedColor": [{"RGB Value": [255, 0, 0], "HEX Value": ["0xFF0000"],
+                                                  "HLS Value": [0.0, 0.5, 1.0]}],
+                              "effects": [{"name": "Effect %d" % i, "script": "effects/effect-%d.py" % i,
+                                           "args": {"speed": 1.0, "color": [i % 256, 0, 0]}}
+                                          for i in range(40)],
+                              "transform": [], "correction": [], "temperature": [], "adjustment": []}}
+
+
+# -STAND-INS-
+class _sink_server(socketserver.ThreadingTCPServer):
+    """Loopback server counting the received bytes."""
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, handler):
+        socketserver.ThreadingTCPServer.__init__(self, ("127.0.0.1", 0), handler)
+        self.received = 0
+        self._thread = threading.Thread(target=self.serve_forever, name="benchmark sink", daemon=True)
+        self._thread.start()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def wait_received(self, size, timeout=10.0):
+        """Wait until size bytes were received."""
+        deadline = time.monotonic() + timeout
+        while self.received < size and time.monotonic() < deadline:
+            time.sleep(0.0005)
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+
+
+class _json_sink_handler(socketserver.StreamRequestHandler):
+    """Reply success to every json command, and a canned reply to serverinfo."""
+
+    rbufsize = 1 << 20
+
+    def handle(self):
+        # the replies without their closing brace, completed by the tan of the command
+        serverinfo = json.dumps(_SERVERINFO_REPLY, separators=(',', ':')).encode('utf-8')[:-1]
+        for line in self.rfile:
+            self.server.received += len(line)
+            # the tan is the last field appended by the client
+            start = line.rfind(b'"tan":')
+            tan = line[start + 6:line.rfind(b'}')] if start >= 0 else b'0'
+            reply = serverinfo if b'"command":"serverinfo"' in line else b'{"success":true'
+            self.wfile.write(b'%s,"tan":%s}\n' % (reply, tan))
+
+
+class _raw_sink_handler(socketserver.BaseRequestHandler):
+    """Discard the received bytes."""
+
+    def handle(self):
+        while True:
+            data = self.request.recv(65536)
+            if not data:
+                return
+            self.server.received += len(data)
+
+
+# -MEASUREMENT-
+def _measure(step, duration, drain=None, received=None):
+    """
+    Run a step repeatedly and measure it.
+
+    :param step: function sending one frame
+    :param duration: time in seconds spent running the step
+    :param drain: function waiting until the sent frames were processed, None -> no wait
+    :param received: function returning the bytes received by the stand-in, None -> not measured
+    :return: dict of the measurements
+    """
+    for _ in range(10):
+        step()
+    if drain is not None:
+        drain()
+    bytes_before = received() if received is not None else 0
+    frames = 0
+    begin = time.perf_counter()
+    deadline = begin + duration
+    while True:
+        step()
+        frames += 1
+        if time.perf_counter() >= deadline:
+            break
+    if drain is not None:
+        drain()
+    elapsed = time.perf_counter() - begin
+    bytes_after = received() if received is not None else 0
+    # retained blocks: objects the frames left behind, without the tracemalloc overhead; the
+    # garbage of the timed loop is collected first, so that its release is not counted
+    gc.collect()
+    blocks = sys.getallocatedblocks()
+    for _ in range(ALLOC_FRAMES):
+        step()
+    if drain is not None:
+        drain()
+    gc.collect()
+    blocks = sys.getallocatedblocks() - blocks
+    # transient allocations: peak of the traced memory (all threads) while a frame is sent and processed
+    tracemalloc.start()
+    peak = 0
+    try:
+        for _ in range(ALLOC_FRAMES):
+            current = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            step()
+            if drain is not None:
+                drain()
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - current)
+    finally:
+        tracemalloc.stop()
+    return {"frames": frames,
+            "seconds": elapsed,
+            "fps": frames / elapsed,
+            "us_per_frame": elapsed / frames * 1e6,
+            "bytes_per_frame": (bytes_after - bytes_before) / frames if received is not None else None,
+            "alloc_peak_bytes": peak,
+            "alloc_blocks_per_frame": blocks / ALLOC_FRAMES}
+
+
+def _frames(leds):
+    """
+    Return the frames of leds * 3 bytes sent in turn.
+
+    :return: two different synthetic frames, or the frames of the workload recording repeated or
+             cut to the size
+    """
+    size = leds * 3
+    if _workload:
+        return [(frame * -(-size // len(frame)))[:size] for frame in _workload]
+    return (bytes(i % 256 for i in range(size)), bytes((i * 7) % 256 for i in range(size)))
+
+
+def _image_size(leds):
+    """Return a (width, height) image size of about leds pixels."""
+    width = max(1, int(round(leds ** 0.5)))
+    return width, max(1, leds // width)
+
+
+@contextlib.contextmanager
+def _json_client():
+    """Yield a connected hyperion_client and the stand-in json server."""
+    server = _sink_server(_json_sink_handler)
+    client = hyperion_client("127.0.0.1", server.port)
+    client.open_connection()
+    try:
+        yield client, server
+    finally:
+        client.close_connection()
+        server.close()
+
+
+def _wait_replies(client, timeout=5.0):
+    """Wait until the server answered all the commands of a client."""
+    deadline = time.monotonic() + timeout
+    while client.pending_requests and time.monotonic() < deadline:
+        time.sleep(0.001)
+
+
+# -BENCHMARKS-
+def bench_send_led_data(leds, duration):
+    """hyperion_client.send_led_data of a frame of leds colors."""
+    frames = _frames(leds)
+    with _json_client() as (client, server):
+        count = [0]
+
+        def step():
+            count[0] += 1
+            client.send_led_data(frames[count[0] % len(frames)])
+        return _measure(step, duration, lambda: _wait_replies(client), lambda: server.received)
+
+
+def bench_set_image(leds, duration):
+    """hyperion_client.set_image of a raw image of about leds pixels, encoded in the calling thread."""
+    width, height = _image_size(leds)
+    frames = [frame[:width * height * 3] for frame in _frames(width * height)]
+    with _json_client() as (client, server):
+        count = [0]
+
+        def step():
+            count[0] += 1
+            client.set_image(frames[count[0] % len(frames)], width, height, block=True)
+        return _measure(step, duration, lambda: _wait_replies(client), lambda: server.received)
+
+
+def bench_set_RGBcolor(leds, duration):
+    """hyperion_client.set_RGBcolor, independent of the led count."""
+    with _json_client() as (client, server):
+        count = [0]
+
+        def step():
+            count[0] += 1
+            client.set_RGBcolor(count[0] & 255, 0, 0)
+        return _measure(step, duration, lambda: _wait_replies(client), lambda: server.received)
+
+
+def bench_serverinfo(leds, duration):
+    """hyperion_client.serverinfo round trip, independent of the led count."""
+    with _json_client() as (client, server):
+        return _measure(lambda: client.serverinfo(refresh=True), duration, received=lambda: server.received)
+
+
+def bench_opc_put_pixels(leds, duration):
+    """OPCclient.put_pixels of leds (r, g, b) tuples."""
+    frames = [[tuple(frame[i:i + 3]) for i in range(0, len(frame), 3)] for frame in _frames(leds)]
+    server = _sink_server(_raw_sink_handler)
+    client = OPCclient("127.0.0.1:%d" % server.port)
+    try:
+        count = [0]
+
+        def step():
+            count[0] += 1
+            client.put_pixels(frames[count[0] % len(frames)])
+
+        def drain():
+            server.wait_received(count[0] * (4 + leds * 3))
+        return _measure(step, duration, drain, lambda: server.received)
+    finally:
+        client.disconnect()
+        server.close()
+
+
+def bench_opc_server_ingest(leds, duration):
+    """OPCserver decoding frames of leds colors into a no-op update_func."""
+    ingested = [0]
+
+    def update_func(led_data):
+        ingested[0] += 1
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        server = OPCserver(update_func, None, PORT=0)
+    server.daemon = True
+    server.start()
+    # the server listens once its thread runs
+    deadline = time.monotonic() + 5.0
+    while True:
+        try:
+            sock = socket.create_connection(server.server.server_address)
+            break
+        except ConnectionRefusedError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.01)
+    packets = [bytes((0, 0, len(frame) >> 8, len(frame) & 255)) + frame for frame in _frames(leds)]
+    sent = [0]
+
+    def step():
+        sent[0] += 1
+        sock.sendall(packets[sent[0] % len(packets)])
+
+    def drain():
+        deadline = time.monotonic() + 10.0
+        while ingested[0] < sent[0] and time.monotonic() < deadline:
+            time.sleep(0.0005)
+
+    try:
+        result = _measure(step, duration, drain)
+        result["bytes_per_frame"] = len(packets[0])
+        return result
+    finally:
+        sock.close()
+        server.stop()
+
+
+BENCHMARKS = {"send_led_data": (bench_send_led_data, True),
+              "set_image": (bench_set_image, True),
+              "set_RGBcolor": (bench_set_RGBcolor, False),
+              "serverinfo": (bench_serverinfo, False),
+              "opc_put_pixels": (bench_opc_put_pixels, True),
+              "opc_server_ingest": (bench_opc_server_ingest, True)}
+
+
+def run(names=None, led_counts=LED_COUNTS, duration=1.0, replay=None):
+    """
+    Run benchmarks.
+
+    The benchmarks independent of the led count run once, with "leds" None.
+
+    :param names: names of the benchmarks to run, None -> all of them (see BENCHMARKS)
+    :param led_counts: numbers of leds of the frames
+    :param duration: time in seconds spent in each measurement
+    :param replay: path of a recording whose first REPLAY_FRAMES frames are sent instead of the
+                   synthetic frames, None -> synthetic frames
+    :return: dict with the environment and a "results" list of dicts with the benchmark name,
+             the led count and the measurements
+    """
+    global _workload
+    _workload = None
+    if replay is not None:
+        with frame_replay(replay) as recording:
+            _workload = [bytes(recording.frame(index)[2]) for index in range(min(len(recording), REPLAY_FRAMES))]
+        _workload = [frame for frame in _workload if frame] or None
+    results = []
+    for name in names or BENCHMARKS:
+        function, per_leds = BENCHMARKS[name]
+        for leds in (led_counts if per_leds else (None,)):
+            measurement = function(leds or 0, duration)
+            results.append(dict(benchmark=name, leds=leds, **measurement))
+    try:
+        import numpy
+        numpy_version = numpy.__version__
+    except ImportError:
+        numpy_version = None
+    return {"time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "platform": platform.platform(),
+            "numpy": numpy_version,
+            "duration": duration,
+            "replay": replay,
+            "results": results}
+
+
+def compare(old, new):
+    """
+    Compare the frames per second of two runs.
+
+    :param old: result of a previous run
+    :param new: result of the current run
+    :return: list of (benchmark, leds, old fps, new fps, ratio) tuples of the measurements of both runs
+    """
+    previous = {(result["benchmark"], result["leds"]): result for result in old["results"]}
+    rows = []
+    for result in new["results"]:
+        before = previous.get((result["benchmark"], result["leds"]))
+        if before is not None:
+            rows.append((result["benchmark"], result["leds"], before["fps"], result["fps"],
+                         result["fps"] / before["fps"] if before["fps"] else float("inf")))
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the hyperion clients and the OPC server.")
+    parser.add_argument("benchmarks", nargs="*", help="benchmarks to run: %s (default: all)" % ", ".join(BENCHMARKS))
+    parser.add_argument("--leds", type=int, nargs="+", default=list(LED_COUNTS), help="led counts")
+    parser.add_argument("--duration", type=float, default=1.0, help="seconds per measurement")
+    parser.add_argument("--output", help="write the json results to this file instead of stdout")
+    parser.add_argument("--compare", help="json results of a previous run to compare with")
+    parser.add_argument("--replay", help="recording whose frames are sent instead of the synthetic frames")
+    args = parser.parse_args()
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error("unknown benchmark %r" % name)
+    report = run(args.benchmarks or None, args.leds, args.duration, args.replay)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(text + "\n")
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare) as previous:
+            rows = compare(json.load(previous), report)
+        print("%-18s %7s %12s %12s %7s" % ("benchmark", "leds", "old fps", "new fps", "ratio"), file=sys.stderr)
+        for name, leds, old_fps, new_fps, ratio in rows:
+            print("%-18s %7s %12.1f %12.1f %7.2f" % (name, leds if leds is not None else "-", old_fps, new_fps, ratio),
+                  file=sys.stderr)
@@ -0,0 +1,127 @@
+"""
+hyperion_catalog.py module.
+
+Index the effects of a hyperion server to resolve the running effects to their names.
+"""
+
+
+def canonical_args(args):
+    """
+    Return a hashable canonical form of effect arguments.
+
+    Dicts are sorted by key and numbers compare by value, so 1 and 1.0 have the same form.
+
+    :param args: json structure of the effect arguments
+    :return: hashable value
+    """
+    if isinstance(args, dict):
+        return tuple(sorted((str(key), canonical_args(value)) for key, value in args.items()))
+    if isinstance(args, (list, tuple)):
+        return ('[]',) + tuple(canonical_args(value) for value in args)
+    if isinstance(args, (int, float)) and not isinstance(args, bool):
+        return float(args)
+    return args
+
+
+def args_distance(first, second):
+    """
+    Return how far apart two argument values are.
+
+    Numbers are compared relatively to their magnitude, so that a rotation time of 5.0 is closer
+    to 3.0 than to 20.0 whatever the unit; lists add the distances of their values.
+
+    :param first: json value of an argument
+    :param second: json value of the same argument
+    :return: 0.0 for equal values, up to 1.0 per differing number, 1.0 for other differing values
+    """
+    if canonical_args(first) == canonical_args(second):
+        return 0.0
+    numbers = (int, float)
+    if (isinstance(first, numbers) and isinstance(second, numbers)
+            and not isinstance(first, bool) and not isinstance(second, bool)):
+        return min(1.0, abs(first - second) / max(abs(first), abs(second)))
+    if isinstance(first, (list, tuple)) and isinstance(second, (list, tuple)) and len(first) == len(second):
+        return sum(args_distance(value, other) for value, other in zip(first, second))
+    return 1.0
+
+
+class effect_catalog:
+    """Effects of a serverinfo snapshot indexed by (script, canonical arguments)."""
+
+    def __init__(self, effects):
+        """
+        Effect_catalog initializer.
+
+        :param effects: "effects" list of the serverinfo reply
+        """
+        self._effects = list(effects)
+        self._by_key = {}
+        self._by_script = {}
+        self._by_name = {}
+        for effect in self._effects:
+            args = effect.get("args") or {}
+            self._by_key.setdefault((effect.get("script"), canonical_args(args)), effect)
+            self._by_script.setdefault(effect.get("script"), []).append(effect)
+            self._by_name[str(effect["name"])] = effect
+
+    def __len__(self):
+        return len(self._effects)
+
+    def __contains__(self, name):
+        return name in self._by_name
+
+    @property
+    def names(self):
+        """
+        Return the names of the effects.
+
+        :return: list of effect names
+        """
+        return list(self._by_name)
+
+    def effect(self, name):
+        """
+        Return an effect by name.
+
+        :param name: name of the effect
+        :return: json structure of the effect, None if unknown
+        """
+        return self._by_name.get(name)
+
+    def lookup(self, script, args):
+        """
+        Return the effect running a script with exactly these arguments.
+
+        :param script: path of the effect script
+        :param args: json structure of the effect arguments
+        :return: json structure of the effect, None if no effect matches
+        """
+        return self._by_key.get((script, canonical_args(args or {})))
+
+    def resolve(self, script, args):
+        """
+        Return the effect closest to a running effect.
+
+        When no effect has exactly these arguments, the effect of the same script with the fewest
+        differing arguments is returned with the arguments that differ; among those, the effect
+        whose values are the closest (see args_distance), then the first one listed.
+
+        :param script: path of the effect script
+        :param args: json structure of the running effect arguments
+        :return: (effect, differing args) tuple, effect is None if no effect uses the script
+        """
+        args = args or {}
+        effect = self.lookup(script, args)
+        if effect is not None:
+            return effect, {}
+        best, best_diff, best_rank = None, args, None
+        for candidate in self._by_script.get(script, ()):
+            known = candidate.get("args") or {}
+            diff = {key: value for key, value in args.items()
+                    if key not in known or canonical_args(known[key]) != canonical_args(value)}
+            diff.update((key, None) for key in known if key not in args)
+            rank = (len(diff), sum(args_distance(known[key], value) if key in known and key in args else 1.0
+                                   for key, value in diff.items()))
+            if best_rank is None or rank < best_rank:
+                best, best_diff, best_rank = candidate, diff, rank
+        return best, best_diff
@@ -3,25 +3,240 @@ hyperion_client.py module.
 
 Connect to the hyperion json interface and send/receive messages.
 """
+import collections
+import itertools
 import json
+import logging
+import select
 import socket
+import threading
 import time
+from concurrent.futures import CancelledError, Future
+
+from hyperion_catalog import effect_catalog
+from hyperion_encoder import command_encoder, led_bytes, led_data_encoder
+from hyperion_image import IMAGE_SIZE, image_encoder
+from hyperion_metrics import client_metrics
+from hyperion_pacer import frame_pacer
+from hyperion_priorities import COLOR, EFFECT, IMAGE, LEDS, priority_stack
+from hyperion_watcher import hyperion_watcher
+
+_log = logging.getLogger(__name__)
+_encoder = command_encoder()
+
+# part of the duration of a command after which an unchanged frame is sent again as a keyframe
+KEYFRAME_RATIO = 0.5
+# replies matching no command kept for recv_timeout, the oldest are dropped beyond it
+UNMATCHED_REPLIES = 100
+
+
+# bytes from the end of a led data message that hold its command, priority, duration and tan
+_COMMAND_TAIL = 128
+
+
+def _command_name(message):
+    """
+    Return the name of the command of an encoded message.
+
+    :param message: json-formatted message bytes
+    :return: command name, empty string if not found
+    """
+    if isinstance(message, memoryview):
+        # a led data message ends with its command: only its tail is copied
+        name = _command_name(bytes(message[-_COMMAND_TAIL:]))
+        return name if name or len(message) <= _COMMAND_TAIL else _command_name(bytes(message))
+    # the led data messages start with the color values: search from the end
+    start = message.rfind(b'"command":"')
+    if start < 0:
+        return ''
+    start += 11
+    return bytes(message[start:message.find(b'"', start)]).decode('utf-8')
+
+
+def _json_message(command):
+    """
+    Encode a json command.
+
+    :param command: dict of the json command
+    :return: json-formatted message bytes
+    """
+    return json.dumps(command, separators=(',', ':')).encode('utf-8') + b'\n'
+
+
+class hyperion_batch:
+    """
+    Batch of calibration commands.
+
+    The commands are serialized when added, sent in a single write and their replies are
+    collected together::
+
+        with client.batch() as batch:
+            batch.set_correction("default", 255, 240, 230)
+            batch.set_temperature("default", 255, 255, 250)
+        replies = batch.replies
+    """
+
+    def __init__(self, client):
+        """
+        Hyperion_batch initializer.
+
+        :param client: hyperion_client sending the batch
+        """
+        self._client = client
+        self._messages = []
+        self.replies = None
+
+    def __len__(self):
+        return len(self._messages)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.send()
+
+    def add(self, command):
+        """
+        Add a json command.
+
+        :param command: dict of the json command
+        :return: the batch
+        """
+        self._messages.append(_json_message(command))
+        return self
+
+    def set_transform(self, identifier, blacklevel=None, gamma=None, luminanceGain=None, luminanceMinimum=None,
+                      saturationGain=None, saturationLGain=None, threshold=None, valueGain=None, whitelevel=None):
+        """
+        Add a transform command, see hyperion_client.set_transform.
+
+        :return: the batch
+        """
+        self._messages.append(self._client._encode(
+            "transform", identifier=identifier, blacklevel=blacklevel, gamma=gamma, luminanceGain=luminanceGain,
+            luminanceMinimum=luminanceMinimum, saturationGain=saturationGain, saturationLGain=saturationLGain,
+            threshold=threshold, valueGain=valueGain, whitelevel=whitelevel))
+        return self
+
+    def set_correction(self, identifier, red, green, blue):
+        """
+        Add a correction command, see hyperion_client.set_correction.
+
+        :return: the batch
+        """
+        self._messages.append(self._client._encode("correction", identifier=identifier,
+                                                   correctionValues=(red, green, blue)))
+        return self
+
+    def set_temperature(self, identifier, red, green, blue):
+        """
+        Add a temperature command, see hyperion_client.set_temperature.
+
+        :return: the batch
+        """
+        self._messages.append(self._client._encode("temperature", identifier=identifier,
+                                                   correctionValues=(red, green, blue)))
+        return self
+
+    def set_adjustment(self, identifier, redAdjust, greenAdjust, blueAdjust):
+        """
+        Add an adjustment command, see hyperion_client.set_adjustment.
+
+        :return: the batch
+        """
+        self._messages.append(self._client._encode("adjustment", identifier=identifier, redAdjust=redAdjust,
+                                                   greenAdjust=greenAdjust, blueAdjust=blueAdjust))
+        return self
+
+    def send(self, timeout=2):
+        """
+        Send all the commands in a single write and wait for all the replies.
+
+        :param timeout: maximum time in seconds to wait for the replies
+        :return: list of the parsed replies, in the order of the commands
+        """
+        messages, self._messages = self._messages, []
+        if not messages:
+            self.replies = []
+            return self.replies
+        self._client.invalidate_serverinfo()
+        futures = self._client.send_messages(messages)
+        deadline = time.monotonic() + timeout
+        self.replies = [future.result(max(0.0, deadline - time.monotonic())) for future in futures]
+        return self.replies
 
 
 class hyperion_client:
     """Hyperion JSON interface client class."""
 
-    def __init__(self, host='127.0.0.1', port=19444):
+    def __init__(self, host='127.0.0.1', port=19444, info_ttl=1.0, queue_size=64, backoff_min=0.5, backoff_max=30.0,
+                 use_tan=True, metrics=True, reconcile_interval=10.0):
         """
         Hyperion_client initializer.
 
         :param host: ip address of the host
         :param port: port number
+        :param info_ttl: time in seconds a serverinfo snapshot is reused by the accessors
+        :param queue_size: maximum number of commands kept while disconnected, sent on reconnection
+        :param backoff_min: delay in seconds before the first reconnection attempt
+        :param backoff_max: maximum delay in seconds between two reconnection attempts
+        :param use_tan: if True -> tag every command with a "tan" id echoed by the server in its reply
+        :param metrics: if True -> count the commands and measure their latencies (see metrics)
+        :param reconcile_interval: time in seconds after which the local priority stack is reconciled
+                                   with the server in the background when it is queried
         """
         self._host = str(host)
         self._port = int(port)
-        self.__socket = socket.socket()
+        self.__socket = None
         self._connected = False
+        self._connect_timeout = 10
+        self._backoff_min = float(backoff_min)
+        self._backoff_max = float(backoff_max)
+        self._backoff = self._backoff_min
+        self._next_attempt = 0.0
+        self._reconnects = 0
+        self._last_error = None
+        self._queued = collections.deque(maxlen=int(queue_size))
+        self._use_tan = bool(use_tan)
+        self._tan = itertools.count(1)
+        self._requests = {}
+        self._requests_order = collections.deque()
+        self._requests_lock = threading.Lock()
+        self._reader_thread = None
+        self._round_trip_times = {}
+        self._recv_buffer = bytearray()
+        self._unmatched = collections.deque(maxlen=UNMATCHED_REPLIES)
+        self._unmatched_ready = threading.Condition()
+        self._info_ttl = float(info_ttl)
+        self._info = None
+        self._info_time = 0.0
+        self._catalog = None
+        self._catalog_info = None
+        # one encoder per sending thread: an encoder reuses its buffer for every frame
+        self._led_encoders = threading.local()
+        self._send_lock = threading.RLock()
+        self._coalesce = threading.Condition()
+        self._pending_frames = {}
+        self._writer_thread = None
+        self._max_rate = 0.0
+        self._pacer = None
+        self._dropped_frames = 0
+        self._suppress_duplicates = False
+        self._last_frames = {}
+        self._suppressed_frames = 0
+        self._image_size = IMAGE_SIZE
+        self._image_encoder = None
+        # image being encoded by the worker thread, sent before the next command
+        self._image_lock = threading.Lock()
+        self._image_future = None
+        self._color_pipeline = None
+        self._recorder = None
+        self._watcher = None
+        self._metrics = client_metrics() if metrics else None
+        self._stack = priority_stack()
+        self._reconcile_interval = float(reconcile_interval)
+        self._reconcile_thread = None
 
 # -IP-
     @property
@@ -61,6 +276,25 @@ class hyperion_client:
         """
         self._port = int(port)
 
+# -INFO TTL-
+    @property
+    def info_ttl(self):
+        """
+        Return the serverinfo cache time to live.
+
+        :return: time in seconds a serverinfo snapshot is reused
+        """
+        return self._info_ttl
+
+    @info_ttl.setter
+    def info_ttl(self, info_ttl):
+        """
+        Set the serverinfo cache time to live.
+
+        :param info_ttl: time in seconds a serverinfo snapshot is reused (0 disables the cache)
+        """
+        self._info_ttl = float(info_ttl)
+
 # -SOCKET-
 # @property
 # def socket(self):
@@ -84,21 +318,58 @@ class hyperion_client:
 # def connected(self, state):
 #       self._connected = state
 
+    def health(self):
+        """
+        Return the connection health without blocking.
+
+        :return: dict with the connection status, the number of reconnections, the number of queued
+                 commands, the seconds before the next reconnection attempt and the last error
+        """
+        return {"connected": self._connected,
+                "reconnects": self._reconnects,
+                "queued": len(self._queued),
+                "retry_in": 0.0 if self._connected else max(0.0, self._next_attempt - time.monotonic()),
+                "last_error": self._last_error}
+
     def open_connection(self, timeout=10):
         """
         Open a socket connection to the server.
 
+        The commands queued while disconnected are sent once connected.
+
         :param timeout: timeout in seconds
         """
-        if self._connected:
-            return
-        self.__socket.settimeout(timeout)
-        try:
-            self.__socket.connect((self._host, self._port))
+        with self._send_lock:
+            if self._connected:
+                return
+            self._connect_timeout = timeout
+            sock = socket.socket()
+            sock.settimeout(timeout)
+            try:
+                sock.connect((self._host, self._port))
+            except socket.error as exc:
+                sock.close()
+                self._connection_lost(exc)
+                _log.error("Error during connection to %s:%d: %s", self._host, self._port, exc)
+                raise exc
+            if self._last_error is not None:
+                self._reconnects += 1
+                if self._metrics is not None:
+                    self._metrics.reconnected()
+            self.__socket = sock
             self._connected = True
-        except socket.error as exc:
-            print("Error during connection to ", self._host, ":", self._port)
-            raise exc
+            self._backoff = self._backoff_min
+            del self._recv_buffer[:]
+            with self._unmatched_ready:
+                self._unmatched.clear()
+            self.invalidate_serverinfo()
+            self._reader_thread = threading.Thread(target=self._read_replies, args=(sock,),
+                                                   name="hyperion_client reader", daemon=True)
+            self._reader_thread.start()
+            while self._queued:
+                message, tan = self._queued.popleft()
+                if not self.send_message(message, tan=tan):
+                    break
 
     def close_connection(self, clean=False):
         """
@@ -106,101 +377,694 @@ class hyperion_client:
 
         :param clean: if True -> clear all the effects/color on disconnection
         """
-        if self._connected:
-            try:
-                if clean:
-                    self.__socket.send('{"command":"clearall"}\n'.encode('utf-8'))
+        self.disable_coalescing()
+        with self._send_lock:
+            if self._connected:
+                try:
+                    if clean:
+                        self.__socket.send('{"command":"clearall"}\n'.encode('utf-8'))
+                    self.__socket.close()
+                except socket.error as exc:
+                    _log.warning("Could not close socket connection: %s", exc)
+            self.__socket = None
+            self._connected = False
+            self._queued.clear()
+            self._fail_requests(socket.error("Connection closed"))
+
+    def _connection_lost(self, exc):
+        """
+        Drop the socket after an error and schedule the next reconnection attempt.
+
+        :param exc: the socket error
+        """
+        with self._send_lock:
+            if self.__socket is not None:
                 self.__socket.close()
-            except socket.error as exc:
-                print("Could not close socket connection\nMessage: ", exc)
+                self.__socket = None
+            self._connected = False
+            # the traceback would keep the frames (and the message buffers) alive
+            self._last_error = exc.with_traceback(None)
+            self._next_attempt = time.monotonic() + self._backoff
+            self._backoff = min(self._backoff * 2, self._backoff_max)
+            if self._metrics is not None:
+                self._metrics.connection_lost()
+            self._fail_requests(self._last_error)
 
     def recv_timeout(self, timeout=2):
-        """Receive data from socket.
-
-        :param timeout: time period to wait when waiting for hyperion server
-        :return: the received string
-        """
-        # make socket non blocking
-        self.__socket.setblocking(0)
-        # total data partwise in an array
-        total_data = []
-        data = ''
-        # beginning time
-        begin = time.time()
-        while 1:
-            # if you got some data, then break after timeout
-            if total_data and time.time() - begin > timeout:
-                break
-            # if you got no data at all, wait twice the timeout
-            elif time.time() - begin > timeout * 2:
-                break
-            # recv something
-            try:
-                data = self.__socket.recv(8192)
-                if data:
-                    total_data.append(data.decode("utf-8"))
-                    # change the beginning time for measurement
-                    begin = time.time()
-                else:
-                    # sleep for sometime to indicate a gap
-                    time.sleep(0.1)
-            except:
-                pass
-        # join all parts to make final string
-        return ''.join(total_data)
+        """Receive the next reply line from socket.
+
+        While the reader thread of the connection runs, the replies to the commands sent by
+        send_message resolve their futures: the next reply matching no pending command (e.g. the
+        reply to data written by another path) is returned instead.
+
+        :param timeout: maximum time in seconds to wait for a complete reply
+        :return: the received string (without the trailing newline), empty string on timeout
+        """
+        sock = self.__socket
+        if sock is None:
+            raise socket.error("Not connected to the hyperion server")
+        reader = self._reader_thread
+        if reader is not None and reader.is_alive():
+            with self._unmatched_ready:
+                self._unmatched_ready.wait_for(lambda: self._unmatched, timeout)
+                return self._unmatched.popleft() if self._unmatched else ''
+        return self._recv_line(sock, self._recv_buffer, timeout)
+
+    @staticmethod
+    def _recv_line(sock, buffer, timeout):
+        """
+        Receive the next reply line from a socket.
+
+        Hyperion terminates every json reply with a newline: bytes are read into a buffer
+        until a complete line is available, the remaining bytes are kept for the next reply.
+
+        :param sock: socket to read
+        :param buffer: bytearray of the bytes received after the last line of this socket
+        :param timeout: maximum time in seconds to wait for a complete reply
+        :return: the received string (without the trailing newline), empty string on timeout
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            end = buffer.find(b'\n')
+            if end >= 0:
+                line = bytes(buffer[:end])
+                del buffer[:end + 1]
+                return line.decode('utf-8')
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return ''
+            # block until the socket is readable instead of polling it
+            readable, _, _ = select.select([sock], [], [], remaining)
+            if not readable:
+                return ''
+            data = sock.recv(65536)
+            if not data:
+                raise socket.error("Connection closed by the hyperion server")
+            buffer += data
 
     def test_connection(self):
         """
         Open socket connection to the server (if not already open).
 
+        While the reconnection backoff delay runs, return immediately instead of connecting.
+
         :return: boolean value of the connection status. True if connected
         """
-        if not self._connected:
-            print("Not connected to Hyperion server: autoconnecting...")
-            self.open_connection()
+        if not self._connected and time.monotonic() >= self._next_attempt:
+            _log.info("Not connected to Hyperion server: autoconnecting...")
+            try:
+                self.open_connection(self._connect_timeout)
+            except socket.error:
+                pass
         return self._connected
 
-    def send_message(self, message):
+    def send_message(self, message, queue=True, tan=None):
         """Send data to socket.
 
-        :param message: json-formatted message
+        :param message: json-formatted message (str or bytes-like), a message already tagged with its
+                        tan is sent without being copied
+        :param queue: if True -> keep the message for the reconnection when it cannot be sent
+        :param tan: tan the message is tagged with (see led_data_encoder.encode), None -> tag it
+        :return: future of the parsed reply of the server if the message was sent, otherwise None
+        """
+        if isinstance(message, str):
+            message = message.encode('utf-8')
+        with self._send_lock:
+            if self.test_connection():
+                future, tagged = self._register_request(message, tan)
+                try:
+                    self.__socket.sendall(tagged)
+                    if self._metrics is not None:
+                        self._metrics.sent(future.command, len(tagged), time.perf_counter() - future.sent_time)
+                    return future
+                except socket.error as exc:
+                    _log.error("Error while sending the data: %s", exc)
+                    self._connection_lost(exc)
+            if queue:
+                # copied, the buffer of the message may be reused; kept with its tan (None -> the
+                # message gets one when it is flushed on reconnection), so it is never tagged twice
+                self._queued.append((bytes(message), tan))
+            return None
+
+    def send_messages(self, messages):
+        """Send several messages in a single write.
+
+        :param messages: list of json-formatted messages (str or bytes-like)
+        :return: list of the futures of the parsed replies of the server
+        """
+        messages = [message.encode('utf-8') if isinstance(message, str) else bytes(message) for message in messages]
+        with self._send_lock:
+            if not self.test_connection():
+                raise socket.error("Not connected to the hyperion server")
+            futures = []
+            tagged = []
+            for message in messages:
+                future, message = self._register_request(message)
+                futures.append(future)
+                tagged.append(message)
+            try:
+                self.__socket.sendall(b''.join(tagged))
+            except socket.error as exc:
+                _log.error("Error while sending the data: %s", exc)
+                self._connection_lost(exc)
+            else:
+                if self._metrics is not None and futures:
+                    # a single write: its time is shared by the messages
+                    seconds = (time.perf_counter() - futures[0].sent_time) / len(futures)
+                    for future, message in zip(futures, tagged):
+                        self._metrics.sent(future.command, len(message), seconds)
+            return futures
+
+    def _register_request(self, message, tan=None):
+        """
+        Register the future of the reply to a message and tag the message with its tan.
+
+        :param message: json-formatted message bytes-like
+        :param tan: tan the message is already tagged with, None -> tag it with a new one
+        :return: (future, message to send) tuple
+        """
+        future = Future()
+        future.command = _command_name(message)
+        if tan is None:
+            tan = next(self._tan)
+            if self._use_tan:
+                if not isinstance(message, (bytes, bytearray)):
+                    message = bytes(message)
+                # every message is a json object followed by a newline
+                message = b'%s,"tan":%d}\n' % (message[:message.rindex(b'}')], tan)
+        with self._requests_lock:
+            self._requests[tan] = future
+            self._requests_order.append(tan)
+        future.sent_time = time.perf_counter()
+        return future, message
+
+    def request(self, command, timeout=2):
+        """
+        Send a command and wait for its reply.
+
+        :param command: dict of the json command
+        :param timeout: maximum time in seconds to wait for the reply
+        :return: parsed reply of the server
+        """
+        future = self.send_message(_json_message(command), queue=False)
+        if future is None:
+            raise socket.error("Not connected to the hyperion server")
+        return future.result(timeout)
+
+    @property
+    def round_trip_times(self):
+        """
+        Return the last measured round trip times.
+
+        :return: dict of command name -> round trip time in seconds of its last reply
+        """
+        return dict(self._round_trip_times)
+
+    @property
+    def pending_requests(self):
+        """
+        Return the number of commands waiting for their reply.
+
+        :return: number of pending commands
+        """
+        return len(self._requests)
+
+    def _read_replies(self, sock):
+        """
+        Reader thread: resolve the futures of the commands with the replies of the server.
+
+        A reply carrying a known "tan" resolves the command with that tan, any other reply resolves
+        the oldest pending command (the server answers the commands in order).
+
+        :param sock: socket of the connection the thread reads
+        """
+        # the buffer of this connection only: a reader never consumes the replies of another socket
+        buffer = bytearray()
+        while self.__socket is sock:
+            try:
+                line = self._recv_line(sock, buffer, 0.5)
+            except (socket.error, ValueError) as exc:
+                if self.__socket is sock:
+                    self._connection_lost(exc)
+                return
+            if not line:
+                continue
+            try:
+                reply = json.loads(line)
+            except ValueError:
+                _log.warning("Invalid reply from the hyperion server: %s", line[:100])
+                continue
+            tan = reply.get("tan") if isinstance(reply, dict) else None
+            with self._requests_lock:
+                future = self._requests.pop(tan, None)
+                if future is not None:
+                    if self._requests_order and self._requests_order[0] == tan:
+                        self._requests_order.popleft()
+                    else:
+                        self._requests_order.remove(tan)
+                else:
+                    while self._requests_order and future is None:
+                        future = self._requests.pop(self._requests_order.popleft(), None)
+            if future is None:
+                with self._unmatched_ready:
+                    self._unmatched.append(line)
+                    self._unmatched_ready.notify()
+                continue
+            future.round_trip_time = time.perf_counter() - future.sent_time
+            self._round_trip_times[future.command] = future.round_trip_time
+            if self._metrics is not None:
+                self._metrics.replied(future.command, future.round_trip_time)
+                if isinstance(reply, dict) and not reply.get("success", True):
+                    self._metrics.failed(future.command)
+            future.set_result(reply)
+
+    def _fail_requests(self, exc):
+        """
+        Fail the commands that will never get a reply.
+
+        :param exc: exception set on their futures
+        """
+        with self._requests_lock:
+            futures = list(self._requests.values())
+            self._requests.clear()
+            self._requests_order.clear()
+        for future in futures:
+            if self._metrics is not None:
+                self._metrics.failed(future.command)
+            future.set_exception(exc)
+
+# -COALESCING-
+    @property
+    def coalescing(self):
+        """
+        Return coalescing status.
+
+        :return: True if the color frames are sent by the background writer
+        """
+        return self._writer_thread is not None
+
+    @property
+    def dropped_frames(self):
+        """
+        Return the number of frames dropped by the coalescing writer.
+
+        :return: number of pending frames replaced by a newer frame before being sent
+        """
+        return self._dropped_frames
+
+    def pacing_stats(self):
+        """
+        Return the pacing statistics of the coalescing writer.
+
+        :return: dict of hyperion_pacer.frame_pacer.stats, None if no frame was paced
+        """
+        pacer = self._pacer
+        return pacer.stats() if pacer is not None else None
+
+    def enable_coalescing(self, max_rate=60.0):
+        """
+        Send the color frames from a background writer at a maximum rate.
+
+        Only the newest pending frame of each priority is kept, older frames are dropped.
+
+        :param max_rate: maximum number of frames per second sent for each priority
+        """
+        with self._coalesce:
+            self._max_rate = float(max_rate)
+            if self._writer_thread is not None:
+                return
+            self._writer_thread = threading.Thread(target=self._write_frames, name="hyperion_client writer",
+                                                   daemon=True)
+            self._writer_thread.start()
+
+    def disable_coalescing(self):
+        """Stop the background writer after sending the pending frames."""
+        with self._coalesce:
+            thread = self._writer_thread
+            self._writer_thread = None
+            self._coalesce.notify()
+        if thread is not None:
+            thread.join()
+
+    def _queue_frame(self, priority, message, led_data=None, tan=None):
+        """
+        Replace the pending frame of a priority.
+
+        :param priority: priority value of the frame
+        :param message: encoded message of the frame
+        :param led_data: led data bytes recorded when the frame is sent, None -> not recorded
+        :param tan: tan the message is tagged with, None -> tagged when sent
+        """
+        with self._coalesce:
+            if priority in self._pending_frames:
+                self._dropped_frames += 1
+            self._pending_frames[priority] = (bytes(message), led_data, tan)
+            self._coalesce.notify()
+
+    def _drop_frames(self, priority=None):
+        """
+        Discard pending frames, so they are not sent after a clear command.
+
+        :param priority: priority of the frames to drop, None -> all priorities
+        """
+        with self._coalesce:
+            if priority is None:
+                self._pending_frames.clear()
+            else:
+                self._pending_frames.pop(priority, None)
+
+    def _write_frames(self):
+        """Background writer: send the pending frames, at most max_rate times per second."""
+        while True:
+            with self._coalesce:
+                idle = not self._pending_frames
+                while not self._pending_frames and self._writer_thread is not None:
+                    self._coalesce.wait()
+                stopping = self._writer_thread is None
+                max_rate = self._max_rate
+            if max_rate > 0 and not stopping:
+                if self._pacer is None or self._pacer.fps != max_rate:
+                    self._pacer = frame_pacer(max_rate)
+                elif idle:
+                    # a frame after a pause is sent at once, not at the slot it would have had
+                    self._pacer.resync()
+                # wait for the next slot, the frames queued meanwhile replace each other
+                self._pacer.wait()
+            with self._coalesce:
+                frames = list(self._pending_frames.items())
+                self._pending_frames.clear()
+            for priority, (message, led_data, tan) in frames:
+                self._send_frame(priority, message, led_data, tan)
+            if stopping:
+                return
+
+    def _send_frame(self, priority, message, led_data=None, tan=None):
+        """
+        Send a frame and record its led data once written to the socket.
+
+        :param priority: priority value of the frame
+        :param message: encoded message of the frame
+        :param led_data: led data of the frame, None -> not recorded
+        :param tan: tan the message is tagged with, None -> tagged when sent
+        :return: future of the reply of the server, None if not sent
+        """
+        future = self.send_message(message, tan=tan)
+        recorder = self._recorder
+        if future is not None and led_data is not None and recorder is not None:
+            recorder.record(led_data, priority)
+        return future
+
+# -DUPLICATE FRAMES-
+    @property
+    def suppress_duplicates(self):
+        """
+        Return duplicate frames suppression status.
+
+        :return: True if the frames identical to the last one sent on their priority are skipped
+        """
+        return self._suppress_duplicates
+
+    @suppress_duplicates.setter
+    def suppress_duplicates(self, enable):
+        """
+        Enable or disable the duplicate frames suppression.
+
+        An unchanged frame is still sent as a keyframe once KEYFRAME_RATIO of its duration
+        elapsed, so that its priority does not time out.
+
+        :param enable: True -> skip the frames identical to the last one sent on their priority
+        """
+        self._suppress_duplicates = bool(enable)
+        self._last_frames.clear()
+
+    @property
+    def suppressed_frames(self):
+        """
+        Return the number of suppressed frames.
+
+        :return: number of frames skipped because identical to the previous one
+        """
+        return self._suppressed_frames
+
+    def _is_duplicate(self, priority, frame, duration):
+        """
+        Check a frame against the last frame sent on its priority and remember it.
+
+        :param priority: priority value of the frame
+        :param frame: hashable content of the frame
+        :param duration: duration in milliseconds of the frame
+        :return: True if the frame can be skipped
+        """
+        if not self._suppress_duplicates:
+            return False
+        now = time.monotonic()
+        last = self._last_frames.get(priority)
+        if last is not None and last[0] == duration and last[1] == frame:
+            if duration <= 0 or now - last[2] < duration / 1000.0 * KEYFRAME_RATIO:
+                self._suppressed_frames += 1
+                return True
+        self._last_frames[priority] = (duration, frame, now)
+        return False
+
+    def _forget_frames(self, priority=None):
+        """
+        Forget the last frames sent, after another command changed their priority.
+
+        :param priority: priority of the frame to forget, None -> all priorities
+        """
+        if priority is None:
+            self._last_frames.clear()
+        else:
+            self._last_frames.pop(priority, None)
+
+# -COLOR PIPELINE-
+    @property
+    def color_pipeline(self):
+        """
+        Return the color pipeline applied to the led data.
+
+        :return: hyperion_color.color_pipeline, None if the led data is sent unchanged
+        """
+        return self._color_pipeline
+
+    @color_pipeline.setter
+    def color_pipeline(self, pipeline):
+        """
+        Set the color pipeline applied to the led data before it is sent.
+
+        Use it to calibrate the leds on the client, e.g. when the server transform is left neutral.
+
+        :param pipeline: hyperion_color.color_pipeline, or any callable mapping the led data to a
+                         numpy uint8 array, None -> send the led data unchanged
+        """
+        self._color_pipeline = pipeline
+        self._last_frames.clear()
+
+# -RECORDING-
+    @property
+    def recorder(self):
+        """
+        Return the recorder of the led data.
+
+        :return: hyperion_recording.frame_recorder, None if not recording
+        """
+        return self._recorder
+
+    @recorder.setter
+    def recorder(self, recorder):
+        """
+        Record the led data sent, with their priority as channel.
+
+        The frames are recorded after the color pipeline and the duplicate frames suppression, when
+        they are written to the socket: a frame dropped by the coalescing writer or queued while
+        disconnected is not recorded.
+
+        :param recorder: hyperion_recording.frame_recorder, None -> stop recording
+        """
+        self._recorder = recorder
+
+# -IMAGES-
+    @property
+    def image_size(self):
+        """
+        Return the size of the images sent.
+
+        :return: (width, height) maximum size of the raw images sent, None if not downscaled
+        """
+        return self._image_size
+
+    @image_size.setter
+    def image_size(self, size):
+        """
+        Set the size of the images sent.
+
+        :param size: (width, height) maximum size of the raw images sent, None -> no downscaling
+        """
+        self._image_size = tuple(size) if size is not None else None
+        if self._image_encoder is not None:
+            self._image_encoder.size = self._image_size
+
+    def image_encoder(self):
+        """
+        Return the encoder of the raw images, started on first use.
+
+        :return: hyperion_image.image_encoder
+        """
+        if self._image_encoder is None:
+            self._image_encoder = image_encoder(self._image_size)
+        return self._image_encoder
+
+    def image_stats(self):
+        """
+        Return the raw images encoding statistics.
+
+        :return: dict with the number of frames, the frames replaced by a newer image before being
+                 encoded, the encode time per frame and the achieved fps
+        """
+        return self.image_encoder().stats()
+
+# -METRICS-
+    @property
+    def metrics(self):
+        """
+        Return the metrics of the commands.
+
+        Use metrics.snapshot() for a dict or metrics.prometheus() for the Prometheus text format.
+        The encoding of the raw images by the worker thread is measured by image_stats.
+
+        :return: hyperion_metrics.client_metrics, None if disabled
+        """
+        return self._metrics
+
+    def _encode(self, command, **values):
         """
+        Encode a command and measure its encode time.
+
+        :param command: command name
+        :param values: values of the fields of the command
+        :return: json-formatted message bytes
+        """
+        if self._metrics is None:
+            return _encoder.encode(command, **values)
+        begin = time.perf_counter()
+        message = _encoder.encode(command, **values)
+        self._metrics.encoded(command, time.perf_counter() - begin)
+        return message
+
+# -PRIORITIES-
+    @property
+    def priority_stack(self):
+        """
+        Return the local mirror of the priority stack of the server.
+
+        :return: hyperion_priorities.priority_stack
+        """
+        return self._stack
+
+    def _reconcile_stack(self):
+        """Reconcile the priority stack with the server in the background when it is due."""
+        reconciled = self._stack.reconciled
+        if (not self._connected or (self._reconcile_thread is not None and self._reconcile_thread.is_alive())
+                or (reconciled is not None and time.monotonic() - reconciled < self._reconcile_interval)):
+            return
+        self._reconcile_thread = threading.Thread(target=self._reconcile_worker, name="hyperion_client reconcile",
+                                                  daemon=True)
+        self._reconcile_thread.start()
+
+    def _reconcile_worker(self):
         try:
-            self.__socket.sendall(message.encode('utf-8'))
-        except socket.error as exc:
-            print("Error while sending the data\nMessage: ", exc)
+            self.serverinfo(refresh=True)
+        except Exception as exc:
+            _log.warning("Could not reconcile the priority stack: %s", exc)
+
+    def visible_priority(self):
+        """
+        Get the priority shown on the leds, from the local priority stack.
+
+        :return: dict with the priority, the kind ("color", "leds", "effect", "image" or "unknown"),
+                 the value, the seconds before expiry (None if no duration) and whether this client
+                 set it, None if no priority is set
+        """
+        self._reconcile_stack()
+        entry = self._stack.visible()
+        return entry.as_dict() if entry is not None else None
+
+    def priority_expires_in(self, priority=100):
+        """
+        Get the time before a priority expires, from the local priority stack.
+
+        :param priority: priority value
+        :return: seconds, None if the priority is not set or has no duration
+        """
+        self._reconcile_stack()
+        return self._stack.expires_in(priority)
+
+# -WATCHER-
+    def watch(self, callback=None, min_interval=0.1, max_interval=2.0):
+        """
+        Return the state watcher of the server, started on first use.
+
+        The watcher polls the serverinfo on its own connection, so it never waits behind the commands
+        of this client, and is shared by all the callers: subscribe callbacks to it or iterate over
+        its events() in an event loop.
+
+        :param callback: function called with every change event, None -> only return the watcher
+        :param min_interval: polling interval in seconds after a change (first call only)
+        :param max_interval: maximum polling interval in seconds while idle (first call only)
+        :return: hyperion_watcher.hyperion_watcher
+        """
+        if self._watcher is None:
+            self._watcher = hyperion_watcher(self._host, self._port, min_interval, max_interval)
+        if callback is not None:
+            self._watcher.subscribe(callback)
+        self._watcher.start()
+        return self._watcher
+
+    def unwatch(self):
+        """Stop the state watcher of the server."""
+        if self._watcher is not None:
+            self._watcher.stop()
+            self._watcher = None
 
 ###############################################################################
 
-    def response_serverinfo(self):
+    def response_serverinfo(self, timeout=2):
         """
-        Get responses to the latest commands sent and all the other infos from the hyperion json server.
+        Get all the infos from the hyperion json server.
 
+        :param timeout: maximum time in seconds to wait for the reply
         :return: json structure containing infos from the hyperion json server
         """
-        if not self.test_connection():
-            return
-        resp = ''
-        # create a message to send
-        message = '{"command":"serverinfo"}\n'
-        self.send_message(message)
-        try:
-            resp = self.recv_timeout()
-        except socket.error as exc:
-            print("Error while receiving the data\nMessage: ", exc)
-        return resp
+        future = self.send_message(self._encode("serverinfo"), queue=False)
+        if future is None:
+            raise socket.error("Not connected to the hyperion server")
+        reply = future.result(timeout)
+        if not reply.get("success", True) or "info" not in reply:
+            raise socket.error("Serverinfo request failed: %s" % reply.get("error"))
+        return reply
 
-    def serverinfo(self):
+    def serverinfo(self, refresh=False):
         """
         Get informations from the hyperion json server.
 
+        The parsed reply is cached for info_ttl seconds and shared by all the accessors.
+
+        :param refresh: if True -> ignore the cached snapshot and query the server
         :return: json structure containing infos from the hyperion json server
         """
-        resp = self.response_serverinfo()
-        info = resp[resp.find('{"info":{'):]
-        parsed = json.loads(info)
+        if not refresh and self._info is not None and time.monotonic() - self._info_time < self._info_ttl:
+            return self._info
+        requested = time.monotonic()
+        parsed = self.response_serverinfo()
+        self._info = parsed
+        self._info_time = time.monotonic()
+        self._stack.reconcile(parsed["info"], requested)
         return parsed
 
+    def invalidate_serverinfo(self):
+        """Drop the cached serverinfo snapshot, the next accessor call queries the server."""
+        self._info = None
+
     def effects(self):
         """
         Get all the effects from the hyperion json server.
@@ -229,28 +1093,47 @@ class hyperion_client:
         """
         return self.serverinfo()["info"]["activeEffects"]
 
+    def effect_catalog(self):
+        """
+        Get the effects of the current serverinfo snapshot indexed for name resolution.
+
+        The catalog is built once per snapshot.
+
+        :return: effect_catalog of the hyperion effects
+        """
+        info = self.serverinfo()
+        if self._catalog is None or self._catalog_info is not info:
+            self._catalog = effect_catalog(info["info"]["effects"])
+            self._catalog_info = info
+        return self._catalog
+
+    def active_effects_resolved(self):
+        """
+        Resolve all the active effects to the known effects.
+
+        An active effect running with custom args is resolved to the effect of the same script
+        with the closest args.
+
+        :return: array of dicts with the priority, the name (None if no effect uses the script),
+                 the script and the args differing from the named effect
+        """
+        catalog = self.effect_catalog()
+        resolved = []
+        for active in self.serverinfo()["info"]["activeEffects"]:
+            effect, diff = catalog.resolve(active["script"], active.get("args"))
+            resolved.append({"priority": int(active["priority"]),
+                             "name": str(effect["name"]) if effect is not None else None,
+                             "script": active["script"],
+                             "args": diff})
+        return resolved
+
     def active_effects_names(self):
         """
         Get the name of all the active effects from hyperion.
 
-        :return: array of active effects names
-        """
-        effect_list = []
-        priority_list = []
-        parsed = self.serverinfo()
-        activeEffects = parsed["info"]["activeEffects"]
-        if activeEffects:
-            for i in range(len(activeEffects)):
-                args = activeEffects[i]["args"]
-                path = activeEffects[i]["script"]
-                for e in parsed["info"]["effects"]:
-                    if (e["args"] == args) and (e["script"] == path):
-                        effect_list.append(str(e["name"]))
-                        priority_list.append(int(activeEffects[i]["priority"]))
-            if len(effect_list) != len(activeEffects):
-                s = json.dumps(activeEffects, indent=4, sort_keys=True)
-                raise NameError("Cannot find a name for some of the current effects\nYou may be using custom args\n", s)
-        return effect_list
+        :return: array of active effects names (closest known effect for custom args)
+        """
+        return [active["name"] for active in self.active_effects_resolved()]
 
     def active_color(self, mode=None):
         """
@@ -262,11 +1145,11 @@ class hyperion_client:
         activeColor = self.serverinfo()["info"]["activeLedColor"]
         if activeColor:
             if str(mode) == "RGB":
-                return self.active_color()[0]["RGB Value"]
+                return activeColor[0]["RGB Value"]
             elif str(mode) == "HEX":
-                return self.active_color()[0]["HEX Value"]
+                return activeColor[0]["HEX Value"]
             elif str(mode) == "HLS":
-                return self.active_color()[0]["HLS Value"]
+                return activeColor[0]["HLS Value"]
         return activeColor
 
     # def current():
@@ -339,16 +1222,16 @@ class hyperion_client:
         :param priority: priority value
         :param duration: duration in milliseconds
         """
-        if not self.test_connection():
-            return
         # create a message to send
-        message = '{"command":"color", "priority":' + str(priority) + ', '
-        message += '"color":[' + str(red) + ',' + str(green) + ',' + str(blue) + ']'
-        if duration > 0:
-            message += ', "duration":' + str(duration)
-        message += '}\n'
-        print(message)
-        self.send_message(message)
+        message = self._encode("color", priority=priority, color=(red, green, blue), duration=duration)
+        self._flush_image()
+        self._forget_frames(priority)
+        self.invalidate_serverinfo()
+        self._stack.set(priority, COLOR, (red, green, blue), duration)
+        if self._writer_thread is not None:
+            self._queue_frame(priority, message)
+        else:
+            self.send_message(message)
 
     def set_effect(self, effectName, priority=100, effectArgs=None, duration=0):
         """
@@ -359,17 +1242,13 @@ class hyperion_client:
         :param effectArgs: Custom arguments for the effect
         :param duration: duration in milliseconds
         """
-        if not self.test_connection():
-            return
         # create a message to send
-        message = '{"command":"effect","effect":{"name":"' + str(effectName)
-        if effectArgs:
-            message += '", "args":' + str(effectArgs)
-        message += '"},"priority":' + str(priority)
-        if duration > 0:
-            message += ', "duration":' + str(duration)
-        message += '}\n'
-        print(message)
+        message = self._encode("effect", effectName=effectName, effectArgs=effectArgs or None, priority=priority,
+                               duration=duration)
+        self._flush_image()
+        self._forget_frames(priority)
+        self.invalidate_serverinfo()
+        self._stack.set(priority, EFFECT, effectName, duration)
         self.send_message(message)
 
     def clear(self, priority=100):
@@ -378,43 +1257,108 @@ class hyperion_client:
 
         :param priority: clear priority value
         """
-        if not self.test_connection():
-            return
         # create a message to send
-        message = '{"command":"clear","priority":' + priority + '}\n'
+        message = self._encode("clear", priority=priority)
+        self._flush_image()
+        self._drop_frames(priority)
+        self._forget_frames(priority)
+        self.invalidate_serverinfo()
+        self._stack.clear(priority)
         self.send_message(message)
 
     def clear_all(self):
         """Clear all the effects/color."""
-        if not self.test_connection():
-            return
         # create a message to send
-        message = '{"command":"clearall"}\n'
+        message = self._encode("clearall")
+        self._flush_image()
+        self._drop_frames()
+        self._forget_frames()
+        self.invalidate_serverinfo()
+        self._stack.clear_all()
         self.send_message(message)
 
-    def set_image(self, image_data, width, height, priority=100, duration=0):
+    def set_image(self, image_data, width, height, priority=100, duration=0, block=False):
         """
         Set leds to the color of the image border.
 
-        :param image_data: base64 RGB888 image data
+        Raw images are downscaled to image_size and encoded by a worker thread unless block is True.
+
+        :param image_data: base64 RGB888 image data (str), or raw RGB888 image data as bytes-like or
+                           numpy uint8 array
         :param width: width of the image
         :param height: height of the image
         :param priority: priority value
         :param duration: duration in milliseconds
-        """
-        if not self.test_connection():
+        :param block: if True -> encode a raw image in the calling thread
+        """
+        if not isinstance(image_data, str):
+            if self._suppress_duplicates and self._is_duplicate(
+                    priority, ("image", width, height, bytes(led_bytes(image_data))), duration):
+                return
+            encoder = self.image_encoder()
+            if block:
+                message = encoder.encode(image_data, width, height, priority, duration)
+                self._flush_image()
+                self.invalidate_serverinfo()
+                self._stack.set(priority, IMAGE, (width, height), duration)
+                self.send_message(message)
+                return
+            # the worker reads the image later: the caller may reuse its buffer meanwhile
+            image_copy = image_data.copy() if hasattr(image_data, 'copy') else bytes(image_data)
+            # a waiting image replaced by this one is cancelled by the encoder
+            future = encoder.submit(image_copy, width, height, priority, duration)
+            # the stack is updated when the image is sent, not if its encoding fails
+            future.image = (priority, width, height, duration)
+            with self._image_lock:
+                self._image_future = future
+            future.add_done_callback(self._send_encoded_image)
+            return
+        if self._is_duplicate(priority, ("image", width, height, str(image_data)), duration):
             return
         # create a message to send
-        message = '{"command":"image","imagewidth":' + str(width)
-        message += ',"imageheight":' + str(height)
-        message += ',"imagedata":' + str(image_data)
-        message += ',"priority":' + str(priority)
-        if duration > 0:
-            message += ', "duration":' + str(duration)
-        message += '}\n'
-        # print(message)
+        message = self._encode("image", width=width, height=height, image_data=image_data, priority=priority,
+                               duration=duration)
+        self._flush_image()
+        self.invalidate_serverinfo()
+        self._stack.set(priority, IMAGE, (width, height), duration)
         self.send_message(message)
 
+    def _send_encoded_image(self, future):
+        """
+        Send an image encoded by the worker thread, unless a newer image replaced it.
+
+        Called by the worker when the encoding is done and by _flush_image: the image is sent once.
+
+        :param future: future of the encoded message
+        """
+        with self._image_lock:
+            if future is not self._image_future:
+                # replaced, or already sent by the other caller
+                return
+            self._image_future = None
+            if future.cancelled():
+                return
+            try:
+                message = future.result()
+            except Exception as exc:
+                _log.error("Error while encoding the image: %s", exc)
+                return
+            priority, width, height, duration = future.image
+            self.invalidate_serverinfo()
+            self._stack.set(priority, IMAGE, (width, height), duration)
+            self.send_message(message)
+
+    def _flush_image(self):
+        """Send the image being encoded by the worker thread, so that a later command does not overtake it."""
+        future = self._image_future
+        if future is None:
+            return
+        try:
+            future.exception()
+        except CancelledError:
+            pass
+        self._send_encoded_image(future)
+
     def set_transform(self, identifier, blacklevel, gamma, luminanceGain, luminanceMinimum, saturationGain, saturationLGain, threshold, valueGain, whitelevel):
         """
         Send the transform values to the hyperion json server.
@@ -429,25 +1373,13 @@ class hyperion_client:
         :param threshold: threshold
         :param valueGain: value gain
         :param whitelevel: white level value
-        :return:
+        :return: future of the reply of the server, None if not sent
         """
-        if not self.test_connection():
-            return
-        # create a message to send
-        message = '{"command":"transform","transform":{'
-        message += '"blacklevel":[' + str(blacklevel[0]) + ',' + str(blacklevel[1]) + ',' + str(blacklevel[2])
-        message += '],"gamma":[' + str(gamma[0]) + ',' + str(gamma[1]) + ',' + str(gamma[2])
-        message += '],"id":"' + str(identifier)
-        message += '","luminanceGain:"' + str(luminanceGain) + ''
-        message += ',"luminanceMinimum:"' + str(luminanceMinimum) + ''
-        message += ',"saturationGain:"' + str(saturationGain) + ''
-        message += ',"saturationLGain:"' + str(saturationLGain) + ''
-        message += '],"threshold":[' + str(threshold[0]) + ',' + str(threshold[1]) + ',' + str(threshold[2])
-        message += '],"valueGain:"' + str(valueGain) + ''
-        message += '],"whitelevel":[' + str(whitelevel[0]) + ',' + str(whitelevel[1]) + ',' + str(whitelevel[2])
-        message += '}}\n'
-        # print(message)
-        self.send_message(message)
+        self.invalidate_serverinfo()
+        return self.send_message(self._encode(
+            "transform", identifier=identifier, blacklevel=blacklevel, gamma=gamma, luminanceGain=luminanceGain,
+            luminanceMinimum=luminanceMinimum, saturationGain=saturationGain, saturationLGain=saturationLGain,
+            threshold=threshold, valueGain=valueGain, whitelevel=whitelevel))
 
     def set_correction(self, identifier, red, green, blue):
         """
@@ -457,16 +1389,11 @@ class hyperion_client:
         :param red: red value in RGB format [0-255]
         :param green: green value in RGB format [0-255]
         :param blue: blue value in RGB format [0-255]
+        :return: future of the reply of the server, None if not sent
         """
-        if not self.test_connection():
-            return
-        # create a message to send
-        message = '{"command":"correction","correction":{'
-        message += '"correctionValues":[' + str(red) + ',' + str(green) + ',' + str(blue)
-        message += '],"id":"' + str(identifier)
-        message += '"}}\n'
-        # print(message)
-        self.send_message(message)
+        self.invalidate_serverinfo()
+        return self.send_message(self._encode("correction", identifier=identifier,
+                                              correctionValues=(red, green, blue)))
 
     def set_temperature(self, identifier, red, green, blue):
         """
@@ -476,16 +1403,11 @@ class hyperion_client:
         :param red: red value in RGB format [0-255]
         :param green: green value in RGB format [0-255]
         :param blue: blue value in RGB format [0-255]
+        :return: future of the reply of the server, None if not sent
         """
-        if not self.test_connection():
-            return
-        # create a message to send
-        message = '{"command":"temperature","temperature":{'
-        message += '"correctionValues":[' + str(red) + ',' + str(green) + ',' + str(blue)
-        message += '],"id":"' + str(identifier)
-        message += '"}}\n'
-        # print(message)
-        self.send_message(message)
+        self.invalidate_serverinfo()
+        return self.send_message(self._encode("temperature", identifier=identifier,
+                                              correctionValues=(red, green, blue)))
 
     def set_adjustment(self, identifier, redAdjust, greenAdjust, blueAdjust):
         """
@@ -495,40 +1417,50 @@ class hyperion_client:
         :param redAdjust: value of the red adjustment in RGB format [0-255]
         :param greenAdjust: value of the green adjustment in RGB format [0-255]
         :param blueAdjust: value of the blue adjustment in RGB format [0-255]
+        :return: future of the reply of the server, None if not sent
         """
-        if not self.test_connection():
-                        return
-        # create a message to send
-        message = '{"command":"adjustment","adjustment":{"id":"' + str(identifier)
-        message += '","redAdjust":[' + str(redAdjust[0]) + ',' + str(redAdjust[1]) + ',' + str(redAdjust[2])
-        message += '],"greenAdjust":[' + str(greenAdjust[0]) + ',' + str(greenAdjust[1]) + ',' + str(greenAdjust[2])
-        message += '],"blueAdjust":[' + str(blueAdjust[0]) + ',' + str(blueAdjust[1]) + ',' + str(blueAdjust[2])
-        message += ']}}\n'
-        # print(message)
-        self.send_message(message)
+        self.invalidate_serverinfo()
+        return self.send_message(self._encode("adjustment", identifier=identifier, redAdjust=redAdjust,
+                                              greenAdjust=greenAdjust, blueAdjust=blueAdjust))
+
+    def batch(self):
+        """
+        Create a batch of commands sent in a single write.
+
+        :return: hyperion_batch bound to this client
+        """
+        return hyperion_batch(self)
 
     def send_led_data(self, led_data, priority=100, duration=0):
         """
         Send the led data in a message format that hyperion can understand.
 
-        :param led_data: bytearray of the led data (r,g,b) * hyperion.ledcount
+        :param led_data: led data (r,g,b) * hyperion.ledcount as bytes, bytearray, memoryview,
+                         numpy uint8 array or sequence of ints
         :param priority: priority value
         :param duration: duration in milliseconds
         """
-        if not self.test_connection():
+        if self._color_pipeline is not None:
+            led_data = self._color_pipeline(led_data)
+        if self._suppress_duplicates and self._is_duplicate(priority, bytes(led_bytes(led_data)), duration):
             return
-        # create a message to send
-        message = '{"color":['
-        # add all the color values to the message
-        for i in range(len(led_data)):
-            message += repr(led_data[i])
-            # separate the color values with ",", but not at the end
-            if not i == len(led_data) - 1:
-                message += ','
-        # complete message
-        message += '],"command":"color","priority":' + str(priority)
-        if duration > 0:
-            message += ', "duration":' + str(duration)
-        message += '}\n'
-        # print message
-        self.send_message(message)
+        self.invalidate_serverinfo()
+        self._stack.set(priority, LEDS, None, duration)
+        encoder = getattr(self._led_encoders, "encoder", None)
+        if encoder is None:
+            encoder = self._led_encoders.encoder = led_data_encoder()
+        # tagged by the encoder: the message is sent from the encoder buffer, without a copy
+        tan = next(self._tan) if self._use_tan else None
+        if self._metrics is not None:
+            begin = time.perf_counter()
+            message = encoder.encode(led_data, priority, duration, tan)
+            self._metrics.encoded("color", time.perf_counter() - begin)
+        else:
+            message = encoder.encode(led_data, priority, duration, tan)
+        self._flush_image()
+        recorded = self._recorder is not None
+        if self._writer_thread is not None:
+            # copied: the caller may reuse its buffer before the writer sends the frame
+            self._queue_frame(priority, message, bytes(led_bytes(led_data)) if recorded else None, tan)
+        else:
+            self._send_frame(priority, message, led_data if recorded else None, tan)
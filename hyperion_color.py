@@ -0,0 +1,392 @@
+"""
+hyperion_color.py module.
+
+Apply the hyperion color calibration to led frames on the client, to preview a calibration
+before sending it or to pre-process the frames sent with send_led_data.
+
+The stages follow the order of the hyperion daemon: the HSV/HSL gains and the per-channel
+threshold, gamma, blacklevel and whitelevel of the transforms, then the adjustment, the
+temperature and the correction. The per-channel stages are compiled into 256-entry lookup
+tables, so a frame costs a few vectorized operations whatever the calibration.
+"""
+from hyperion_config import load_config
+from hyperion_encoder import led_bytes
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+_IDENTITY_ADJUSTMENT = ((255, 0, 0), (0, 255, 0), (0, 0, 255))
+
+
+def parse_leds(leds, led_count):
+    """
+    Return the led indices of a transform.
+
+    :param leds: "*" for all the leds, or index ranges such as "0-5, 9, 12-17"
+    :param led_count: number of leds of the frames
+    :return: numpy array of led indices, None for all the leds
+    """
+    leds = str(leds).strip()
+    if leds in ("", "*"):
+        return None
+    indices = []
+    for part in leds.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            first, last = part.split("-", 1)
+            indices.extend(range(int(first), int(last) + 1))
+        else:
+            indices.append(int(part))
+    return np.array([index for index in indices if index < led_count], dtype=np.intp)
+
+
+class color_transform:
+    """Transform of a set of leds: HSV/HSL gains and per-channel threshold, gamma and levels."""
+
+    def __init__(self, identifier="default", leds="*", saturationGain=1.0, valueGain=1.0, saturationLGain=1.0,
+                 luminanceGain=1.0, luminanceMinimum=0.0, threshold=(0.0, 0.0, 0.0), gamma=(1.0, 1.0, 1.0),
+                 blacklevel=(0.0, 0.0, 0.0), whitelevel=(1.0, 1.0, 1.0)):
+        """
+        Color_transform initializer.
+
+        :param identifier: transform id
+        :param leds: leds of the transform ("*" or index ranges, see parse_leds)
+        :param saturationGain: HSV saturation gain
+        :param valueGain: HSV value gain
+        :param saturationLGain: HSL saturation gain
+        :param luminanceGain: HSL luminance gain
+        :param luminanceMinimum: HSL minimum luminance
+        :param threshold: (r, g, b) minimum input [0-1] for the channel to be on
+        :param gamma: (r, g, b) gamma
+        :param blacklevel: (r, g, b) lowest output [0-1]
+        :param whitelevel: (r, g, b) highest output [0-1]
+        """
+        self.identifier = str(identifier)
+        self.leds = leds
+        self.saturationGain = float(saturationGain)
+        self.valueGain = float(valueGain)
+        self.saturationLGain = float(saturationLGain)
+        self.luminanceGain = float(luminanceGain)
+        self.luminanceMinimum = float(luminanceMinimum)
+        self.threshold = tuple(float(value) for value in threshold)
+        self.gamma = tuple(float(value) for value in gamma)
+        self.blacklevel = tuple(float(value) for value in blacklevel)
+        self.whitelevel = tuple(float(value) for value in whitelevel)
+
+    @classmethod
+    def from_config(cls, entry):
+        """
+        Create a transform from an entry of the color.transform section of a configuration.
+
+        :param entry: dict with id, leds, hsv and red/green/blue sections
+        :return: color_transform
+        """
+        hsv = entry.get("hsv", {})
+        channels = [entry.get(channel, {}) for channel in ("red", "green", "blue")]
+        return cls(entry.get("id", "default"), entry.get("leds", "*"),
+                   hsv.get("saturationGain", 1.0), hsv.get("valueGain", 1.0),
+                   hsv.get("saturationLGain", 1.0), hsv.get("luminanceGain", 1.0), hsv.get("luminanceMinimum", 0.0),
+                   [channel.get("threshold", 0.0) for channel in channels],
+                   [channel.get("gamma", 1.0) for channel in channels],
+                   [channel.get("blacklevel", 0.0) for channel in channels],
+                   [channel.get("whitelevel", 1.0) for channel in channels])
+
+    def update(self, **values):
+        """
+        Change parameters, with the argument names of hyperion_client.set_transform.
+
+        :param values: parameter values, None values are ignored
+        """
+        for name, value in values.items():
+            if value is None:
+                continue
+            if not hasattr(self, name) or name in ("identifier", "leds"):
+                raise TypeError("Unknown transform parameter %r" % name)
+            current = getattr(self, name)
+            setattr(self, name, tuple(float(item) for item in value) if isinstance(current, tuple) else float(value))
+
+    def channel_luts(self):
+        """
+        Compile the per-channel stages.
+
+        :return: numpy float32 array of shape (3, 256) of the output [0-1] of every input value
+        """
+        luts = np.empty((3, 256), dtype=np.float32)
+        inputs = np.arange(256, dtype=np.float64) / 255.0
+        for channel in range(3):
+            output = np.where(inputs < self.threshold[channel], 0.0, inputs) ** self.gamma[channel]
+            black, white = self.blacklevel[channel], self.whitelevel[channel]
+            luts[channel] = black + (white - black) * output
+        return luts
+
+    @property
+    def has_hsv(self):
+        return self.saturationGain != 1.0 or self.valueGain != 1.0
+
+    @property
+    def has_hsl(self):
+        return self.saturationLGain != 1.0 or self.luminanceGain != 1.0 or self.luminanceMinimum != 0.0
+
+
+def _extremes(rgb):
+    """
+    Return the maximum and the minimum channel of colors.
+
+    :param rgb: float32 array of shape (3, n)
+    :return: (maximum, minimum) float32 arrays of shape (n,)
+    """
+    red, green, blue = rgb
+    return np.maximum(np.maximum(red, green), blue), np.minimum(np.minimum(red, green), blue)
+
+
+def _hsv_gain(rgb, saturation_gain, value_gain):
+    """
+    Scale the HSV saturation and value of colors, in place.
+
+    A channel c of a color with value v and chroma v - min is v - (v - c) * chroma / chroma, the
+    ratio (v - c) / chroma being fixed by the hue: the gains scale the value and the chroma and
+    the hue is kept without converting to HSV and back.
+
+    :param rgb: float32 array of shape (3, n) in [0-255]
+    """
+    value, low = _extremes(rgb)
+    chroma = value - low
+    new_value = np.minimum(value * value_gain, 255.0)
+    # new chroma / chroma = new value * min(saturation * gain, 1) / chroma
+    factor = np.divide(new_value * saturation_gain, value, out=np.zeros_like(value), where=value > 0)
+    np.minimum(factor, np.divide(new_value, chroma, out=np.zeros_like(value), where=chroma > 0), out=factor)
+    np.subtract(value, rgb, out=rgb)
+    rgb *= factor
+    np.subtract(new_value, rgb, out=rgb)
+
+
+def _hsl_gain(rgb, saturation_gain, luminance_gain, luminance_minimum):
+    """
+    Scale the HSL saturation and luminance of colors, in place.
+
+    :param rgb: float32 array of shape (3, n) in [0-255]
+    """
+    high, low = _extremes(rgb)
+    luminance = (high + low) / 2.0
+    chroma = high - low
+    # chroma of the full saturation at a luminance
+    span = 255.0 - np.abs(2.0 * luminance - 255.0)
+    saturation = np.divide(chroma, span, out=np.zeros_like(chroma), where=span > 0)
+    luminance = np.clip(luminance * luminance_gain, luminance_minimum * 255.0, 255.0)
+    new_chroma = (255.0 - np.abs(2.0 * luminance - 255.0)) * np.minimum(saturation * saturation_gain, 1.0)
+    # every channel keeps its position between the minimum and the maximum, fixed by the hue
+    factor = np.divide(new_chroma, chroma, out=np.zeros_like(chroma), where=chroma > 0)
+    rgb -= (high + low) / 2.0
+    rgb *= factor
+    rgb += luminance
+    np.clip(rgb, 0.0, 255.0, out=rgb)
+
+
+class color_pipeline:
+    """
+    Client side copy of the hyperion color processing.
+
+    The pipeline is compiled on the first frame after a change of the calibration: the transform,
+    temperature and correction tables are merged into one lookup table per channel when the
+    adjustment is the identity.
+    """
+
+    def __init__(self, transforms=None, correction=(255, 255, 255), temperature=(255, 255, 255),
+                 adjustment=_IDENTITY_ADJUSTMENT):
+        """
+        Color_pipeline initializer.
+
+        :param transforms: list of color_transform, None -> a default transform of all the leds
+        :param correction: (r, g, b) correction values [0-255]
+        :param temperature: (r, g, b) temperature values [0-255]
+        :param adjustment: (redAdjust, greenAdjust, blueAdjust) output colors of the pure red, green
+                           and blue inputs
+        """
+        if np is None:
+            raise ImportError("numpy is required by the color pipeline")
+        self.transforms = list(transforms) if transforms else [color_transform()]
+        self.correction = tuple(int(value) for value in correction)
+        self.temperature = tuple(int(value) for value in temperature)
+        self.adjustment = tuple(tuple(int(value) for value in color) for color in adjustment)
+        self._compiled = None
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Create the pipeline of a hyperion configuration.
+
+        :param config: json structure or path of a hyperion configuration
+        :return: color_pipeline of the color.transform section (and of the correction, temperature
+                 and adjustment sections when present)
+        """
+        if isinstance(config, str):
+            config = load_config(config)
+        color = config.get("color", {})
+
+        def channels(section, default):
+            entries = color.get(section) or ()
+            if not entries:
+                return default
+            return tuple(entries[0].get(channel, 255) for channel in ("red", "green", "blue"))
+
+        adjustment = _IDENTITY_ADJUSTMENT
+        if color.get("adjustment"):
+            entry = color["adjustment"][0]
+            adjustment = tuple((entry[pure]["redChannel"], entry[pure]["greenChannel"], entry[pure]["blueChannel"])
+                               if pure in entry else default
+                               for pure, default in zip(("pureRed", "pureGreen", "pureBlue"), _IDENTITY_ADJUSTMENT))
+        return cls([color_transform.from_config(entry) for entry in color.get("transform") or ()],
+                   channels("correction", (255, 255, 255)), channels("temperature", (255, 255, 255)), adjustment)
+
+# -CALIBRATION-
+    def set_transform(self, identifier, **values):
+        """
+        Change a transform, with the arguments of hyperion_client.set_transform.
+
+        :param identifier: transform id
+        :param values: blacklevel, gamma, luminanceGain, luminanceMinimum, saturationGain,
+                       saturationLGain, threshold, valueGain, whitelevel
+        """
+        for transform in self.transforms:
+            if transform.identifier == identifier:
+                transform.update(**values)
+                self._compiled = None
+                return
+        raise KeyError("No transform with id %r" % identifier)
+
+    def set_correction(self, red, green, blue):
+        """
+        Change the correction.
+
+        :param red: red correction value [0-255]
+        :param green: green correction value [0-255]
+        :param blue: blue correction value [0-255]
+        """
+        self.correction = (int(red), int(green), int(blue))
+        self._compiled = None
+
+    def set_temperature(self, red, green, blue):
+        """
+        Change the temperature.
+
+        :param red: red temperature value [0-255]
+        :param green: green temperature value [0-255]
+        :param blue: blue temperature value [0-255]
+        """
+        self.temperature = (int(red), int(green), int(blue))
+        self._compiled = None
+
+    def set_adjustment(self, redAdjust, greenAdjust, blueAdjust):
+        """
+        Change the adjustment.
+
+        :param redAdjust: (r, g, b) output of the pure red input
+        :param greenAdjust: (r, g, b) output of the pure green input
+        :param blueAdjust: (r, g, b) output of the pure blue input
+        """
+        self.adjustment = tuple(tuple(int(value) for value in color) for color in (redAdjust, greenAdjust, blueAdjust))
+        self._compiled = None
+
+# -PROCESSING-
+    def _compile(self, led_count):
+        """Build the lookup tables and the led indices of every transform."""
+        # temperature and correction scale every channel: one factor per channel
+        scale = np.array([t * c for t, c in zip(self.temperature, self.correction)], dtype=np.float32) / (255.0 * 255.0)
+        identity = self.adjustment == _IDENTITY_ADJUSTMENT
+        matrix = np.array(self.adjustment, dtype=np.float32) / 255.0
+        stages = []
+        for transform in self.transforms:
+            luts = transform.channel_luts()
+            if identity:
+                # merge the channel tables and the scales into uint8 tables
+                luts = np.clip(np.rint(luts * scale[:, np.newaxis] * 255.0), 0, 255).astype(np.uint8)
+            stages.append((parse_leds(transform.leds, led_count), transform, luts))
+        self._compiled = (led_count, identity, matrix, scale, stages)
+
+    def apply(self, led_data):
+        """
+        Process a frame.
+
+        :param led_data: led data (r,g,b) * ledcount accepted by hyperion_encoder.led_bytes
+        :return: numpy uint8 array of shape (ledcount, 3) of the output colors
+        """
+        frame = np.frombuffer(led_bytes(led_data), dtype=np.uint8).reshape(-1, 3)
+        if self._compiled is None or self._compiled[0] != len(frame):
+            self._compile(len(frame))
+        _, identity, matrix, scale, stages = self._compiled
+        # the leds of no transform are sent unchanged
+        output = frame.copy()
+        for indices, transform, luts in stages:
+            pixels = frame if indices is None else frame[indices]
+            # planar (3, n) layout: the stages work on contiguous channel rows
+            planes = pixels.T
+            if transform.has_hsv or transform.has_hsl:
+                rgb = np.array(planes, dtype=np.float32, order="C")
+                if transform.has_hsv:
+                    _hsv_gain(rgb, transform.saturationGain, transform.valueGain)
+                if transform.has_hsl:
+                    _hsl_gain(rgb, transform.saturationLGain, transform.luminanceGain, transform.luminanceMinimum)
+                # the tables take the 8 bit values of the hsv stage
+                planes = np.rint(rgb, out=rgb).astype(np.uint8)
+            result = np.empty_like(pixels)
+            if identity:
+                for channel in range(3):
+                    np.take(luts[channel], planes[channel], out=result[:, channel])
+            else:
+                rgb = np.stack([luts[channel][planes[channel]] for channel in range(3)])
+                # output channel = sum of the input channels times the adjustment of their pure color
+                rgb = np.clip(matrix.T @ rgb, 0.0, 1.0)
+                rgb *= scale[:, np.newaxis] * 255.0
+                result[:] = np.rint(rgb, out=rgb).T
+            if indices is None:
+                output = result
+            else:
+                output[indices] = result
+        return output
+
+    __call__ = apply
+
+    def preview_color(self, red, green, blue):
+        """
+        Process a single color.
+
+        :param red: red value [0-255]
+        :param green: green value [0-255]
+        :param blue: blue value [0-255]
+        :return: (r, g, b) output color
+        """
+        return tuple(int(value) for value in self.apply(bytes((red, green, blue)))[0])
+
+
+def benchmark_pipeline(led_count=100000, repeat=20):
+    """
+    Measure the time to process a frame.
+
+    :param led_count: number of leds of the frame
+    :param repeat: number of processed frames
+    :return: dict of stages -> milliseconds per frame
+    """
+    import time
+    frame = np.random.default_rng(0).integers(0, 256, led_count * 3, dtype=np.uint8)
+    pipelines = {"lut": color_pipeline([color_transform(gamma=(2.2, 2.0, 1.8), threshold=(0.05, 0.05, 0.05))],
+                                       correction=(255, 240, 220)),
+                 "lut+hsv": color_pipeline([color_transform(saturationGain=1.2, valueGain=0.9, gamma=(2.2, 2.2, 2.2))]),
+                 "lut+hsv+adjustment": color_pipeline([color_transform(saturationGain=1.2, gamma=(2.2, 2.2, 2.2))],
+                                                      adjustment=((255, 10, 0), (0, 255, 0), (0, 20, 255)))}
+    results = {}
+    for name, pipeline in pipelines.items():
+        pipeline.apply(frame)
+        begin = time.perf_counter()
+        for _ in range(repeat):
+            pipeline.apply(frame)
+        results[name] = (time.perf_counter() - begin) / repeat * 1000.0
+    return results
+
+
+if __name__ == '__main__':
+    for stages, milliseconds in benchmark_pipeline().items():
+        print("%-20s %8.2f ms per 100k leds frame" % (stages, milliseconds))
@@ -0,0 +1,88 @@
+"""
+hyperion_config.py module.
+
+Read the hyperion daemon configuration files.
+
+The configuration is json with "//" and "///" line comments, as written by HyperCon.
+"""
+import json
+
+
+def strip_comments(text):
+    """
+    Remove the line comments of a hyperion configuration.
+
+    A "//" inside a json string (e.g. an url) is kept.
+
+    :param text: configuration text
+    :return: json text
+    """
+    parts = []
+    start = 0
+    index = 0
+    in_string = False
+    length = len(text)
+    while index < length:
+        char = text[index]
+        if in_string:
+            if char == '\\':
+                index += 1
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == '/' and text.startswith('//', index):
+            parts.append(text[start:index])
+            end = text.find('\n', index)
+            if end < 0:
+                start = index = length
+                break
+            start = index = end
+            continue
+        index += 1
+    parts.append(text[start:])
+    return ''.join(parts)
+
+
+def loads_config(text):
+    """
+    Parse a hyperion configuration.
+
+    :param text: configuration text
+    :return: json structure of the configuration
+    """
+    return json.loads(strip_comments(text))
+
+
+def load_config(path):
+    """
+    Read a hyperion configuration file.
+
+    :param path: path of the configuration file
+    :return: json structure of the configuration
+    """
+    with open(path) as config_file:
+        return loads_config(config_file.read())
+
+
+def led_layout(config):
+    """
+    Return the areas of the image mapped to every led.
+
+    :param config: json structure of the configuration
+    :return: list of (hmin, hmax, vmin, vmax) tuples in [0, 1] image coordinates, in led index order
+    """
+    leds = sorted(config.get("leds", ()), key=lambda led: led.get("index", 0))
+    return [(float(led["hscan"]["minimum"]), float(led["hscan"]["maximum"]),
+             float(led["vscan"]["minimum"]), float(led["vscan"]["maximum"])) for led in leds]
+
+
+def json_port(config, default=19444):
+    """
+    Return the port of the json server.
+
+    :param config: json structure of the configuration
+    :param default: port used when the configuration has no json server
+    :return: port number
+    """
+    return int(config.get("jsonServer", {}).get("port", default))
@@ -0,0 +1,372 @@
+"""
+hyperion_effects.py module.
+
+Render hyperion-style effects on the client, as frames for send_led_data or OPCclient.put_pixels.
+
+The effects are functions of the time only: render(t) returns the frame of the time t in seconds
+since a shared epoch, whatever the frames rendered before. Controllers rendering the same effect
+from the same epoch with synchronized clocks (e.g. NTP) show the same frame at the same time.
+"""
+import colorsys
+import math
+import os
+import time
+
+from hyperion_config import led_layout
+from hyperion_pacer import frame_pacer
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# number of entries of the hue wheel palette
+PALETTE_SIZE = 1536
+# fading steps per second of the knight rider trail, the update rate of the hyperion effect scripts
+FADE_STEPS = 50.0
+
+
+def _hue_palette(size=PALETTE_SIZE):
+    """
+    Return the colors of the hue wheel at full saturation and value.
+
+    :param size: number of hues
+    :return: float32 array of shape (size, 3) in [0-255]
+    """
+    hue = np.arange(size, dtype=np.float32) * (6.0 / size)
+    # distance of every channel to its hue sector, as in colorsys.hsv_to_rgb
+    channels = np.stack([np.abs((hue + offset) % 6.0 - 3.0) - 1.0 for offset in (0.0, 4.0, 2.0)], axis=1)
+    return np.clip(channels, 0.0, 1.0) * 255.0
+
+
+class led_geometry:
+    """Positions of the leds used by the effects."""
+
+    def __init__(self, leds):
+        """
+        Led_geometry initializer.
+
+        :param leds: number of leds of a strip or a ring, list of (hmin, hmax, vmin, vmax) led areas
+                     (see hyperion_config.led_layout) or json structure of a configuration
+        """
+        if np is None:
+            raise ImportError("numpy is required by the effects")
+        if isinstance(leds, dict):
+            leds = led_layout(leds)
+        if isinstance(leds, int):
+            count = leds
+            # a strip closed in a ring: the leds are evenly spread on the turn and on the width
+            self.x = np.linspace(0.0, 1.0, count, dtype=np.float32)
+            self.y = np.full(count, 0.5, dtype=np.float32)
+            self.angle = np.arange(count, dtype=np.float32) / max(count, 1)
+        else:
+            areas = np.array(leds, dtype=np.float32).reshape(-1, 4)
+            count = len(areas)
+            self.x = (areas[:, 0] + areas[:, 1]) / 2.0
+            self.y = (areas[:, 2] + areas[:, 3]) / 2.0
+            # fraction of a turn around the center of the image, clockwise from the top
+            self.angle = ((np.arctan2(self.x - 0.5, 0.5 - self.y) / (2.0 * math.pi)) % 1.0).astype(np.float32)
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+
+class effect:
+    """Base class of the effects."""
+
+    # hyperion argument names -> initializer argument names
+    ARGS = {}
+
+    def __init__(self, geometry):
+        """
+        Effect initializer.
+
+        :param geometry: led_geometry, or the leds argument of led_geometry
+        """
+        self.geometry = geometry if isinstance(geometry, led_geometry) else led_geometry(geometry)
+
+    @classmethod
+    def from_args(cls, geometry, args):
+        """
+        Create an effect from the arguments of a hyperion effect definition.
+
+        :param geometry: led_geometry, or the leds argument of led_geometry
+        :param args: "args" dict of the effect definition, unknown arguments are ignored
+        :return: effect
+        """
+        return cls(geometry, **{cls.ARGS[name]: value for name, value in (args or {}).items() if name in cls.ARGS})
+
+    def render(self, t, out=None):
+        """
+        Render a frame.
+
+        :param t: time in seconds since the epoch of the effect
+        :param out: numpy uint8 array of shape (ledcount, 3) to render into, None -> new array
+        :return: numpy uint8 array of shape (ledcount, 3)
+        """
+        if out is None:
+            out = np.empty((self.geometry.count, 3), dtype=np.uint8)
+        self._render(float(t), out)
+        return out
+
+    def _render(self, t, out):
+        raise NotImplementedError
+
+
+class rainbow_swirl(effect):
+    """The hue wheel around the leds, turning."""
+
+    ARGS = {"rotation-time": "rotation_time", "brightness": "brightness", "reverse": "reverse"}
+
+    def __init__(self, geometry, rotation_time=3.0, brightness=1.0, reverse=False):
+        """
+        Rainbow_swirl initializer.
+
+        :param geometry: led_geometry, or the leds argument of led_geometry
+        :param rotation_time: time in seconds of a turn
+        :param brightness: brightness [0-1]
+        :param reverse: if True -> turn counterclockwise
+        """
+        super().__init__(geometry)
+        self.rotation_time = float(rotation_time)
+        self.reverse = bool(reverse)
+        self._palette = np.rint(_hue_palette() * float(brightness)).astype(np.uint8)
+        self._offsets = (self.geometry.angle * PALETTE_SIZE).astype(np.int64)
+
+    def _render(self, t, out):
+        turns = t / self.rotation_time if self.rotation_time > 0 else 0.0
+        shift = int((turns % 1.0) * PALETTE_SIZE)
+        indices = self._offsets + (shift if self.reverse else PALETTE_SIZE - shift)
+        np.take(self._palette, indices % PALETTE_SIZE, axis=0, out=out)
+
+
+class rainbow_mood(effect):
+    """All the leds going through the hue wheel."""
+
+    ARGS = {"rotation-time": "rotation_time", "brightness": "brightness", "reverse": "reverse"}
+
+    def __init__(self, geometry, rotation_time=60.0, brightness=1.0, reverse=False):
+        """
+        Rainbow_mood initializer.
+
+        :param geometry: led_geometry, or the leds argument of led_geometry
+        :param rotation_time: time in seconds of a turn of the hue wheel
+        :param brightness: brightness [0-1]
+        :param reverse: if True -> go through the hue wheel backwards
+        """
+        super().__init__(geometry)
+        self.rotation_time = float(rotation_time)
+        self.reverse = bool(reverse)
+        self._palette = np.rint(_hue_palette() * float(brightness)).astype(np.uint8)
+
+    def _render(self, t, out):
+        turns = t / self.rotation_time if self.rotation_time > 0 else 0.0
+        index = int((turns % 1.0) * PALETTE_SIZE)
+        out[:] = self._palette[(PALETTE_SIZE - index) % PALETTE_SIZE if self.reverse else index]
+
+
+class mood_blobs(effect):
+    """Blobs of a color turning around the leds, the hue swinging around the color."""
+
+    ARGS = {"rotationTime": "rotation_time", "color": "color", "hueChange": "hue_change", "blobs": "blobs",
+            "reverse": "reverse"}
+
+    def __init__(self, geometry, rotation_time=60.0, color=(0, 0, 255), hue_change=60.0, blobs=5, reverse=False):
+        """
+        Mood_blobs initializer.
+
+        :param geometry: led_geometry, or the leds argument of led_geometry
+        :param rotation_time: time in seconds of a turn of the blobs
+        :param color: (r, g, b) color of the blobs
+        :param hue_change: swing of the hue in degrees
+        :param blobs: number of blobs
+        :param reverse: if True -> turn counterclockwise
+        """
+        super().__init__(geometry)
+        self.rotation_time = float(rotation_time)
+        self.hue_change = float(hue_change)
+        self.blobs = int(blobs)
+        self.reverse = bool(reverse)
+        self._hsv = colorsys.rgb_to_hsv(*(value / 255.0 for value in color))
+        self._phase = (self.geometry.angle * (2.0 * math.pi * self.blobs)).astype(np.float32)
+        self._levels = np.empty(self.geometry.count, dtype=np.float32)
+
+    def _render(self, t, out):
+        turns = t / self.rotation_time if self.rotation_time > 0 else 0.0
+        hue, saturation, value = self._hsv
+        hue = (hue + self.hue_change / 360.0 * math.sin(2.0 * math.pi * turns)) % 1.0
+        color = np.array(colorsys.hsv_to_rgb(hue, saturation, value), dtype=np.float32) * 255.0
+        # one raised cosine per blob, moving a blob spacing per turn of the blobs
+        shift = 2.0 * math.pi * self.blobs * (turns % 1.0)
+        levels = self._levels
+        np.add(self._phase, shift if self.reverse else -shift, out=levels)
+        np.cos(levels, out=levels)
+        levels += 1.0
+        levels *= 0.5
+        np.multiply(levels[:, np.newaxis], color, out=out, casting="unsafe")
+
+
+class knight_rider(effect):
+    """A dot sweeping the width of the leds back and forth, with a fading trail."""
+
+    ARGS = {"speed": "speed", "fadeFactor": "fade_factor", "color": "color"}
+
+    def __init__(self, geometry, speed=1.0, fade_factor=0.7, color=(255, 0, 0)):
+        """
+        Knight_rider initializer.
+
+        :param geometry: led_geometry, or the leds argument of led_geometry
+        :param speed: sweeps per second
+        :param fade_factor: brightness kept by the trail at every fading step (see FADE_STEPS)
+        :param color: (r, g, b) color of the dot
+        """
+        super().__init__(geometry)
+        self.sweep_time = 1.0 / float(speed) if speed > 0 else math.inf
+        self.fade_factor = float(fade_factor)
+        self.color = np.array(color, dtype=np.float32)
+        # times of a back and forth period the dot passes every led
+        self._forward = (self.geometry.x * self.sweep_time).astype(np.float64)
+        self._backward = (2.0 - self.geometry.x) * self.sweep_time
+        self._levels = np.empty(self.geometry.count, dtype=np.float64)
+        # the dot lights a led fully until it reaches the next one
+        self._spacing = self.sweep_time / max(self.geometry.count - 1, 1)
+
+    def _render(self, t, out):
+        if math.isinf(self.sweep_time):
+            out[:] = 0
+            return
+        period = 2.0 * self.sweep_time
+        now = t % period
+        # time since the dot last passed every led
+        age = np.minimum((now - self._forward) % period, (now - self._backward) % period, out=self._levels)
+        age -= self._spacing
+        np.maximum(age, 0.0, out=age)
+        age *= FADE_STEPS * math.log(max(self.fade_factor, 1e-9))
+        np.exp(age, out=age)
+        np.multiply(age[:, np.newaxis], self.color, out=out, casting="unsafe")
+
+
+class strobe(effect):
+    """All the leds flashing a color."""
+
+    ARGS = {"color": "color", "frequency": "frequency"}
+
+    def __init__(self, geometry, color=(255, 255, 255), frequency=10.0):
+        """
+        Strobe initializer.
+
+        :param geometry: led_geometry, or the leds argument of led_geometry
+        :param color: (r, g, b) color of the flashes
+        :param frequency: flashes per second, the leds are on half of the time
+        """
+        super().__init__(geometry)
+        self.color = np.array(color, dtype=np.uint8)
+        self.frequency = float(frequency)
+
+    def _render(self, t, out):
+        out[:] = self.color if (t * self.frequency) % 1.0 < 0.5 else 0
+
+
+class fade(effect):
+    """All the leds fading from a color to another."""
+
+    ARGS = {"color-start": "color_start", "color-end": "color_end", "fade-time": "fade_time", "repeat": "repeat"}
+
+    def __init__(self, geometry, color_start=(0, 0, 0), color_end=(255, 255, 255), fade_time=2.0, repeat=True):
+        """
+        Fade initializer.
+
+        :param geometry: led_geometry, or the leds argument of led_geometry
+        :param color_start: (r, g, b) color at the start of the fade
+        :param color_end: (r, g, b) color at the end of the fade
+        :param fade_time: time in seconds of the fade
+        :param repeat: if True -> fade back and forth, else stay on the end color
+        """
+        super().__init__(geometry)
+        self.color_start = np.array(color_start, dtype=np.float32)
+        self.color_end = np.array(color_end, dtype=np.float32)
+        self.fade_time = float(fade_time)
+        self.repeat = bool(repeat)
+
+    def _render(self, t, out):
+        if self.fade_time <= 0:
+            position = 1.0
+        elif self.repeat:
+            position = 1.0 - abs((t / self.fade_time) % 2.0 - 1.0)
+        else:
+            position = min(max(t / self.fade_time, 0.0), 1.0)
+        out[:] = np.rint(self.color_start + (self.color_end - self.color_start) * position)
+
+
+# script names of the hyperion effects -> effects
+EFFECT_SCRIPTS = {
+    "rainbow-swirl.py": rainbow_swirl,
+    "rainbow-mood.py": rainbow_mood,
+    "mood-blobs.py": mood_blobs,
+    "knight-rider.py": knight_rider,
+    "strobe.py": strobe,
+    "fade.py": fade,
+}
+
+
+def create_effect(definition, geometry):
+    """
+    Create the effect of a hyperion effect definition.
+
+    :param definition: {"script", "args"} dict, e.g. an entry of the "effects" list of the serverinfo
+    :param geometry: led_geometry, or the leds argument of led_geometry
+    :return: effect
+    """
+    script = os.path.basename(str(definition["script"]))
+    if script not in EFFECT_SCRIPTS:
+        raise ValueError("No local rendering of the effect script %s" % script)
+    return EFFECT_SCRIPTS[script].from_args(geometry, definition.get("args"))
+
+
+def play(effect, sink, fps=60.0, duration=None, epoch=0.0, pacer=None):
+    """
+    Render an effect and send its frames.
+
+    The frames are paced on a grid of 1/fps steps from the epoch on the wall clock, so players
+    with the same epoch and synchronized clocks send the same frames at the same time. A frame that
+    could not be sent on time is skipped.
+
+    :param effect: effect to render
+    :param sink: callable sending a frame, e.g. hyperion_client.send_led_data or OPCclient.put_pixels
+    :param fps: frames per second
+    :param duration: time in seconds to play, None -> forever
+    :param epoch: time.time() value of the start of the effect
+    :param pacer: hyperion_pacer.frame_pacer to use, None -> a new one at fps aligned on the epoch
+    :return: pacing statistics, see hyperion_pacer.frame_pacer.stats
+    """
+    if pacer is None:
+        # the grid of the wall clock epoch on the monotonic clock
+        pacer = frame_pacer(fps, start=time.monotonic() - (time.time() - epoch))
+    frame = np.empty((effect.geometry.count, 3), dtype=np.uint8)
+    return pacer.run(lambda index: sink(effect.render(pacer.frame_time(index), frame)), duration)
+
+
+def benchmark_effects(led_count=20000, repeat=200):
+    """
+    Measure the time to render a frame.
+
+    :param led_count: number of leds
+    :param repeat: number of rendered frames
+    :return: dict of script names -> milliseconds per frame
+    """
+    geometry = led_geometry(led_count)
+    frame = np.empty((led_count, 3), dtype=np.uint8)
+    results = {}
+    for script, effect_class in EFFECT_SCRIPTS.items():
+        renderer = effect_class(geometry)
+        begin = time.perf_counter()
+        for index in range(repeat):
+            renderer.render(index / 60.0, frame)
+        results[script] = (time.perf_counter() - begin) / repeat * 1000.0
+    return results
+
+
+if __name__ == '__main__':
+    for script, milliseconds in benchmark_effects().items():
+        print("%-18s %8.3f ms per 20k leds frame" % (script, milliseconds))
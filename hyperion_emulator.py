@@ -0,0 +1,500 @@
+"""
+hyperion_emulator.py module.
+
+Local emulator of the hyperion json server, to develop and load-test the clients without a device.
+
+Run "python hyperion_emulator.py --config addon/hyperion.config.matrix.json" to serve on the json
+port of the configuration.
+"""
+import argparse
+import asyncio
+import base64
+import binascii
+import collections
+import colorsys
+import glob
+import json
+import logging
+import os
+import socket
+import time
+from threading import Event, Thread
+
+from hyperion_config import json_port, led_layout, load_config
+
+_log = logging.getLogger(__name__)
+
+# effects served when the configuration has no readable effect directory
+DEFAULT_EFFECTS = (
+    {"name": "Knight rider", "script": "knight-rider.py",
+     "args": {"speed": 1.0, "fadeFactor": 0.7, "color": [255, 0, 0]}},
+    {"name": "Rainbow swirl", "script": "rainbow-swirl.py",
+     "args": {"rotation-time": 20.0, "brightness": 1.0, "reverse": False}},
+    {"name": "Rainbow swirl fast", "script": "rainbow-swirl.py",
+     "args": {"rotation-time": 3.0, "brightness": 1.0, "reverse": False}},
+    {"name": "Rainbow mood", "script": "rainbow-mood.py",
+     "args": {"rotation-time": 60.0, "brightness": 1.0, "reverse": False}},
+    {"name": "Blue mood blobs", "script": "mood-blobs.py",
+     "args": {"rotationTime": 60.0, "color": [0, 0, 255], "hueChange": 60.0, "blobs": 5, "reverse": False}},
+    {"name": "Strobe blue", "script": "strobe.py", "args": {"color": [0, 0, 255], "frequency": 5.0}},
+    {"name": "Strobe white", "script": "strobe.py", "args": {"color": [255, 255, 255], "frequency": 10.0}},
+)
+# maximum size of a command line, a raw image of 1920x1080 in base64 fits
+MAX_LINE = 16 * 1024 * 1024
+# the writes of a client are only awaited when its send buffer exceeds this size
+_WRITE_HIGH_WATER = 256 * 1024
+
+
+class CommandError(Exception):
+    """A command the server answers with an error."""
+
+
+def load_effects(config):
+    """
+    Read the effect definitions of the effect directories of a configuration.
+
+    :param config: json structure of the configuration
+    :return: list of {"name", "script", "args"} dicts, DEFAULT_EFFECTS if no effect was found
+    """
+    paths = config.get("effects", {}).get("paths", ()) if config else ()
+    effects = []
+    for path in paths:
+        for filename in sorted(glob.glob(os.path.join(path, "*.json"))):
+            try:
+                with open(filename) as effect_file:
+                    effect = json.load(effect_file)
+                effects.append({"name": str(effect["name"]),
+                                "script": os.path.join(path, effect["script"]),
+                                "args": effect.get("args", {})})
+            except (OSError, ValueError, KeyError) as exc:
+                _log.warning("Could not read the effect %s: %s", filename, exc)
+    if effects:
+        return effects
+    prefix = paths[0] if paths else "effects"
+    return [dict(effect, script=os.path.join(prefix, effect["script"])) for effect in DEFAULT_EFFECTS]
+
+
+def _default_calibration(config):
+    """Return the transform, correction, temperature and adjustment lists of a configuration."""
+    color = config.get("color", {}) if config else {}
+    transforms = []
+    for transform in color.get("transform") or [{"id": "default"}]:
+        hsv = transform.get("hsv", {})
+        channels = [transform.get(channel, {}) for channel in ("red", "green", "blue")]
+        transforms.append({"id": transform.get("id", "default"),
+                           "saturationGain": hsv.get("saturationGain", 1.0),
+                           "valueGain": hsv.get("valueGain", 1.0),
+                           "saturationLGain": hsv.get("saturationLGain", 1.0),
+                           "luminanceGain": hsv.get("luminanceGain", 1.0),
+                           "luminanceMinimum": hsv.get("luminanceMinimum", 0.0),
+                           "threshold": [channel.get("threshold", 0.0) for channel in channels],
+                           "gamma": [channel.get("gamma", 1.0) for channel in channels],
+                           "blacklevel": [channel.get("blacklevel", 0.0) for channel in channels],
+                           "whitelevel": [channel.get("whitelevel", 1.0) for channel in channels]})
+    corrections = [{"id": entry.get("id", "default"),
+                    "correctionValues": [entry.get(channel, 255) for channel in ("red", "green", "blue")]}
+                   for entry in color.get("correction") or [{"id": "default"}]]
+    temperatures = [{"id": entry.get("id", "default"),
+                     "correctionValues": [entry.get(channel, 255) for channel in ("red", "green", "blue")]}
+                    for entry in color.get("temperature") or [{"id": "default"}]]
+    adjustments = []
+    for entry in color.get("adjustment") or [{"id": "default"}]:
+        adjustment = {"id": entry.get("id", "default")}
+        for name, pure, default in (("redAdjust", "pureRed", [255, 0, 0]), ("greenAdjust", "pureGreen", [0, 255, 0]),
+                                    ("blueAdjust", "pureBlue", [0, 0, 255])):
+            channels = entry.get(pure)
+            adjustment[name] = ([channels["redChannel"], channels["greenChannel"], channels["blueChannel"]]
+                                if channels else default)
+        adjustments.append(adjustment)
+    return {"transform": transforms, "correction": corrections, "temperature": temperatures,
+            "adjustment": adjustments}
+
+
+class _client_stats:
+    """Traffic of a connected client."""
+
+    __slots__ = ("address", "connected", "commands", "errors", "bytes_in", "bytes_out")
+
+    def __init__(self, address):
+        self.address = address
+        self.connected = time.monotonic()
+        self.commands = 0
+        self.errors = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def report(self, now):
+        elapsed = max(now - self.connected, 1e-9)
+        return {"address": self.address,
+                "seconds": elapsed,
+                "commands": self.commands,
+                "errors": self.errors,
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+                "commands_per_second": self.commands / elapsed,
+                "bytes_in_per_second": self.bytes_in / elapsed}
+
+
+class hyperion_emulator(Thread):
+    """
+    Local emulator of the hyperion json server.
+
+    The emulator runs an asyncio event loop in its own thread, so hundreds of clients are served
+    without a thread per connection. It keeps the priorities with their duration, the effects and
+    the calibration of a configuration, and the traffic of every client.
+    """
+
+    def __init__(self, config=None, HOST='127.0.0.1', PORT=None, effects=None, hostname="hyperion-emulator"):
+        """
+        Hyperion_emulator initializer.
+
+        :param config: json structure or path of a hyperion configuration, None -> no leds
+        :param HOST: ip address to bind
+        :param PORT: port to bind (0 -> any free port), None -> json port of the configuration
+        :param effects: list of {"name", "script", "args"} effect dicts, None -> from the configuration
+        :param hostname: hostname reported by serverinfo
+        """
+        Thread.__init__(self, daemon=True)
+        if isinstance(config, str):
+            config = load_config(config)
+        self.config = config or {}
+        self.layout = led_layout(self.config)
+        self.hostname = str(hostname)
+        self._effects = list(effects) if effects is not None else load_effects(self.config)
+        self._effects_by_name = {effect["name"]: effect for effect in self._effects}
+        self._calibration = _default_calibration(self.config)
+        self._priorities = {}
+        self._clients = {}
+        self._writers = set()
+        self._tasks = set()
+        self._closed_clients = collections.deque(maxlen=1000)
+        self._commands = 0
+        self._closed_count = 0
+        self._loop = None
+        self._stopped = None
+        self._ready = Event()
+        # bind now: the address is known (and a busy port fails) before the thread starts
+        self._socket = socket.socket()
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind((HOST, int(json_port(self.config) if PORT is None else PORT)))
+        self._socket.listen(512)
+
+    @property
+    def address(self):
+        """
+        Return the bound address.
+
+        :return: (host, port) tuple
+        """
+        return self._socket.getsockname()
+
+    @property
+    def effects(self):
+        """
+        Return the effects of the server.
+
+        :return: list of {"name", "script", "args"} effect dicts
+        """
+        return self._effects
+
+    @property
+    def led_count(self):
+        """
+        Return the number of leds of the configuration.
+
+        :return: number of leds
+        """
+        return len(self.layout)
+
+# -SERVER-
+    def run(self):
+        asyncio.run(self._serve())
+
+    async def _serve(self):
+        self._loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        server = await asyncio.start_server(self._handle_client, sock=self._socket, limit=MAX_LINE)
+        self._ready.set()
+        async with server:
+            await self._stopped.wait()
+        # close the connections: the client tasks see the end of their stream and finish
+        tasks = list(self._tasks)
+        for writer in list(self._writers):
+            writer.close()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def start(self):
+        """Start the server thread and wait until it accepts connections."""
+        Thread.start(self)
+        self._ready.wait()
+
+    def stop(self, timeout=5.0):
+        """
+        Stop the server thread.
+
+        :param timeout: maximum time in seconds to wait for the thread
+        """
+        if self._loop is not None and self._stopped is not None:
+            self._loop.call_soon_threadsafe(self._stopped.set)
+            self.join(timeout)
+        else:
+            self._socket.close()
+
+    async def _handle_client(self, reader, writer):
+        peer = writer.get_extra_info("peername")
+        stats = _client_stats("%s:%d" % peer[:2] if peer else "?")
+        self._clients[id(stats)] = stats
+        self._writers.add(writer)
+        self._tasks.add(asyncio.current_task())
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except (ValueError, asyncio.LimitOverrunError):
+                    # line over MAX_LINE: the stream cannot be resynchronised
+                    break
+                if not line:
+                    break
+                stats.bytes_in += len(line)
+                if not line.strip():
+                    continue
+                reply = self.handle_line(line, stats)
+                stats.bytes_out += len(reply)
+                writer.write(reply)
+                if writer.transport.get_write_buffer_size() > _WRITE_HIGH_WATER:
+                    await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            del self._clients[id(stats)]
+            self._closed_clients.append(stats.report(time.monotonic()))
+            self._closed_count += 1
+            self._writers.discard(writer)
+            self._tasks.discard(asyncio.current_task())
+            writer.close()
+
+# -COMMANDS-
+    def handle_line(self, line, stats=None):
+        """
+        Execute a command line and return the reply line.
+
+        :param line: json-formatted command bytes
+        :param stats: traffic of the client that sent the command, None -> not recorded
+        :return: json-formatted reply bytes
+        """
+        self._commands += 1
+        if stats is not None:
+            stats.commands += 1
+        tan = None
+        try:
+            try:
+                command = json.loads(line)
+            except ValueError as exc:
+                raise CommandError("Error while parsing json: %s" % exc)
+            if not isinstance(command, dict) or "command" not in command:
+                raise CommandError("Missing command")
+            tan = command.get("tan")
+            handler = getattr(self, "_command_" + str(command["command"]), None)
+            if handler is None:
+                raise CommandError("Unknown command: %s" % command["command"])
+            reply = handler(command) or {}
+            reply["success"] = True
+        except (CommandError, KeyError, TypeError, ValueError) as exc:
+            if stats is not None:
+                stats.errors += 1
+            message = str(exc) if isinstance(exc, CommandError) else "Invalid command arguments: %r" % exc
+            reply = {"success": False, "error": message}
+        if tan is not None:
+            reply["tan"] = tan
+        return json.dumps(reply, separators=(',', ':')).encode('utf-8') + b'\n'
+
+    def _set_priority(self, command, kind, value):
+        priority = int(command["priority"])
+        if not 0 <= priority <= 255:
+            raise CommandError("Priority out of range [0-255]: %d" % priority)
+        duration = int(command.get("duration", 0))
+        self._priorities[priority] = {"kind": kind, "value": value,
+                                      "expires": time.monotonic() + duration / 1000.0 if duration > 0 else None}
+
+    def _command_serverinfo(self, command):
+        return {"info": self.serverinfo()}
+
+    def _command_color(self, command):
+        values = [int(value) for value in command["color"]]
+        if not values or len(values) % 3 or not all(0 <= value <= 255 for value in values):
+            raise CommandError("Color must be a list of (r, g, b) values in [0-255]")
+        self._set_priority(command, "color", bytes(values))
+
+    def _command_image(self, command):
+        width, height = int(command["imagewidth"]), int(command["imageheight"])
+        try:
+            data = base64.b64decode(command["imagedata"], validate=True)
+        except binascii.Error:
+            raise CommandError("Image data is not valid base64")
+        if width <= 0 or height <= 0 or len(data) != width * height * 3:
+            raise CommandError("Size of image data does not match with the width and height")
+        self._set_priority(command, "image", (width, height, data))
+
+    def _command_effect(self, command):
+        name = command["effect"]["name"]
+        effect = self._effects_by_name.get(name)
+        if effect is None:
+            raise CommandError("Effect %s not found" % name)
+        args = command["effect"].get("args") or effect["args"]
+        self._set_priority(command, "effect", {"name": name, "script": effect["script"], "args": args})
+
+    def _command_clear(self, command):
+        self._priorities.pop(int(command["priority"]), None)
+
+    def _command_clearall(self, command):
+        self._priorities.clear()
+
+    def _update_calibration(self, section, values):
+        for entry in self._calibration[section]:
+            if entry["id"] == values.get("id", "default"):
+                entry.update((key, value) for key, value in values.items() if value is not None)
+                return
+        raise CommandError("%s with id %s not found" % (section.capitalize(), values.get("id")))
+
+    def _command_transform(self, command):
+        self._update_calibration("transform", command["transform"])
+
+    def _command_correction(self, command):
+        self._update_calibration("correction", command["correction"])
+
+    def _command_temperature(self, command):
+        self._update_calibration("temperature", command["temperature"])
+
+    def _command_adjustment(self, command):
+        self._update_calibration("adjustment", command["adjustment"])
+
+# -STATE-
+    def _expire(self):
+        """Drop the priorities whose duration elapsed."""
+        now = time.monotonic()
+        expired = [priority for priority, entry in list(self._priorities.items())
+                   if entry["expires"] is not None and entry["expires"] <= now]
+        for priority in expired:
+            self._priorities.pop(priority, None)
+        return now
+
+    def visible_priority(self):
+        """
+        Return the priority shown on the leds.
+
+        :return: the lowest priority value set, None if no priority is set
+        """
+        self._expire()
+        return min(self._priorities) if self._priorities else None
+
+    def serverinfo(self):
+        """
+        Return the "info" object of the serverinfo reply.
+
+        :return: json structure of the server state
+        """
+        now = self._expire()
+        priorities = []
+        active_effects = []
+        for priority in sorted(self._priorities):
+            entry = self._priorities[priority]
+            info = {"priority": priority}
+            if entry["expires"] is not None:
+                info["duration_ms"] = int((entry["expires"] - now) * 1000)
+            priorities.append(info)
+            if entry["kind"] == "effect":
+                active = {"script": entry["value"]["script"], "args": entry["value"]["args"],
+                          "priority": priority, "timeout": info.get("duration_ms", -1)}
+                active_effects.append(active)
+        active_color = []
+        visible = self._priorities.get(min(self._priorities)) if self._priorities else None
+        if visible is not None and visible["kind"] == "color" and len(visible["value"]) == 3:
+            red, green, blue = visible["value"]
+            hue, lightness, saturation = colorsys.rgb_to_hls(red / 255.0, green / 255.0, blue / 255.0)
+            active_color.append({"RGB Value": [red, green, blue],
+                                 "HEX Value": ["0x%02X%02X%02X" % (red, green, blue)],
+                                 "HLS Value": [hue * 360.0, lightness, saturation]})
+        info = {"hostname": self.hostname,
+                "hyperion_build": [{"version": "emulator", "time": ""}],
+                "priorities": priorities,
+                "effects": self._effects,
+                "activeEffects": active_effects,
+                "activeLedColor": active_color}
+        info.update(self._calibration)
+        return info
+
+    def led_colors(self):
+        """
+        Return the colors of the leds for the visible priority.
+
+        A color list is repeated over the leds, an image is averaged over the area of every led.
+        Effects are not run: their leds are black.
+
+        :return: bytes of led_count (r, g, b) values
+        """
+        count = self.led_count
+        priority = self.visible_priority()
+        entry = self._priorities.get(priority) if priority is not None else None
+        if entry is None or entry["kind"] == "effect" or not count:
+            return bytes(count * 3)
+        if entry["kind"] == "color":
+            pattern = entry["value"]
+            repeat = -(-count * 3 // len(pattern))
+            return (pattern * repeat)[:count * 3]
+        width, height, data = entry["value"]
+        colors = bytearray()
+        for hmin, hmax, vmin, vmax in self.layout:
+            x0, x1 = int(hmin * width), max(int(hmin * width) + 1, int(hmax * width))
+            y0, y1 = int(vmin * height), max(int(vmin * height) + 1, int(vmax * height))
+            x1, y1 = min(x1, width), min(y1, height)
+            sums = [0, 0, 0]
+            pixels = max(1, (x1 - x0) * (y1 - y0))
+            for y in range(y0, y1):
+                row = data[(y * width + x0) * 3:(y * width + x1) * 3]
+                for channel in range(3):
+                    sums[channel] += sum(row[channel::3])
+            colors += bytes(total // pixels for total in sums)
+        return bytes(colors)
+
+# -STATISTICS-
+    def clients(self):
+        """
+        Return the traffic of the connected clients.
+
+        :return: list of dicts with the address, the connection time in seconds, the numbers of
+                 commands, errors and bytes in/out and the commands and bytes per second
+        """
+        now = time.monotonic()
+        return [stats.report(now) for stats in list(self._clients.values())]
+
+    def stats(self):
+        """
+        Return the traffic of the server.
+
+        :return: dict with the number of commands, connected clients, closed connections and the
+                 reports of the connected and of the last 1000 closed clients (see clients)
+        """
+        return {"commands": self._commands,
+                "connected": len(self._clients),
+                "closed": self._closed_count,
+                "clients": self.clients(),
+                "closed_clients": list(self._closed_clients)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Emulate a hyperion json server.")
+    parser.add_argument("--config", help="hyperion configuration file (leds, effect paths, calibration, port)")
+    parser.add_argument("--host", default="127.0.0.1", help="ip address to bind")
+    parser.add_argument("--port", type=int, default=None, help="port to bind (default: json port of the config)")
+    args = parser.parse_args()
+    emulator = hyperion_emulator(args.config, args.host, args.port)
+    emulator.start()
+    print("hyperion emulator on %s:%d, %d leds, %d effects" % (emulator.address[:2] + (emulator.led_count,
+                                                                                     len(emulator.effects))))
+    try:
+        while True:
+            time.sleep(10)
+            stats = emulator.stats()
+            print("%d commands, %d clients" % (stats["commands"], stats["connected"]))
+    except KeyboardInterrupt:
+        emulator.stop()
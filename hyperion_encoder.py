@@ -0,0 +1,552 @@
+"""
+hyperion_encoder.py module.
+
+Encode the messages sent to the hyperion json interface.
+"""
+import functools
+import json
+import math
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# ascii representation of every byte value followed by the array separator
+_BYTE_ASCII = tuple(str(i).encode('ascii') + b',' for i in range(256))
+
+if np is not None:
+    # the same table padded to 4 bytes per value for the vectorized encoder
+    _BYTE_ASCII_PADDED = np.zeros((256, 4), dtype=np.uint8)
+    for _value, _text in enumerate(_BYTE_ASCII):
+        _BYTE_ASCII_PADDED[_value, :len(_text)] = tuple(_text)
+    _BYTE_ASCII_MASK = _BYTE_ASCII_PADDED != 0
+    del _value, _text
+
+# below this size the lookup table join is faster than the numpy gather
+_NUMPY_MIN_SIZE = 512
+
+
+def led_bytes(led_data):
+    """
+    Return the led data as a flat bytes-like object.
+
+    :param led_data: bytes, bytearray, memoryview, numpy uint8 array or sequence of ints [0-255]
+    :return: bytes-like object with one byte per color value
+    """
+    if isinstance(led_data, (bytes, bytearray)):
+        return led_data
+    if isinstance(led_data, memoryview):
+        return led_data.cast('B') if led_data.format != 'B' or led_data.ndim != 1 else led_data
+    if np is not None and isinstance(led_data, np.ndarray):
+        if led_data.dtype != np.uint8:
+            raise TypeError("led data array must have dtype uint8, not %s" % led_data.dtype)
+        return np.ascontiguousarray(led_data).reshape(-1)
+    return bytes(led_data)
+
+
+class led_data_encoder:
+    """
+    Encoder of the led data color messages.
+
+    The message is written into a buffer that is reused for every frame, so encoding a frame
+    does not allocate a new string for every color value.
+    """
+
+    def __init__(self):
+        """Led_data_encoder initializer."""
+        self._buffer = bytearray()
+
+    def encode_values(self, led_data):
+        """
+        Encode the color values as the content of a json array.
+
+        :param led_data: led data accepted by led_bytes
+        :return: ascii bytes of the comma separated color values
+        """
+        data = led_bytes(led_data)
+        if not len(data):
+            return b''
+        if np is not None and len(data) >= _NUMPY_MIN_SIZE:
+            values = np.frombuffer(data, dtype=np.uint8) if not isinstance(data, np.ndarray) else data
+            return _BYTE_ASCII_PADDED[values][_BYTE_ASCII_MASK[values]][:-1].tobytes()
+        return b''.join(map(_BYTE_ASCII.__getitem__, data))[:-1]
+
+    def encode(self, led_data, priority=100, duration=0, tan=None):
+        """
+        Encode a led data color message.
+
+        :param led_data: led data accepted by led_bytes
+        :param priority: priority value
+        :param duration: duration in milliseconds
+        :param tan: "tan" id echoed by the server in its reply, None -> no tan
+        :return: memoryview of the message, valid until the next call to encode
+        """
+        buffer = self._buffer
+        try:
+            del buffer[:]
+        except BufferError:
+            # a view of the previous message is still alive: leave it untouched
+            buffer = self._buffer = bytearray()
+        buffer += b'{"color":['
+        buffer += self.encode_values(led_data)
+        buffer += b'],"command":"color","priority":%d' % int(priority)
+        if duration > 0:
+            buffer += b',"duration":%d' % int(duration)
+        if tan is not None:
+            buffer += b',"tan":%d' % tan
+        buffer += b'}\n'
+        return memoryview(buffer)
+
+
+# Hyperion json commands: command name -> fields as (argument name, json path, type, required).
+# The fields are written in this order, the fields of a nested object must be consecutive.
+COMMAND_SCHEMA = {
+    "serverinfo": (),
+    "clearall": (),
+    "clear": (
+        ("priority", "priority", "int", True),
+    ),
+    "color": (
+        ("priority", "priority", "int", True),
+        ("color", "color", "rgb", True),
+        ("duration", "duration", "duration", False),
+    ),
+    "effect": (
+        ("effectName", "effect.name", "str", True),
+        ("effectArgs", "effect.args", "json", False),
+        ("priority", "priority", "int", True),
+        ("duration", "duration", "duration", False),
+    ),
+    "image": (
+        ("width", "imagewidth", "int", True),
+        ("height", "imageheight", "int", True),
+        ("image_data", "imagedata", "base64", True),
+        ("priority", "priority", "int", True),
+        ("duration", "duration", "duration", False),
+    ),
+    "transform": (
+        ("identifier", "transform.id", "str", True),
+        ("blacklevel", "transform.blacklevel", "float3", False),
+        ("gamma", "transform.gamma", "float3", False),
+        ("luminanceGain", "transform.luminanceGain", "float", False),
+        ("luminanceMinimum", "transform.luminanceMinimum", "float", False),
+        ("saturationGain", "transform.saturationGain", "float", False),
+        ("saturationLGain", "transform.saturationLGain", "float", False),
+        ("threshold", "transform.threshold", "float3", False),
+        ("valueGain", "transform.valueGain", "float", False),
+        ("whitelevel", "transform.whitelevel", "float3", False),
+    ),
+    "correction": (
+        ("identifier", "correction.id", "str", True),
+        ("correctionValues", "correction.correctionValues", "rgb", True),
+    ),
+    "temperature": (
+        ("identifier", "temperature.id", "str", True),
+        ("correctionValues", "temperature.correctionValues", "rgb", True),
+    ),
+    "adjustment": (
+        ("identifier", "adjustment.id", "str", True),
+        ("redAdjust", "adjustment.redAdjust", "rgb", True),
+        ("greenAdjust", "adjustment.greenAdjust", "rgb", True),
+        ("blueAdjust", "adjustment.blueAdjust", "rgb", True),
+    ),
+}
+
+
+@functools.lru_cache(maxsize=1024)
+def _json_str(value):
+    """Return a json string, the identifiers and names repeat so they are cached."""
+    return json.dumps(value).encode('utf-8')
+
+
+def _as_str(value):
+    return _json_str(value if isinstance(value, str) else str(value))
+
+
+# json.dumps builds a new encoder for every call with non-default separators
+_compact_json = json.JSONEncoder(separators=(',', ':')).encode
+
+
+def _as_json(value):
+    return _compact_json(value).encode('utf-8')
+
+
+def _as_base64(value):
+    return value.encode('ascii') if isinstance(value, str) else bytes(value)
+
+
+def _as_float(value):
+    value = float(value)
+    if not math.isfinite(value):
+        raise ValueError("expected a finite number, got %r" % value)
+    return value
+
+
+def _as_int(value):
+    # strings would take % 1 for a formatting
+    if isinstance(value, (bool, str, bytes)) or value % 1:
+        raise ValueError("expected an integer, got %r" % (value,))
+    return int(value)
+
+
+def _check_rgb(value):
+    if len(value) != 3:
+        raise ValueError("expected 3 color values, got %r" % (value,))
+    for channel in value:
+        if isinstance(channel, bool) or channel % 1 or not 0 <= channel <= 255:
+            raise ValueError("expected color values in [0-255], got %r" % (value,))
+
+
+# per field type: json placeholder, validation statement and formatted arguments of the value {v}
+_FIELD_TYPES = {
+    "int": ("%d", "if {v}.__class__ is not int: {v} = _as_int({v})", "{v},"),
+    "duration": ("%d", "if {v}.__class__ is not int: {v} = _as_int({v})", "{v},"),
+    "rgb": ("[%d,%d,%d]", "if len({v}) != 3 or not (0 <= {v}[0] <= 255 and 0 <= {v}[1] <= 255 and 0 <= {v}[2] <= 255)"
+                          " or {v}[0] % 1 or {v}[1] % 1 or {v}[2] % 1: _check_rgb({v})", "{v}[0], {v}[1], {v}[2],"),
+    "float": ("%a", "{v} = _as_float({v})", "{v},"),
+    "float3": ("[%a,%a,%a]", "if len({v}) != 3: raise ValueError('expected 3 values, got %r' % ({v},))\n"
+                             "{v} = _as_float({v}[0]), _as_float({v}[1]), _as_float({v}[2])", "{v}[0], {v}[1], {v}[2],"),
+    "str": ("%s", "{v} = _as_str({v})", "{v},"),
+    "base64": ('"%s"', "{v} = _as_base64({v})", "{v},"),
+    "json": ("%s", "{v} = _as_json({v})", "{v},"),
+}
+
+# above this number of optional fields the encoder builds the values at run time instead of
+# having one return statement per combination of the optional fields
+_MAX_BRANCHED_OPTIONALS = 3
+
+
+class command_template:
+    """
+    Precompiled byte template of a hyperion json command.
+
+    The constant parts of the message are joined once for every combination of the optional
+    fields and the validation of the fields is compiled into a function per command, so encoding
+    a command only checks and formats its variable fields.
+    """
+
+    def __init__(self, name, fields):
+        """
+        Command_template initializer.
+
+        :param name: command name
+        :param fields: fields of the command as in COMMAND_SCHEMA
+        """
+        self.name = name
+        self.fields = tuple(fields)
+        for field in self.fields:
+            if len(field[1].split('.')) > 2:
+                raise ValueError("Only one level of nesting is supported: %s" % field[1])
+            if field[2] not in _FIELD_TYPES:
+                raise ValueError("Unknown field type %r" % field[2])
+        self._templates = {}
+        self.encode = self._compile_function()
+
+    def template(self, mask):
+        """
+        Return the template of the message with the given fields.
+
+        :param mask: bit mask of the optional fields written in the message
+        :return: bytes template with the placeholders of the written fields
+        """
+        template = self._templates.get(mask)
+        if template is not None:
+            return template
+        parts = ['{"command":"%s"' % self.name]
+        group = None
+        optional = 0
+        for field in self.fields:
+            if not field[3]:
+                written = mask >> optional & 1
+                optional += 1
+                if not written:
+                    continue
+            path = field[1].split('.')
+            field_group = path[0] if len(path) == 2 else None
+            if field_group != group:
+                if group is not None:
+                    parts.append('}')
+                if field_group is not None:
+                    parts.append(',"%s":{' % field_group)
+                group = field_group
+                separator = ',' if field_group is None else ''
+            else:
+                separator = ','
+            parts.append('%s"%s":%s' % (separator, path[-1], _FIELD_TYPES[field[2]][0]))
+        if group is not None:
+            parts.append('}')
+        parts.append('}\n')
+        template = self._templates[mask] = ''.join(parts).encode('utf-8')
+        return template
+
+    def _compile_function(self):
+        """
+        Generate the encoding function of the command.
+
+        All the fields are validated in a single try block, then a return statement per
+        combination of the optional fields formats the values into its precomputed template.
+
+        :return: function taking the fields by argument name and returning the message bytes
+        """
+        namespace = {"_templates": self._templates, "_template": self.template,
+                     "_as_int": _as_int, "_as_float": _as_float, "_as_str": _as_str, "_as_json": _as_json,
+                     "_as_base64": _as_base64, "_check_rgb": _check_rgb}
+        arguments = ', '.join('%s=None' % field[0] for field in self.fields)
+        lines = ['def encode_%s(%s):' % (self.name, arguments)]
+        if not self.fields:
+            namespace["_TEMPLATE"] = self.template(0)
+            lines.append('    return _TEMPLATE')
+        else:
+            for argument, _, _, required in self.fields:
+                if required:
+                    lines.append('    if %s is None: raise ValueError("%s: missing required field %s")'
+                                 % (argument, self.name, argument))
+            lines.append('    try:')
+            optionals = []
+            for argument, _, field_type, required in self.fields:
+                lines.append('        field = "%s"' % argument)
+                check = _FIELD_TYPES[field_type][1].format(v=argument).split('\n')
+                if required:
+                    lines.extend('        %s' % statement for statement in check)
+                else:
+                    lines.append('        if %s is not None:' % argument)
+                    lines.extend('            %s' % statement for statement in check)
+                    # a duration of 0 or less means no duration
+                    optionals.append('%s is not None and %s > 0' % (argument, argument) if field_type == "duration"
+                                     else '%s is not None' % argument)
+            lines.append('    except (TypeError, ValueError) as exc:')
+            lines.append('        raise ValueError("%s: invalid %%s: %%s" %% (field, exc))' % self.name)
+            if len(optionals) <= _MAX_BRANCHED_OPTIONALS:
+                lines.extend(self._branches(optionals, 0, 0, namespace, '    '))
+            else:
+                lines.extend(self._values(optionals))
+        exec('\n'.join(lines), namespace)
+        return namespace['encode_%s' % self.name]
+
+    def _formatted(self, mask):
+        """Return the formatted values of the fields written with a mask of the optional fields."""
+        values = []
+        optional = 0
+        for argument, _, field_type, required in self.fields:
+            if not required:
+                written = mask >> optional & 1
+                optional += 1
+                if not written:
+                    continue
+            values.append(_FIELD_TYPES[field_type][2].format(v=argument))
+        return ' '.join(values)
+
+    def _branches(self, conditions, index, mask, namespace, indent):
+        """Generate the return statements of the combinations of the optional fields from index."""
+        if index == len(conditions):
+            name = "_TEMPLATE_%d" % mask
+            namespace[name] = self.template(mask)
+            return ['%sreturn %s %% (%s)' % (indent, name, self._formatted(mask))]
+        lines = ['%sif %s:' % (indent, conditions[index])]
+        lines.extend(self._branches(conditions, index + 1, mask | 1 << index, namespace, indent + '    '))
+        lines.extend(self._branches(conditions, index + 1, mask, namespace, indent))
+        return lines
+
+    def _values(self, conditions):
+        """Generate the statements building the values and the mask of the optional fields at run time."""
+        lines = ['    mask = 0', '    values = ()']
+        optional = 0
+        for argument, _, field_type, required in self.fields:
+            formatted = _FIELD_TYPES[field_type][2].format(v=argument)
+            if required:
+                lines.append('    values += (%s)' % formatted)
+            else:
+                lines.append('    if %s:' % conditions[optional])
+                lines.append('        mask |= %d' % (1 << optional))
+                lines.append('        values += (%s)' % formatted)
+                optional += 1
+        lines.append('    return (_templates.get(mask) or _template(mask)) % values')
+        return lines
+
+
+class command_encoder:
+    """
+    Encoder of the hyperion json commands described by a schema.
+
+    Every command is also available as a method taking its fields by argument name,
+    e.g. encoder.color(priority=100, color=(255, 0, 0)).
+    """
+
+    def __init__(self, schema=None):
+        """
+        Command_encoder initializer.
+
+        :param schema: dict of command name -> fields, COMMAND_SCHEMA by default
+        """
+        schema = COMMAND_SCHEMA if schema is None else schema
+        self._templates = {name: command_template(name, fields) for name, fields in schema.items()}
+        for name, template in self._templates.items():
+            setattr(self, name, template.encode)
+
+    def encode(self, command, **values):
+        """
+        Encode a command.
+
+        :param command: command name
+        :param values: values of the fields of the command by argument name
+        :return: json-formatted message bytes
+        """
+        try:
+            template = self._templates[command]
+        except KeyError:
+            raise ValueError("Unknown hyperion command %r" % command)
+        return template.encode(**values)
+
+
+_default_encoder = command_encoder()
+
+
+def encode_command(command, **values):
+    """
+    Encode a command with the default schema.
+
+    :param command: command name
+    :param values: values of the fields of the command by argument name
+    :return: json-formatted message bytes
+    """
+    return _default_encoder.encode(command, **values)
+
+
+def benchmark_led_data(led_counts=(1000, 10000, 100000), seconds=1.0):
+    """
+    Measure the frames per second sustained by led_data_encoder.
+
+    :param led_counts: numbers of leds of the encoded frames
+    :param seconds: time spent encoding each frame size
+    :return: dict of led count -> frames per second
+    """
+    encoder = led_data_encoder()
+    results = {}
+    for count in led_counts:
+        frame = bytes(i % 256 for i in range(count * 3))
+        frames = 0
+        begin = time.perf_counter()
+        while True:
+            encoder.encode(frame)
+            frames += 1
+            elapsed = time.perf_counter() - begin
+            if elapsed >= seconds:
+                break
+        results[count] = frames / elapsed
+    return results
+
+
+def _legacy_message(command, values):
+    """Build a message with the string concatenations used before the command templates."""
+    if command == "color":
+        message = '{"command":"color", "priority":' + str(values["priority"]) + ', '
+        message += '"color":[' + str(values["color"][0]) + ',' + str(values["color"][1]) + ',' + str(values["color"][2]) + ']'
+        if values.get("duration", 0) > 0:
+            message += ', "duration":' + str(values["duration"])
+        return message + '}\n'
+    if command == "effect":
+        message = '{"command":"effect","effect":{"name":"' + str(values["effectName"])
+        if values.get("effectArgs"):
+            message += '", "args":' + str(values["effectArgs"])
+        message += '"},"priority":' + str(values["priority"])
+        if values.get("duration", 0) > 0:
+            message += ', "duration":' + str(values["duration"])
+        return message + '}\n'
+    if command == "clear":
+        return '{"command":"clear","priority":' + str(values["priority"]) + '}\n'
+    if command == "image":
+        message = '{"command":"image","imagewidth":' + str(values["width"])
+        message += ',"imageheight":' + str(values["height"])
+        message += ',"imagedata":"' + str(values["image_data"]) + '"'
+        message += ',"priority":' + str(values["priority"])
+        return message + '}\n'
+    if command == "transform":
+        message = '{"command":"transform","transform":{'
+        for key in ("blacklevel", "gamma"):
+            message += '"' + key + '":[' + str(values[key][0]) + ',' + str(values[key][1]) + ',' + str(values[key][2]) + '],'
+        message += '"id":"' + str(values["identifier"]) + '"'
+        for key in ("luminanceGain", "luminanceMinimum", "saturationGain", "saturationLGain"):
+            message += ',"' + key + '":' + str(values[key])
+        message += ',"threshold":[' + str(values["threshold"][0]) + ',' + str(values["threshold"][1]) + ',' + str(values["threshold"][2])
+        message += '],"valueGain":' + str(values["valueGain"])
+        message += ',"whitelevel":[' + str(values["whitelevel"][0]) + ',' + str(values["whitelevel"][1]) + ',' + str(values["whitelevel"][2])
+        return message + ']}}\n'
+    if command in ("correction", "temperature"):
+        message = '{"command":"' + command + '","' + command + '":{'
+        message += '"correctionValues":[' + str(values["correctionValues"][0]) + ',' + str(values["correctionValues"][1]) + ',' + str(values["correctionValues"][2])
+        message += '],"id":"' + str(values["identifier"])
+        return message + '"}}\n'
+    if command == "adjustment":
+        message = '{"command":"adjustment","adjustment":{"id":"' + str(values["identifier"])
+        for key in ("redAdjust", "greenAdjust", "blueAdjust"):
+            message += '","' + key + '":[' + str(values[key][0]) + ',' + str(values[key][1]) + ',' + str(values[key][2])
+        return message + ']}}\n'
+    return '{"command":"' + command + '"}\n'
+
+
+def _json_message(command, values):
+    """Build a message with json.dumps from the paths of the schema, without validation."""
+    message = {"command": command}
+    for argument, path, field_type, required in COMMAND_SCHEMA[command]:
+        value = values.get(argument)
+        if value is None or (field_type == "duration" and value <= 0):
+            continue
+        path = path.split('.')
+        target = message.setdefault(path[0], {}) if len(path) == 2 else message
+        target[path[-1]] = list(value) if field_type in ("rgb", "float3") else value
+    return json.dumps(message) + '\n'
+
+
+# sample arguments of every command for benchmark_commands
+_BENCHMARK_VALUES = {
+    "serverinfo": {},
+    "clearall": {},
+    "clear": {"priority": 100},
+    "color": {"priority": 100, "color": (255, 128, 0), "duration": 1000},
+    "effect": {"effectName": "Rainbow swirl fast", "effectArgs": {"rotation-time": 3.0, "brightness": 1.0},
+               "priority": 100, "duration": 1000},
+    "image": {"width": 8, "height": 8, "image_data": "AAAA" * 64, "priority": 100},
+    "transform": {"identifier": "default", "blacklevel": (0.0, 0.0, 0.0), "gamma": (2.2, 2.2, 2.2),
+                  "luminanceGain": 1.0, "luminanceMinimum": 0.0, "saturationGain": 1.0, "saturationLGain": 1.0,
+                  "threshold": (0.0, 0.0, 0.0), "valueGain": 1.0, "whitelevel": (1.0, 1.0, 1.0)},
+    "correction": {"identifier": "default", "correctionValues": (255, 240, 230)},
+    "temperature": {"identifier": "default", "correctionValues": (255, 255, 250)},
+    "adjustment": {"identifier": "default", "redAdjust": (255, 0, 0), "greenAdjust": (0, 255, 0),
+                   "blueAdjust": (0, 0, 255)},
+}
+
+
+def benchmark_commands(repeat=20000):
+    """
+    Compare the command templates with json.dumps and with the string concatenations they replaced.
+
+    :param repeat: number of messages encoded per command and method
+    :return: dict of command name -> (template, json.dumps, legacy) microseconds per message
+    """
+    results = {}
+    for command, values in _BENCHMARK_VALUES.items():
+        encode = getattr(_default_encoder, command)
+        begin = time.perf_counter()
+        for _ in range(repeat):
+            encode(**values)
+        template_time = (time.perf_counter() - begin) / repeat * 1e6
+        begin = time.perf_counter()
+        for _ in range(repeat):
+            _json_message(command, values).encode('utf-8')
+        json_time = (time.perf_counter() - begin) / repeat * 1e6
+        begin = time.perf_counter()
+        for _ in range(repeat):
+            _legacy_message(command, values).encode('utf-8')
+        legacy_time = (time.perf_counter() - begin) / repeat * 1e6
+        results[command] = (template_time, json_time, legacy_time)
+    return results
+
+
+if __name__ == '__main__':
+    for count, fps in benchmark_led_data().items():
+        print("%7d leds: %10.1f frames/s" % (count, fps))
+    print("%-12s %14s %14s %14s" % ("command", "template [us]", "json [us]", "legacy [us]"))
+    for command, (template_time, json_time, legacy_time) in benchmark_commands().items():
+        print("%-12s %14.2f %14.2f %14.2f" % (command, template_time, json_time, legacy_time))
@@ -0,0 +1,272 @@
+"""
+hyperion_group.py module.
+
+Send the same commands to several hyperion json servers in parallel.
+"""
+import collections
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from hyperion_client import hyperion_client
+from hyperion_encoder import led_bytes
+
+# commands carrying a frame: a newer frame replaces them, the others change the server state
+FRAME_METHODS = ("send_led_data", "set_image")
+# state commands waiting for a busy server, the oldest are dropped beyond it
+MAX_QUEUED_COMMANDS = 8
+
+
+class _group_member:
+    """A hyperion server of the group, with its own sender thread and statistics."""
+
+    def __init__(self, host, port, leds=None):
+        self.client = hyperion_client(host, port)
+        self.leds = leds
+        self.executor = None
+        self.future = None
+        self.queued = collections.deque()
+        self.latency = None
+        self.sent = 0
+        self.skipped = 0
+        self.dropped = 0
+        self.errors = 0
+        self.last_error = None
+
+    @property
+    def busy(self):
+        return self.future is not None and not self.future.done()
+
+    def submit(self, method, args, kwargs):
+        """
+        Queue a client method call on the sender thread, started on first use.
+
+        A state command waiting behind MAX_QUEUED_COMMANDS others cancels the oldest of them.
+
+        :return: future of the call
+        """
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="hyperion_group %s" % self.client.host)
+        if method not in FRAME_METHODS:
+            # the commands already taken by the sender thread cannot be cancelled anymore
+            while self.queued and (self.queued[0].running() or self.queued[0].done()):
+                self.queued.popleft()
+            if len(self.queued) >= MAX_QUEUED_COMMANDS and self.queued.popleft().cancel():
+                self.dropped += 1
+        self.future = self.executor.submit(self.run, method, args, kwargs)
+        if method not in FRAME_METHODS:
+            self.queued.append(self.future)
+        return self.future
+
+    def shutdown(self):
+        """Stop the sender thread after the queued calls, a later call starts a new one."""
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+            self.queued.clear()
+
+    def run(self, method, args, kwargs):
+        """Call a client method and record its latency or its error."""
+        begin = time.perf_counter()
+        try:
+            getattr(self.client, method)(*args, **kwargs)
+        except Exception as exc:
+            self.errors += 1
+            self.last_error = exc
+            raise
+        if not self.client.connected and method != "close_connection":
+            # the client keeps the command queued until it reconnects
+            self.errors += 1
+            self.last_error = self.client.health()["last_error"]
+            raise ConnectionError("Not connected to %s:%d" % (self.client.host, self.client.port))
+        self.latency = time.perf_counter() - begin
+        self.sent += 1
+
+
+class hyperion_group:
+    """
+    Group of hyperion json servers driven as one.
+
+    Every command is sent to all the servers in parallel: each server has its own sender thread,
+    so a slow or dead server does not delay the others. A frame for a server that is still busy
+    with the previous command is skipped for that server instead of being queued. The commands
+    changing the server state (colors, effects, clears...) are queued behind it, at most
+    MAX_QUEUED_COMMANDS per server: a server that stays busy loses the oldest ones (counted as
+    dropped by report) and receives the newest ones late, when it answers again.
+    """
+
+    def __init__(self, endpoints, timeout=1.0):
+        """
+        Hyperion_group initializer.
+
+        :param endpoints: list of (host, port) or (host, port, (first, last)) tuples, the optional
+                          range selects the leds [first, last) of the frames sent to that server
+        :param timeout: time in seconds a command waits for the servers before returning
+        """
+        self._members = []
+        for endpoint in endpoints:
+            host, port = endpoint[0], endpoint[1]
+            leds = tuple(endpoint[2]) if len(endpoint) > 2 and endpoint[2] is not None else None
+            self._members.append(_group_member(host, port, leds))
+        self.timeout = float(timeout)
+
+    @property
+    def clients(self):
+        """
+        Return the clients of the group.
+
+        :return: list of hyperion_client, one per endpoint
+        """
+        return [member.client for member in self._members]
+
+    def open_connection(self, timeout=10):
+        """
+        Open the connections to all the servers in parallel.
+
+        :param timeout: timeout in seconds of each connection
+        :return: report of the group (see report)
+        """
+        self._broadcast("open_connection", [((), {"timeout": timeout})] * len(self._members), timeout)
+        return self.report()
+
+    def close_connection(self, clean=False):
+        """
+        Close the connections to all the servers, the group can be opened again.
+
+        :param clean: if True -> clear all the effects/color on disconnection
+        """
+        self._broadcast("close_connection", [((clean,), {})] * len(self._members), self.timeout)
+
+    def shutdown(self, clean=False):
+        """
+        Close the connections and stop the sender threads once the queued commands are sent.
+
+        :param clean: if True -> clear all the effects/color on disconnection
+        """
+        self.close_connection(clean)
+        for member in self._members:
+            member.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
+
+    def _broadcast(self, method, calls, timeout=None):
+        """
+        Call a client method on all the servers in parallel.
+
+        :param method: name of the hyperion_client method
+        :param calls: list of (args, kwargs) per member, None -> skip the member
+        :param timeout: time in seconds to wait for the servers, None -> self.timeout
+        :return: number of servers that completed the call in time
+        """
+        futures = []
+        for member, call in zip(self._members, calls):
+            if call is None:
+                continue
+            if method in FRAME_METHODS and member.busy:
+                # latest wins: the next frame replaces this one
+                member.skipped += 1
+                continue
+            futures.append(member.submit(method, call[0], call[1]))
+        done, _ = wait(futures, self.timeout if timeout is None else timeout)
+        # a command can be dropped by a later call from another thread meanwhile
+        return sum(1 for future in done if not future.cancelled() and future.exception() is None)
+
+    def _same_call(self, *args, **kwargs):
+        return [(args, kwargs)] * len(self._members)
+
+    def report(self):
+        """
+        Return the state of every server.
+
+        :return: list of dicts with host, port, leds range, connection status, latency in seconds
+                 of the last command, number of sent/skipped/dropped/failed commands and last error
+        """
+        return [{"host": member.client.host,
+                 "port": member.client.port,
+                 "leds": member.leds,
+                 "connected": member.client.connected,
+                 "busy": member.busy,
+                 "latency": member.latency,
+                 "sent": member.sent,
+                 "skipped": member.skipped,
+                 "dropped": member.dropped,
+                 "errors": member.errors,
+                 "last_error": member.last_error}
+                for member in self._members]
+
+###############################################################################
+
+    def send_led_data(self, led_data, priority=100, duration=0):
+        """
+        Send a frame to all the servers, sliced by the leds range of each server.
+
+        :param led_data: led data (r,g,b) * ledcount accepted by hyperion_client.send_led_data
+        :param priority: priority value
+        :param duration: duration in milliseconds
+        :return: number of servers that received the frame in time
+        """
+        data = led_bytes(led_data)
+        calls = []
+        for member in self._members:
+            frame = data if member.leds is None else data[member.leds[0] * 3:member.leds[1] * 3]
+            # the sender threads run after this call returned: do not share the caller buffer
+            calls.append(((bytes(frame), priority, duration), {}))
+        return self._broadcast("send_led_data", calls)
+
+    def set_RGBcolor(self, red, green, blue, priority=100, duration=0):
+        """
+        Send color to all the servers.
+
+        :param red: red value in RGB format [0-255]
+        :param green: green value in RGB format [0-255]
+        :param blue: blue value in RGB format [0-255]
+        :param priority: priority value
+        :param duration: duration in milliseconds
+        :return: number of servers that received the command in time
+        """
+        return self._broadcast("set_RGBcolor", self._same_call(red, green, blue, priority, duration))
+
+    def set_effect(self, effectName, priority=100, effectArgs=None, duration=0):
+        """
+        Send effect to all the servers.
+
+        :param effectName: Name of the effect
+        :param priority: priority value
+        :param effectArgs: Custom arguments for the effect
+        :param duration: duration in milliseconds
+        :return: number of servers that received the command in time
+        """
+        return self._broadcast("set_effect", self._same_call(effectName, priority, effectArgs, duration))
+
+    def set_image(self, image_data, width, height, priority=100, duration=0):
+        """
+        Send an image to all the servers.
+
+        :param image_data: image data accepted by hyperion_client.set_image
+        :param width: width of the image
+        :param height: height of the image
+        :param priority: priority value
+        :param duration: duration in milliseconds
+        :return: number of servers that received the command in time
+        """
+        return self._broadcast("set_image", self._same_call(image_data, width, height, priority, duration))
+
+    def clear(self, priority=100):
+        """
+        Clear a priority on all the servers.
+
+        :param priority: clear priority value
+        :return: number of servers that received the command in time
+        """
+        return self._broadcast("clear", self._same_call(priority))
+
+    def clear_all(self):
+        """
+        Clear all the effects/color on all the servers.
+
+        :return: number of servers that received the command in time
+        """
+        return self._broadcast("clear_all", self._same_call())
@@ -0,0 +1,211 @@
+"""
+hyperion_image.py module.
+
+Downscale and encode the images sent to the hyperion json interface.
+"""
+import base64
+import collections
+import threading
+import time
+from concurrent.futures import Future
+
+from hyperion_encoder import encode_command
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# size of the hyperion framegrabber images: larger images carry no extra information
+IMAGE_SIZE = (64, 64)
+
+
+def image_array(image_data, width, height):
+    """
+    Return RGB888 image data as an array.
+
+    :param image_data: bytes-like or numpy uint8 array of width * height * 3 values
+    :param width: width of the image
+    :param height: height of the image
+    :return: numpy uint8 array of shape (height, width, 3)
+    """
+    if np is None:
+        raise ImportError("numpy is required to process raw images")
+    if isinstance(image_data, np.ndarray):
+        if image_data.dtype != np.uint8:
+            raise TypeError("image array must have dtype uint8, not %s" % image_data.dtype)
+        array = image_data
+    else:
+        array = np.frombuffer(image_data, dtype=np.uint8)
+    if array.size != width * height * 3:
+        raise ValueError("Image data size %d does not match %dx%d RGB888" % (array.size, width, height))
+    return array.reshape(height, width, 3)
+
+
+def area_average(image, target_width, target_height):
+    """
+    Downscale an image by averaging the pixels covered by each target pixel.
+
+    The image is never upscaled: a dimension smaller than the target is kept.
+
+    :param image: numpy uint8 array of shape (height, width, 3)
+    :param target_width: maximum width of the result
+    :param target_height: maximum height of the result
+    :return: numpy uint8 array of shape (min(height, target_height), min(width, target_width), 3)
+    """
+    height, width = image.shape[:2]
+    target_width = min(width, int(target_width))
+    target_height = min(height, int(target_height))
+    if (target_width, target_height) == (width, height):
+        return image
+    if width % target_width == 0 and height % target_height == 0:
+        # integer factors: every target pixel covers a whole block
+        blocks = image.reshape(target_height, height // target_height, target_width, width // target_width, 3)
+        return blocks.mean(axis=(1, 3), dtype=np.float32).round().astype(np.uint8)
+    rows = np.linspace(0, height, target_height + 1).astype(np.intp)
+    cols = np.linspace(0, width, target_width + 1).astype(np.intp)
+    sums = np.add.reduceat(np.add.reduceat(image, rows[:-1], axis=0, dtype=np.uint32), cols[:-1], axis=1)
+    counts = np.outer(np.diff(rows), np.diff(cols))[:, :, np.newaxis]
+    return (sums / counts).round().astype(np.uint8)
+
+
+def encode_image_message(image, priority=100, duration=0):
+    """
+    Encode an image json message.
+
+    :param image: numpy uint8 array of shape (height, width, 3)
+    :param priority: priority value
+    :param duration: duration in milliseconds
+    :return: bytes of the message
+    """
+    height, width = image.shape[:2]
+    return encode_command("image", width=width, height=height,
+                          image_data=base64.b64encode(np.ascontiguousarray(image).data),
+                          priority=priority, duration=duration)
+
+
+class image_encoder:
+    """
+    Background image encoder.
+
+    The images are downscaled and encoded by a worker thread, so the capture loop never waits for
+    the encoding. Latest wins: a single image waits for the worker, an image submitted while
+    another one is waiting replaces it and the future of the replaced image is cancelled.
+    """
+
+    def __init__(self, size=IMAGE_SIZE, window=100):
+        """
+        Image_encoder initializer.
+
+        :param size: (width, height) maximum size of the encoded images, None -> keep the size
+        :param window: number of frames used to compute the statistics
+        """
+        self.size = size
+        self._slot = threading.Condition()
+        self._pending = None
+        self._running = True
+        self._thread = None
+        self._dropped = 0
+        self._encode_times = collections.deque(maxlen=window)
+        self._done_times = collections.deque(maxlen=window)
+        self._frames = 0
+
+    def encode(self, image_data, width, height, priority=100, duration=0):
+        """
+        Downscale and encode an image in the calling thread.
+
+        :param image_data: raw RGB888 image data (bytes-like or numpy uint8 array)
+        :param width: width of the image
+        :param height: height of the image
+        :param priority: priority value
+        :param duration: duration in milliseconds
+        :return: bytes of the json message
+        """
+        begin = time.perf_counter()
+        image = image_array(image_data, width, height)
+        if self.size is not None:
+            image = area_average(image, *self.size)
+        message = encode_image_message(image, priority, duration)
+        end = time.perf_counter()
+        self._encode_times.append(end - begin)
+        self._done_times.append(end)
+        self._frames += 1
+        return message
+
+    def submit(self, image_data, width, height, priority=100, duration=0):
+        """
+        Downscale and encode an image in the worker thread.
+
+        :param image_data: raw RGB888 image data, it must not be modified until the future is done
+        :param width: width of the image
+        :param height: height of the image
+        :param priority: priority value
+        :param duration: duration in milliseconds
+        :return: future of the bytes of the json message, cancelled if a newer image replaces it
+                 before the worker takes it
+        """
+        future = Future()
+        with self._slot:
+            if not self._running:
+                raise RuntimeError("Image encoder is shut down")
+            replaced = self._pending
+            self._pending = (future, (image_data, width, height, priority, duration))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="hyperion image encoder", daemon=True)
+                self._thread.start()
+            self._slot.notify()
+        if replaced is not None:
+            self._dropped += 1
+            replaced[0].cancel()
+        return future
+
+    def _run(self):
+        """Worker thread: encode the waiting image until shut down."""
+        while True:
+            with self._slot:
+                while self._pending is None and self._running:
+                    self._slot.wait()
+                if self._pending is None:
+                    return
+                future, args = self._pending
+                self._pending = None
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                message = self.encode(*args)
+            except Exception as exc:
+                future.set_exception(exc)
+            else:
+                future.set_result(message)
+
+    def stats(self):
+        """
+        Return the encoding statistics over the last frames.
+
+        :return: dict with the number of encoded frames, the number of frames replaced before
+                 being encoded, the average and last encode time per frame in seconds and the
+                 achieved frames per second
+        """
+        encode_times = list(self._encode_times)
+        done_times = list(self._done_times)
+        fps = 0.0
+        if len(done_times) > 1 and done_times[-1] > done_times[0]:
+            fps = (len(done_times) - 1) / (done_times[-1] - done_times[0])
+        return {"frames": self._frames,
+                "dropped": self._dropped,
+                "encode_time": sum(encode_times) / len(encode_times) if encode_times else 0.0,
+                "last_encode_time": encode_times[-1] if encode_times else 0.0,
+                "fps": fps}
+
+    def shutdown(self, wait=True):
+        """
+        Stop the worker thread.
+
+        :param wait: if True -> wait for the waiting image to be encoded
+        """
+        with self._slot:
+            self._running = False
+            self._slot.notify()
+            thread = self._thread
+        if wait and thread is not None and thread is not threading.current_thread():
+            thread.join()
@@ -0,0 +1,235 @@
+"""
+hyperion_metrics.py module.
+
+Count the commands sent to a hyperion server and measure their latencies.
+"""
+import bisect
+import threading
+
+# upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5)
+# latencies measured for every command
+STAGES = ("encode", "send", "reply")
+
+
+class histogram:
+    """Distribution of measured values over fixed buckets."""
+
+    __slots__ = ("bounds", "counts", "count", "sum")
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        """
+        Histogram initializer.
+
+        :param bounds: sorted upper bounds of the buckets, values above the last bound are only counted
+        """
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        """
+        Add a value.
+
+        :param value: measured value
+        """
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """
+        Return an estimate of a quantile: the upper bound of the bucket containing it.
+
+        :param q: quantile in [0, 1]
+        :return: upper bound of the bucket, infinity above the last bound, None if empty
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        total = 0
+        for bound, count in zip(self.bounds, self.counts):
+            total += count
+            if total >= rank:
+                return bound
+        return float("inf")
+
+    def snapshot(self):
+        """
+        Return the state of the histogram.
+
+        :return: dict with the count, the sum, the mean, the p50/p99 estimates and the cumulative
+                 counts by upper bound
+        """
+        cumulative = []
+        total = 0
+        for bound, count in zip(self.bounds + (float("inf"),), self.counts):
+            total += count
+            cumulative.append((bound, total))
+        return {"count": self.count,
+                "sum": self.sum,
+                "mean": self.sum / self.count if self.count else 0.0,
+                "p50": self.quantile(0.5),
+                "p99": self.quantile(0.99),
+                "buckets": cumulative}
+
+
+class _command_metrics:
+    """Counters and latency histograms of a command type."""
+
+    __slots__ = ("sent", "bytes", "errors") + STAGES
+
+    def __init__(self):
+        self.sent = 0
+        self.bytes = 0
+        self.errors = 0
+        for stage in STAGES:
+            setattr(self, stage, histogram())
+
+
+class client_metrics:
+    """
+    Metrics of a hyperion client, by command type.
+
+    For every command: number of sent messages, bytes sent, number of errors and histograms of
+    the encode time, of the send time (the socket write) and of the reply wait (from the write
+    to the reply of the server). Compare the three to tell a slow sender from a slow network or
+    a slow hyperion daemon.
+    """
+
+    def __init__(self):
+        """Client_metrics initializer."""
+        self._lock = threading.Lock()
+        self._commands = {}
+        self.reconnects = 0
+        self.connection_errors = 0
+
+    def _command(self, command):
+        metrics = self._commands.get(command)
+        if metrics is None:
+            metrics = self._commands.setdefault(command, _command_metrics())
+        return metrics
+
+    def encoded(self, command, seconds):
+        """
+        Record the encoding of a command.
+
+        :param command: command name
+        :param seconds: encode time
+        """
+        with self._lock:
+            self._command(command).encode.observe(seconds)
+
+    def sent(self, command, size, seconds):
+        """
+        Record the write of a command.
+
+        :param command: command name
+        :param size: number of bytes written
+        :param seconds: time spent writing to the socket
+        """
+        with self._lock:
+            metrics = self._command(command)
+            metrics.sent += 1
+            metrics.bytes += size
+            metrics.send.observe(seconds)
+
+    def replied(self, command, seconds):
+        """
+        Record the reply to a command.
+
+        :param command: command name
+        :param seconds: time between the write and the reply
+        """
+        with self._lock:
+            self._command(command).reply.observe(seconds)
+
+    def failed(self, command):
+        """
+        Record a command failed by the server or by the connection.
+
+        :param command: command name
+        """
+        with self._lock:
+            self._command(command).errors += 1
+
+    def connection_lost(self):
+        """Record a connection error."""
+        with self._lock:
+            self.connection_errors += 1
+
+    def reconnected(self):
+        """Record a reconnection."""
+        with self._lock:
+            self.reconnects += 1
+
+    def reset(self):
+        """Drop all the measurements."""
+        with self._lock:
+            self._commands = {}
+            self.reconnects = 0
+            self.connection_errors = 0
+
+    def snapshot(self):
+        """
+        Return the current measurements.
+
+        :return: dict with the reconnects and connection_errors counters and a "commands" dict of
+                 command name -> dict with the sent, bytes and errors counters and the encode, send
+                 and reply histogram snapshots
+        """
+        with self._lock:
+            commands = {}
+            for command, metrics in self._commands.items():
+                commands[command] = {"sent": metrics.sent, "bytes": metrics.bytes, "errors": metrics.errors}
+                for stage in STAGES:
+                    commands[command][stage] = getattr(metrics, stage).snapshot()
+            return {"reconnects": self.reconnects,
+                    "connection_errors": self.connection_errors,
+                    "commands": commands}
+
+    def prometheus(self, prefix="hyperion_client", labels=None):
+        """
+        Return the measurements in the Prometheus text exposition format.
+
+        :param prefix: prefix of the metric names
+        :param labels: dict of labels added to every sample, e.g. {"host": "192.168.1.2"}
+        :return: str of the exposition
+        """
+        snapshot = self.snapshot()
+        common = "".join(',%s="%s"' % (key, _escape(value)) for key, value in sorted((labels or {}).items()))
+        lines = []
+        for name, help_text in (("reconnects", "Number of reconnections"),
+                                ("connection_errors", "Number of lost connections")):
+            lines.append("# HELP %s_%s_total %s." % (prefix, name, help_text))
+            lines.append("# TYPE %s_%s_total counter" % (prefix, name))
+            lines.append("%s_%s_total%s %d" % (prefix, name, "{%s}" % common[1:] if common else "", snapshot[name]))
+        commands = sorted(snapshot["commands"].items())
+        for name, help_text in (("sent", "Number of commands sent"),
+                                ("bytes", "Number of bytes sent"),
+                                ("errors", "Number of failed commands")):
+            lines.append("# HELP %s_%s_total %s." % (prefix, name, help_text))
+            lines.append("# TYPE %s_%s_total counter" % (prefix, name))
+            for command, metrics in commands:
+                lines.append('%s_%s_total{command="%s"%s} %d' % (prefix, name, command, common, metrics[name]))
+        for stage, help_text in (("encode", "Time spent encoding the commands"),
+                                 ("send", "Time spent writing the commands to the socket"),
+                                 ("reply", "Time between the write of the commands and their reply")):
+            metric = "%s_%s_seconds" % (prefix, stage)
+            lines.append("# HELP %s %s." % (metric, help_text))
+            lines.append("# TYPE %s histogram" % metric)
+            for command, metrics in commands:
+                values = metrics[stage]
+                for bound, count in values["buckets"]:
+                    lines.append('%s_bucket{command="%s"%s,le="%s"} %d' % (
+                        metric, command, common, "+Inf" if bound == float("inf") else repr(bound), count))
+                lines.append('%s_sum{command="%s"%s} %r' % (metric, command, common, values["sum"]))
+                lines.append('%s_count{command="%s"%s} %d' % (metric, command, common, values["count"]))
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    """Escape a Prometheus label value."""
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
@@ -0,0 +1,179 @@
+"""
+hyperion_pacer.py module.
+
+Pace a stream of frames on absolute deadlines.
+
+Sleeping a fixed time after every frame makes the frame rate drift below its target by the time
+spent rendering and sending the frame. The frame_pacer schedules frame k at start + k / fps on a
+monotonic clock instead, so the time spent on a frame is absorbed by the wait for the next one.
+"""
+import time
+
+from hyperion_metrics import LATENCY_BUCKETS, histogram
+
+# a frame starting later than this fraction of the period after its deadline is counted as late
+LATE_FRACTION = 0.5
+
+
+class frame_pacer:
+    """Scheduler of the frames of a stream at a fixed rate."""
+
+    def __init__(self, fps, skip_missed=True, spin=0.0, start=None, clock=time.monotonic):
+        """
+        Frame_pacer initializer.
+
+        :param fps: frames per second
+        :param skip_missed: if True -> skip the frames whose slot has passed, else send them
+                            without waiting until the stream is back on schedule
+        :param spin: time in seconds before a deadline spent busy waiting instead of sleeping, for
+                     a lower jitter at the cost of cpu time
+        :param start: clock value of frame 0, None -> time of the first wait; frames are aligned on
+                      the grid of this start, the first wait returns the next frame of the grid
+        :param clock: clock function returning seconds
+        """
+        self.period = 1.0 / float(fps)
+        self.skip_missed = bool(skip_missed)
+        self.spin = float(spin)
+        self._clock = clock
+        self._start = start
+        self._index = None
+        self._first = None
+        self._last = None
+        self.reset()
+
+    @property
+    def fps(self):
+        return 1.0 / self.period
+
+    def reset(self):
+        """Reset the statistics."""
+        self._frames = 0
+        self._late = 0
+        self._skipped = 0
+        self._max_jitter = 0.0
+        self._jitter = histogram(LATENCY_BUCKETS)
+        self._first = None
+
+    def deadline(self, index):
+        """
+        Return the deadline of a frame.
+
+        :param index: frame index
+        :return: clock value, None before the schedule started
+        """
+        return None if self._start is None else self._start + index * self.period
+
+    def frame_time(self, index):
+        """
+        Return the time of a frame in the stream.
+
+        :param index: frame index
+        :return: time in seconds from frame 0, e.g. the time of an effect
+        """
+        return index * self.period
+
+    def resync(self):
+        """
+        Move the schedule to now if the next deadline has passed, without counting skipped frames.
+
+        Call it when the stream was idle, so that the first frame after the pause is sent at once.
+        """
+        if self._start is None or self._index is None:
+            return
+        now = self._clock()
+        if self._start + (self._index + 1) * self.period < now:
+            self._start = now - (self._index + 1) * self.period
+
+    def wait(self):
+        """
+        Wait for the deadline of the next frame.
+
+        :return: index of the frame
+        """
+        clock = self._clock
+        now = clock()
+        if self._start is None:
+            self._start = now
+        if self._index is None:
+            # first frame: the next slot of the grid, nothing was missed yet
+            index = max(0, -int((self._start - now) // self.period))
+        else:
+            index = self._index + 1
+            behind = now - (self._start + index * self.period)
+            if behind >= self.period and self.skip_missed:
+                missed = int(behind // self.period)
+                self._skipped += missed
+                index += missed
+        deadline = self._start + index * self.period
+        delay = deadline - now - self.spin
+        if delay > 0:
+            time.sleep(delay)
+        if self.spin > 0:
+            while clock() < deadline:
+                pass
+        woke = clock()
+        lateness = woke - deadline
+        jitter = abs(lateness)
+        self._jitter.observe(jitter)
+        if jitter > self._max_jitter:
+            self._max_jitter = jitter
+        if lateness > self.period * LATE_FRACTION:
+            self._late += 1
+        self._frames += 1
+        if self._first is None:
+            self._first = woke
+        self._last = woke
+        self._index = index
+        return index
+
+    def run(self, callback, duration=None, frames=None):
+        """
+        Call a function at the deadline of every frame.
+
+        :param callback: function called with the frame index
+        :param duration: time in seconds to run, None -> until the number of frames
+        :param frames: number of frames to run, None -> until the duration (forever if both None)
+        :return: stats() at the end
+        """
+        end = self._clock() + duration if duration is not None else None
+        count = 0
+        while frames is None or count < frames:
+            index = self.wait()
+            if end is not None and self._last >= end:
+                break
+            callback(index)
+            count += 1
+        return self.stats()
+
+    def stats(self):
+        """
+        Return the pacing statistics.
+
+        :return: dict with the target and achieved frame rates, the numbers of frames, late frames
+                 (started over LATE_FRACTION of a period after their deadline) and skipped frames,
+                 the maximum jitter and the jitter histogram (seconds between deadline and start)
+        """
+        elapsed = self._last - self._first if self._frames > 1 else 0.0
+        return {"fps": self.fps,
+                "achieved_fps": (self._frames - 1) / elapsed if elapsed > 0 else 0.0,
+                "frames": self._frames,
+                "late": self._late,
+                "skipped": self._skipped,
+                "max_jitter": self._max_jitter,
+                "jitter": self._jitter.snapshot()}
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Measure the pacing accuracy of this machine.")
+    parser.add_argument("--fps", type=float, default=60.0, help="frames per second")
+    parser.add_argument("--duration", type=float, default=3.0, help="time in seconds to measure")
+    parser.add_argument("--work", type=float, default=0.005, help="time in seconds spent on every frame")
+    parser.add_argument("--spin", type=float, default=0.0, help="busy wait time in seconds before the deadlines")
+    args = parser.parse_args()
+    pacer = frame_pacer(args.fps, spin=args.spin)
+    stats = pacer.run(lambda index: time.sleep(args.work), duration=args.duration)
+    print("%.2f fps achieved for %.2f, %d frames, %d late, %d skipped" %
+          (stats["achieved_fps"], stats["fps"], stats["frames"], stats["late"], stats["skipped"]))
+    print("jitter p50 <= %.6f s, p99 <= %.6f s, max %.6f s" %
+          (stats["jitter"]["p50"], stats["jitter"]["p99"], stats["max_jitter"]))
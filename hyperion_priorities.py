@@ -0,0 +1,221 @@
+"""
+hyperion_priorities.py module.
+
+Local model of the priority stack of a hyperion server.
+"""
+import threading
+import time
+
+from hyperion_catalog import effect_catalog
+
+# kinds of the priority entries
+COLOR = "color"
+LEDS = "leds"
+EFFECT = "effect"
+IMAGE = "image"
+UNKNOWN = "unknown"
+
+
+class priority_entry:
+    """A priority of the stack."""
+
+    __slots__ = ("priority", "kind", "value", "expires", "time", "local")
+
+    def __init__(self, priority, kind, value=None, expires=None, local=True, now=None):
+        self.priority = priority
+        self.kind = kind
+        self.value = value
+        self.expires = expires
+        self.time = time.monotonic() if now is None else now
+        self.local = local
+
+    def expires_in(self, now=None):
+        """
+        Return the time before the priority expires.
+
+        :param now: time.monotonic() value, None -> now
+        :return: seconds, None if the priority has no duration
+        """
+        if self.expires is None:
+            return None
+        return max(0.0, self.expires - (time.monotonic() if now is None else now))
+
+    def as_dict(self, now=None):
+        """
+        Return the entry as a dict.
+
+        :param now: time.monotonic() value, None -> now
+        :return: dict with the priority, the kind, the value, the seconds before expiry (None if
+                 no duration) and whether it was set by this client
+        """
+        return {"priority": self.priority, "kind": self.kind, "value": self.value,
+                "expires_in": self.expires_in(now), "local": self.local}
+
+    def __repr__(self):
+        return "priority_entry(%d, %r, %r)" % (self.priority, self.kind, self.value)
+
+
+class priority_stack:
+    """
+    Mirror of the priority stack of a hyperion server.
+
+    The stack is updated by the commands the client sends and expires the durations locally.
+    reconcile() replaces it with a serverinfo snapshot, to pick up the priorities set by other
+    clients and the effects that ended on the server. The commands sent after the snapshot was
+    requested are kept, so the mirror never goes back in time.
+    """
+
+    def __init__(self):
+        """Priority_stack initializer."""
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._cleared = {}
+        self._reconciled = None
+
+    def _expire(self, now):
+        expired = [priority for priority, entry in self._entries.items()
+                   if entry.expires is not None and entry.expires <= now]
+        for priority in expired:
+            del self._entries[priority]
+
+    def set(self, priority, kind, value=None, duration=0):
+        """
+        Record a priority set by the client.
+
+        :param priority: priority value
+        :param kind: COLOR, LEDS, EFFECT or IMAGE
+        :param value: (r, g, b) color, effect name, (width, height) of the image, None for led data
+        :param duration: duration in milliseconds, 0 -> until cleared
+        """
+        now = time.monotonic()
+        priority = int(priority)
+        expires = now + duration / 1000.0 if duration and duration > 0 else None
+        with self._lock:
+            self._entries[priority] = priority_entry(priority, kind, value, expires, True, now)
+            self._cleared.pop(priority, None)
+
+    def clear(self, priority):
+        """
+        Record a priority cleared by the client.
+
+        :param priority: priority value
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._entries.pop(int(priority), None)
+            self._cleared[int(priority)] = now
+
+    def clear_all(self):
+        """Record all the priorities cleared by the client."""
+        now = time.monotonic()
+        with self._lock:
+            for priority in self._entries:
+                self._cleared[priority] = now
+            self._entries.clear()
+            # priorities of other clients unknown to the mirror are cleared too
+            self._cleared[None] = now
+
+    def reconcile(self, info, requested=None):
+        """
+        Replace the stack with a serverinfo snapshot.
+
+        :param info: "info" object of the serverinfo reply
+        :param requested: time.monotonic() when the snapshot was requested, None -> now
+        """
+        now = time.monotonic()
+        requested = now if requested is None else requested
+        effects = {int(active["priority"]): active for active in info.get("activeEffects", ())}
+        colors = info.get("activeLedColor") or ()
+        server = sorted(int(entry["priority"]) for entry in info.get("priorities", ()))
+        durations = {int(entry["priority"]): entry.get("duration_ms") for entry in info.get("priorities", ())}
+        catalog = None
+        with self._lock:
+            clear_all = self._cleared.get(None)
+            entries = {}
+            for priority in server:
+                # the latest of its own clear and a clear_all
+                cleared = max(filter(None, (self._cleared.get(priority), clear_all)), default=None)
+                if cleared is not None and cleared >= requested:
+                    # cleared by the client after the snapshot was requested
+                    continue
+                duration = durations.get(priority)
+                expires = now + duration / 1000.0 if duration is not None and duration >= 0 else None
+                known = self._entries.get(priority)
+                if known is not None:
+                    entry = priority_entry(priority, known.kind, known.value, expires, known.local, known.time)
+                elif priority in effects:
+                    if catalog is None:
+                        catalog = effect_catalog(info.get("effects", ()))
+                    effect, _ = catalog.resolve(effects[priority]["script"], effects[priority].get("args"))
+                    name = str(effect["name"]) if effect is not None else effects[priority]["script"]
+                    entry = priority_entry(priority, EFFECT, name, expires, False, now)
+                elif priority == server[0] and colors and "RGB Value" in colors[0]:
+                    entry = priority_entry(priority, COLOR, tuple(colors[0]["RGB Value"]), expires, False, now)
+                else:
+                    entry = priority_entry(priority, UNKNOWN, None, expires, False, now)
+                entries[priority] = entry
+            # keep the commands sent after the snapshot was requested
+            for priority, entry in self._entries.items():
+                if entry.time >= requested:
+                    entries[priority] = entry
+            self._entries = entries
+            self._cleared = {priority: cleared for priority, cleared in self._cleared.items() if cleared >= requested}
+            self._reconciled = now
+
+    @property
+    def reconciled(self):
+        """
+        Return the time of the last reconciliation.
+
+        :return: time.monotonic() value, None if never reconciled
+        """
+        return self._reconciled
+
+    def visible(self):
+        """
+        Return the priority shown on the leds.
+
+        :return: priority_entry with the lowest priority value, None if the stack is empty
+        """
+        with self._lock:
+            self._expire(time.monotonic())
+            if not self._entries:
+                return None
+            return self._entries[min(self._entries)]
+
+    def get(self, priority):
+        """
+        Return a priority.
+
+        :param priority: priority value
+        :return: priority_entry, None if the priority is not set
+        """
+        with self._lock:
+            self._expire(time.monotonic())
+            return self._entries.get(int(priority))
+
+    def expires_in(self, priority):
+        """
+        Return the time before a priority expires.
+
+        :param priority: priority value
+        :return: seconds, None if the priority is not set or has no duration
+        """
+        entry = self.get(priority)
+        return entry.expires_in() if entry is not None else None
+
+    def entries(self):
+        """
+        Return the priorities of the stack.
+
+        :return: list of priority_entry sorted by priority value, the visible one first
+        """
+        with self._lock:
+            self._expire(time.monotonic())
+            return [self._entries[priority] for priority in sorted(self._entries)]
+
+    def __len__(self):
+        return len(self.entries())
+
+    def __contains__(self, priority):
+        return self.get(priority) is not None
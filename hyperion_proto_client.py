@@ -0,0 +1,487 @@
+"""
+hyperion_proto_client.py module.
+
+Connect to the hyperion protobuffer interface and send/receive binary messages.
+
+The messages follow the message.proto definitions of the hyperion proto server: every message is
+a HyperionRequest (or HyperionReply) prefixed by its size as a 4 bytes big-endian integer.
+"""
+import logging
+import select
+import socket
+import socketserver
+import struct
+from threading import Thread
+
+from hyperion_encoder import led_bytes
+
+_log = logging.getLogger(__name__)
+
+# HyperionRequest.Command
+COLOR = 1
+IMAGE = 2
+CLEAR = 3
+CLEARALL = 4
+
+# HyperionRequest extension field numbers
+_COLOR_REQUEST = 10
+_IMAGE_REQUEST = 11
+_CLEAR_REQUEST = 12
+
+# protobuf wire types
+_VARINT = 0
+_LENGTH_DELIMITED = 2
+
+_HEADER = struct.Struct('>I')
+
+
+def _varint(value):
+    """
+    Encode an integer as a protobuf varint.
+
+    :param value: int32/int64/bool value (negative values are encoded on 10 bytes)
+    :return: encoded bytes
+    """
+    value &= 0xFFFFFFFFFFFFFFFF
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _int_field(number, value):
+    """Encode a varint field."""
+    return _varint(number << 3 | _VARINT) + _varint(int(value))
+
+
+def _bytes_field(number, value):
+    """Encode a length-delimited field."""
+    return _varint(number << 3 | _LENGTH_DELIMITED) + _varint(len(value)) + value
+
+
+def decode_message(data):
+    """
+    Decode the fields of a protobuf message.
+
+    :param data: bytes of the message
+    :return: dict of field number -> value (int for varints, bytes for length-delimited fields)
+    """
+    fields = {}
+    pos = 0
+    size = len(data)
+    while pos < size:
+        key, pos = _read_varint(data, pos)
+        number, wire_type = key >> 3, key & 0x07
+        if wire_type == _VARINT:
+            value, pos = _read_varint(data, pos)
+            if value >= 1 << 63:
+                value -= 1 << 64
+        elif wire_type == _LENGTH_DELIMITED:
+            length, pos = _read_varint(data, pos)
+            value = bytes(data[pos:pos + length])
+            pos += length
+        else:
+            raise ValueError("Unsupported protobuf wire type %d" % wire_type)
+        fields[number] = value
+    return fields
+
+
+def _read_varint(data, pos):
+    """Decode the varint starting at pos, return the value and the position after it."""
+    value = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+
+
+def encode_color_request(red, green, blue, priority=100, duration=0):
+    """
+    Encode a framed color HyperionRequest.
+
+    :param red: red value in RGB format [0-255]
+    :param green: green value in RGB format [0-255]
+    :param blue: blue value in RGB format [0-255]
+    :param priority: priority value
+    :param duration: duration in milliseconds
+    :return: bytes of the framed message
+    """
+    rgb = (int(red) & 0xFF) << 16 | (int(green) & 0xFF) << 8 | (int(blue) & 0xFF)
+    request = _int_field(1, priority) + _int_field(2, rgb)
+    if duration > 0:
+        request += _int_field(3, duration)
+    return _frame(_int_field(1, COLOR) + _bytes_field(_COLOR_REQUEST, request))
+
+
+def encode_image_request(image_data, width, height, priority=100, duration=0):
+    """
+    Encode a framed image HyperionRequest.
+
+    :param image_data: raw RGB888 image data (width * height * 3 bytes)
+    :param width: width of the image
+    :param height: height of the image
+    :param priority: priority value
+    :param duration: duration in milliseconds
+    :return: bytes of the framed message
+    """
+    data = led_bytes(image_data)
+    if len(data) != width * height * 3:
+        raise ValueError("Image data size %d does not match %dx%d RGB888" % (len(data), width, height))
+    request = _int_field(1, priority) + _int_field(2, width) + _int_field(3, height)
+    request += _bytes_field(4, bytes(data))
+    if duration > 0:
+        request += _int_field(5, duration)
+    return _frame(_int_field(1, IMAGE) + _bytes_field(_IMAGE_REQUEST, request))
+
+
+def encode_clear_request(priority=100):
+    """
+    Encode a framed clear HyperionRequest.
+
+    :param priority: clear priority value
+    :return: bytes of the framed message
+    """
+    return _frame(_int_field(1, CLEAR) + _bytes_field(_CLEAR_REQUEST, _int_field(1, priority)))
+
+
+def encode_clearall_request():
+    """
+    Encode a framed clearall HyperionRequest.
+
+    :return: bytes of the framed message
+    """
+    return _frame(_int_field(1, CLEARALL))
+
+
+def _frame(message):
+    """Prefix a message with its size."""
+    return _HEADER.pack(len(message)) + message
+
+
+def decode_request(message):
+    """
+    Decode a HyperionRequest.
+
+    :param message: bytes of the message (without the size prefix)
+    :return: dict with the command name and its fields
+    """
+    fields = decode_message(message)
+    command = fields.get(1)
+    if command == COLOR:
+        color = decode_message(fields[_COLOR_REQUEST])
+        rgb = color[2]
+        return {"command": "color", "priority": color[1], "color": [rgb >> 16 & 0xFF, rgb >> 8 & 0xFF, rgb & 0xFF],
+                "duration": color.get(3, -1)}
+    if command == IMAGE:
+        image = decode_message(fields[_IMAGE_REQUEST])
+        return {"command": "image", "priority": image[1], "imagewidth": image[2], "imageheight": image[3],
+                "imagedata": image[4], "duration": image.get(5, -1)}
+    if command == CLEAR:
+        return {"command": "clear", "priority": decode_message(fields[_CLEAR_REQUEST])[1]}
+    if command == CLEARALL:
+        return {"command": "clearall"}
+    raise ValueError("Unknown hyperion proto command %r" % command)
+
+
+def decode_reply(message):
+    """
+    Decode a HyperionReply.
+
+    :param message: bytes of the message (without the size prefix)
+    :return: dict with the success flag and the error message
+    """
+    fields = decode_message(message)
+    error = fields.get(3)
+    return {"type": fields.get(1, 1), "success": bool(fields.get(2, False)),
+            "error": error.decode('utf-8') if error is not None else None}
+
+
+def encode_reply(success=True, error=None):
+    """
+    Encode a framed HyperionReply.
+
+    :param success: success flag
+    :param error: error message
+    :return: bytes of the framed message
+    """
+    reply = _int_field(1, 1) + _int_field(2, bool(success))
+    if error:
+        reply += _bytes_field(3, str(error).encode('utf-8'))
+    return _frame(reply)
+
+
+def _recv_exactly(sock, size):
+    """Receive exactly size bytes, None if the connection is closed."""
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return bytes(data)
+
+
+class hyperion_proto_client:
+    """Hyperion protobuffer interface client class."""
+
+    def __init__(self, host='127.0.0.1', port=19445):
+        """
+        Hyperion_proto_client initializer.
+
+        :param host: ip address of the host
+        :param port: port number
+        """
+        self._host = str(host)
+        self._port = int(port)
+        self._socket = None
+        self._reply_buffer = bytearray()
+        self._unread_replies = 0
+        self._last_error = None
+
+    @property
+    def host(self):
+        """
+        Return ip address.
+
+        :return: ip address of the hyperion server host
+        """
+        return self._host
+
+    @property
+    def port(self):
+        """
+        Return port.
+
+        :return: port of the hyperion proto server host
+        """
+        return self._port
+
+    @property
+    def connected(self):
+        """
+        Return connection status.
+
+        :return: boolean value of the connection status. True if connected
+        """
+        return self._socket is not None
+
+    def open_connection(self, timeout=10):
+        """
+        Open a socket connection to the server.
+
+        :param timeout: timeout in seconds
+        """
+        if self._socket is not None:
+            return
+        sock = socket.socket()
+        sock.settimeout(timeout)
+        try:
+            sock.connect((self._host, self._port))
+        except socket.error as exc:
+            sock.close()
+            _log.error("Error during connection to %s:%d: %s", self._host, self._port, exc)
+            raise
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._socket = sock
+        del self._reply_buffer[:]
+        self._unread_replies = 0
+
+    def close_connection(self, clean=False):
+        """
+        Close socket connection to the server.
+
+        :param clean: if True -> clear all the effects/color on disconnection
+        """
+        if self._socket is None:
+            return
+        try:
+            if clean:
+                self._socket.sendall(encode_clearall_request())
+            self._socket.close()
+        except socket.error as exc:
+            _log.warning("Could not close socket connection: %s", exc)
+        self._socket = None
+
+    def _pop_reply(self):
+        """Return the next complete reply in the receive buffer, None if not yet complete."""
+        buffer = self._reply_buffer
+        if len(buffer) < _HEADER.size:
+            return None
+        end = _HEADER.size + _HEADER.unpack_from(buffer)[0]
+        if len(buffer) < end:
+            return None
+        reply = decode_reply(bytes(buffer[_HEADER.size:end]))
+        del buffer[:end]
+        self._unread_replies -= 1
+        if not reply["success"]:
+            self._last_error = reply["error"]
+        return reply
+
+    def _drain_replies(self):
+        """Consume the replies already received without blocking, so they never fill the socket buffers."""
+        while select.select([self._socket], [], [], 0)[0]:
+            data = self._socket.recv(65536)
+            if not data:
+                raise socket.error("Connection closed by the hyperion proto server")
+            self._reply_buffer += data
+        while self._pop_reply() is not None:
+            pass
+
+    @property
+    def last_error(self):
+        """
+        Return the last error reported by the server.
+
+        :return: error message of the last failed request, None if none failed
+        """
+        return self._last_error
+
+    def recv_reply(self):
+        """
+        Receive the next reply of the server.
+
+        :return: dict with the success flag and the error message
+        """
+        while True:
+            reply = self._pop_reply()
+            if reply is not None:
+                return reply
+            data = self._socket.recv(65536)
+            if not data:
+                raise socket.error("Connection closed by the hyperion proto server")
+            self._reply_buffer += data
+
+    def send_request(self, request, wait=False):
+        """
+        Send a framed request to the server.
+
+        :param request: bytes of the framed request
+        :param wait: if True -> wait for the reply to this request and return it
+        :return: the reply if wait is True, otherwise None
+        """
+        if self._socket is None:
+            self.open_connection()
+        self._socket.sendall(request)
+        self._unread_replies += 1
+        if not wait:
+            self._drain_replies()
+            return None
+        # skip the replies of the requests that were not waited for
+        while self._unread_replies > 1:
+            self.recv_reply()
+        return self.recv_reply()
+
+    def set_RGBcolor(self, red, green, blue, priority=100, duration=0, wait=False):
+        """
+        Send color to the hyperion proto server.
+
+        :param red: red value in RGB format [0-255]
+        :param green: green value in RGB format [0-255]
+        :param blue: blue value in RGB format [0-255]
+        :param priority: priority value
+        :param duration: duration in milliseconds
+        :param wait: if True -> wait for the reply of the server
+        """
+        return self.send_request(encode_color_request(red, green, blue, priority, duration), wait)
+
+    def set_image(self, image_data, width, height, priority=100, duration=0, wait=False):
+        """
+        Send an image to the hyperion proto server.
+
+        :param image_data: raw RGB888 image data (bytes, bytearray, memoryview or numpy uint8 array)
+        :param width: width of the image
+        :param height: height of the image
+        :param priority: priority value
+        :param duration: duration in milliseconds
+        :param wait: if True -> wait for the reply of the server
+        """
+        return self.send_request(encode_image_request(image_data, width, height, priority, duration), wait)
+
+    def clear(self, priority=100, wait=False):
+        """
+        Clear the highest priority effect/color (with lower priority value).
+
+        :param priority: clear priority value
+        :param wait: if True -> wait for the reply of the server
+        """
+        return self.send_request(encode_clear_request(priority), wait)
+
+    def clear_all(self, wait=False):
+        """
+        Clear all the effects/color.
+
+        :param wait: if True -> wait for the reply of the server
+        """
+        return self.send_request(encode_clearall_request(), wait)
+
+
+class hyperion_proto_server(Thread):
+    """Local stand-in of the hyperion proto server, records the decoded requests and replies success."""
+
+    class ProtoHandler(socketserver.BaseRequestHandler):
+
+        def handle(self):
+            while True:
+                header = _recv_exactly(self.request, _HEADER.size)
+                if header is None:
+                    break
+                message = _recv_exactly(self.request, _HEADER.unpack(header)[0])
+                if message is None:
+                    break
+                try:
+                    request = decode_request(message)
+                except (ValueError, KeyError, IndexError) as exc:
+                    self.request.sendall(encode_reply(False, exc))
+                    continue
+                self.server.requests.append(request)
+                if self.server.update_func is not None:
+                    self.server.update_func(request)
+                self.request.sendall(encode_reply(True))
+
+    class ThreadingServer(socketserver.ThreadingTCPServer):
+        allow_reuse_address = True
+        daemon_threads = True
+
+    def __init__(self, upd_func=None, HOST='127.0.0.1', PORT=19445):
+        """
+        Hyperion_proto_server initializer.
+
+        :param upd_func: function called with every decoded request
+        :param HOST: ip address to bind
+        :param PORT: port to bind (0 -> any free port)
+        """
+        Thread.__init__(self, daemon=True)
+        self.server = hyperion_proto_server.ThreadingServer((HOST, int(PORT)), hyperion_proto_server.ProtoHandler)
+        self.server.requests = []
+        self.server.update_func = upd_func
+
+    @property
+    def address(self):
+        """
+        Return the bound address.
+
+        :return: (host, port) tuple
+        """
+        return self.server.server_address
+
+    @property
+    def requests(self):
+        """
+        Return the received requests.
+
+        :return: list of the decoded requests
+        """
+        return self.server.requests
+
+    def run(self):
+        self.server.serve_forever()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
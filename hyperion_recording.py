@@ -0,0 +1,257 @@
+"""
+hyperion_recording.py module.
+
+Record led frame streams into a compact binary file and replay them.
+
+File layout, little endian:
+
+- header (HEADER_SIZE bytes): magic b"HLED", version, header size, reserved, wall clock time of
+  the start of the recording, offset of the index and number of frames (both 0 until closed);
+- frames: timestamp (float64 seconds from the start), channel (uint16: hyperion priority or OPC
+  channel), reserved (uint16), length (uint32), then the raw (r, g, b) bytes;
+- index: the timestamps of the frames (float64) followed by their offsets (uint64).
+
+The replay memory-maps the file: frames are memoryview slices of the mapping, nothing is copied.
+A recording that was not closed (e.g. after a crash) has no index, its frames are scanned instead.
+"""
+import bisect
+import mmap
+import os
+import struct
+import threading
+import time
+
+from hyperion_encoder import led_bytes
+
+MAGIC = b"HLED"
+VERSION = 1
+_HEADER = struct.Struct("<4sHHIdQQ")
+_FRAME = struct.Struct("<dHHI")
+HEADER_SIZE = _HEADER.size
+FRAME_HEADER_SIZE = _FRAME.size
+
+
+class frame_recorder:
+    """Writer of a recording."""
+
+    def __init__(self, path, clock=time.monotonic):
+        """
+        Frame_recorder initializer: create the file.
+
+        :param path: path of the recording
+        :param clock: clock function returning seconds, for the frame timestamps
+        """
+        self.path = path
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._file = open(path, "wb")
+        self._start = clock()
+        self._created = time.time()
+        self._timestamps = []
+        self._offsets = []
+        self._offset = HEADER_SIZE
+        self._bytes = 0
+        self._file.write(_HEADER.pack(MAGIC, VERSION, HEADER_SIZE, 0, self._created, 0, 0))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def frames(self):
+        return len(self._offsets)
+
+    @property
+    def closed(self):
+        return self._file is None
+
+    def record(self, led_data, channel=0):
+        """
+        Add a frame.
+
+        :param led_data: led data (r,g,b) * ledcount accepted by hyperion_encoder.led_bytes
+        :param channel: hyperion priority or OPC channel of the frame
+        """
+        data = led_bytes(led_data)
+        length = len(data)
+        with self._lock:
+            if self._file is None:
+                raise ValueError("Recording %s is closed" % self.path)
+            timestamp = self._clock() - self._start
+            self._file.write(_FRAME.pack(timestamp, int(channel), 0, length))
+            self._file.write(data)
+            self._timestamps.append(timestamp)
+            self._offsets.append(self._offset)
+            self._offset += FRAME_HEADER_SIZE + length
+            self._bytes += length
+
+    def close(self):
+        """Write the index and close the file."""
+        with self._lock:
+            if self._file is None:
+                return
+            count = len(self._offsets)
+            self._file.write(struct.pack("<%dd" % count, *self._timestamps))
+            self._file.write(struct.pack("<%dQ" % count, *self._offsets))
+            self._file.seek(0)
+            self._file.write(_HEADER.pack(MAGIC, VERSION, HEADER_SIZE, 0, self._created, self._offset, count))
+            self._file.close()
+            self._file = None
+
+    def stats(self):
+        """
+        Return the recording statistics.
+
+        :return: dict with the number of frames, the led data bytes and the file size
+        """
+        return {"frames": self.frames, "bytes": self._bytes,
+                "file_bytes": self._offset + (0 if self._file is not None else self.frames * 16)}
+
+
+class frame_replay:
+    """Reader of a recording."""
+
+    def __init__(self, path):
+        """
+        Frame_replay initializer: map the file.
+
+        :param path: path of the recording
+        """
+        self.path = path
+        with open(path, "rb") as recording:
+            self._mmap = mmap.mmap(recording.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+        magic, version, header_size, _, created, index, count = _HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError("%s is not a led frame recording" % path)
+        if version > VERSION:
+            self.close()
+            raise ValueError("Recording version %d is not supported" % version)
+        self.created = created
+        if index:
+            # zero-copy views of the index
+            self._timestamps = self._view[index:index + count * 8].cast("d")
+            self._offsets = self._view[index + count * 8:index + count * 16].cast("Q")
+        else:
+            self._timestamps, self._offsets = self._scan(header_size)
+
+    def _scan(self, offset):
+        """Rebuild the index of a recording that was not closed."""
+        timestamps = []
+        offsets = []
+        size = len(self._mmap)
+        while offset + FRAME_HEADER_SIZE <= size:
+            timestamp, _, _, length = _FRAME.unpack_from(self._mmap, offset)
+            if offset + FRAME_HEADER_SIZE + length > size:
+                # frame cut by the end of the file
+                break
+            timestamps.append(timestamp)
+            offsets.append(offset)
+            offset += FRAME_HEADER_SIZE + length
+        return timestamps, offsets
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self.frame(index)
+
+    @property
+    def duration(self):
+        """
+        Return the time between the first and the last frame.
+
+        :return: seconds
+        """
+        return self._timestamps[-1] - self._timestamps[0] if len(self) else 0.0
+
+    def frame(self, index):
+        """
+        Return a frame.
+
+        :param index: frame index
+        :return: (timestamp, channel, led data) with the led data a memoryview of the mapping,
+                 valid until the replay is closed
+        """
+        offset = self._offsets[index]
+        timestamp, channel, _, length = _FRAME.unpack_from(self._mmap, offset)
+        start = offset + FRAME_HEADER_SIZE
+        return timestamp, channel, self._view[start:start + length]
+
+    def seek(self, timestamp):
+        """
+        Return the frame shown at a time.
+
+        :param timestamp: seconds from the start of the recording
+        :return: index of the last frame recorded at or before the time, 0 before the first frame
+        """
+        return max(0, bisect.bisect_right(self._timestamps, timestamp) - 1)
+
+    def play(self, sink, speed=1.0, start=0.0, end=None):
+        """
+        Send the frames.
+
+        :param sink: callable called with the led data and the channel of every frame, e.g.
+                     hyperion_client.send_led_data or OPCclient.put_pixels
+        :param speed: playback speed, 1.0 -> the original timing, None -> as fast as possible
+        :param start: time in seconds from the start of the recording of the first frame
+        :param end: time in seconds from the start of the recording to stop at, None -> the end
+        :return: number of frames sent
+        """
+        if not len(self):
+            return 0
+        first = self.seek(start)
+        begin = time.monotonic()
+        sent = 0
+        for index in range(first, len(self)):
+            timestamp, channel, data = self.frame(index)
+            if end is not None and timestamp > end:
+                break
+            if speed:
+                # absolute deadlines: the time spent in the sink does not delay the next frames
+                delay = begin + (max(timestamp, start) - start) / speed - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            sink(data, channel)
+            sent += 1
+        return sent
+
+    def close(self):
+        """
+        Release the mapping.
+
+        The file is unmapped once the frames returned before are released too.
+        """
+        if self._mmap is None:
+            return
+        self._timestamps = self._offsets = ()
+        self._view.release()
+        try:
+            self._mmap.close()
+        except BufferError:
+            # frames still referenced: the mapping is released with the last of them
+            pass
+        self._mmap = None
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Show the content of a led frame recording.")
+    parser.add_argument("recording", help="path of the recording")
+    args = parser.parse_args()
+    with frame_replay(args.recording) as replay:
+        sizes = set(len(replay.frame(index)[2]) for index in range(len(replay)))
+        channels = set(replay.frame(index)[1] for index in range(len(replay)))
+        print("%s: %d frames over %.3f s, %s bytes per frame, channels %s, %d bytes" %
+              (args.recording, len(replay), replay.duration, sorted(sizes), sorted(channels),
+               os.path.getsize(args.recording)))
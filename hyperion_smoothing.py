@@ -0,0 +1,251 @@
+"""
+hyperion_smoothing.py module.
+
+Smooth the led frames on the client, as the color.smoothing section of the hyperion daemon.
+
+A producer pushes keyframes at its own rate, the smoothing emits the interpolated frames at the
+output rate: an effect rendered at 10 fps drives a smooth 60 fps output.
+"""
+import logging
+import math
+import threading
+import time
+
+from hyperion_config import load_config
+from hyperion_encoder import led_bytes
+from hyperion_pacer import frame_pacer
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+_log = logging.getLogger(__name__)
+
+# smoothing types
+NONE = "none"
+LINEAR = "linear"
+EXPONENTIAL = "exponential"
+# shape of the exponential smoothing: the plain exponential decay covers this fraction of the step
+# to a keyframe in time_ms, the curve is scaled to cover all of it
+EXPONENTIAL_SETTLED = 0.95
+
+
+class color_smoothing:
+    """
+    Interpolation of the led colors between keyframes.
+
+    linear: the colors move in a straight line from their current value to the keyframe in time_ms,
+    as the hyperion linear smoothing. exponential: the colors move fast at first and slow down
+    close to the keyframe, on an exponential decay scaled to reach the keyframe in time_ms.
+
+    The state is kept in buffers allocated for the led count, an output frame allocates nothing.
+    """
+
+    def __init__(self, led_count, type=LINEAR, time_ms=200, update_frequency=60.0, clock=time.monotonic):
+        """
+        Color_smoothing initializer.
+
+        :param led_count: number of leds of the frames
+        :param type: LINEAR, EXPONENTIAL or NONE
+        :param time_ms: settling time in milliseconds
+        :param update_frequency: output frames per second of start()
+        :param clock: clock function returning seconds
+        """
+        if np is None:
+            raise ImportError("numpy is required by the smoothing")
+        if type not in (NONE, LINEAR, EXPONENTIAL):
+            raise ValueError("Unknown smoothing type %r" % type)
+        self.type = type
+        self.time = max(float(time_ms), 0.0) / 1000.0
+        self.update_frequency = float(update_frequency)
+        self._clock = clock
+        self._lock = threading.Lock()
+        shape = (int(led_count), 3)
+        self._current = np.zeros(shape, dtype=np.float32)
+        self._start = np.zeros(shape, dtype=np.float32)
+        self._target = np.zeros(shape, dtype=np.float32)
+        self._work = np.zeros(shape, dtype=np.float32)
+        self._output = np.zeros(shape, dtype=np.uint8)
+        self._keyframe_time = None
+        self._settled = True
+        self._keyframes = 0
+        self._thread = None
+        self._running = False
+        self._pacer = None
+
+    @classmethod
+    def from_config(cls, config, led_count=None, **options):
+        """
+        Create the smoothing of a hyperion configuration.
+
+        :param config: json structure or path of a hyperion configuration
+        :param led_count: number of leds of the frames, None -> the leds of the configuration
+        :param options: other initializer arguments
+        :return: color_smoothing of the color.smoothing section
+        """
+        if isinstance(config, str):
+            config = load_config(config)
+        smoothing = config.get("color", {}).get("smoothing", {})
+        if led_count is None:
+            led_count = len(config.get("leds", ()))
+        options.setdefault("type", smoothing.get("type", NONE))
+        options.setdefault("time_ms", smoothing.get("time_ms", 200))
+        options.setdefault("update_frequency", smoothing.get("updateFrequency", 60.0))
+        return cls(led_count, **options)
+
+    @property
+    def led_count(self):
+        return len(self._current)
+
+    @property
+    def settled(self):
+        """
+        Return whether the colors reached the last keyframe.
+
+        :return: True if the output does not change until the next keyframe
+        """
+        return self._settled
+
+    def push(self, led_data, now=None):
+        """
+        Set the next keyframe.
+
+        :param led_data: led data (r,g,b) * ledcount accepted by hyperion_encoder.led_bytes
+        :param now: clock value of the keyframe, None -> now
+        """
+        frame = np.frombuffer(led_bytes(led_data), dtype=np.uint8)
+        if len(frame) != self._target.size:
+            raise ValueError("Keyframe of %d values for %d leds" % (len(frame), self.led_count))
+        now = self._clock() if now is None else now
+        with self._lock:
+            if self._keyframes == 0 or self.type == NONE or self.time <= 0:
+                # nothing to smooth from: show the first keyframe at once
+                self._current.reshape(-1)[:] = frame
+            else:
+                self._update(now)
+            self._start[:] = self._current
+            self._target.reshape(-1)[:] = frame
+            self._keyframe_time = now
+            self._keyframes += 1
+            self._settled = bool(np.array_equal(self._current, self._target))
+
+    def _update(self, now):
+        """Move the current colors to their value at a time."""
+        if self._settled:
+            return
+        if self.type in (LINEAR, EXPONENTIAL):
+            progress = (now - self._keyframe_time) / self.time
+            if progress >= 1.0:
+                self._current[:] = self._target
+                self._settled = True
+                return
+            progress = max(progress, 0.0)
+            if self.type == EXPONENTIAL:
+                # 1 - exp(-rate * progress) covers EXPONENTIAL_SETTLED of the step at progress 1:
+                # divided by it, the curve ends on the keyframe without a jump
+                rate = -math.log(1.0 - EXPONENTIAL_SETTLED)
+                progress = (1.0 - math.exp(-rate * progress)) / EXPONENTIAL_SETTLED
+            np.subtract(self._target, self._start, out=self._work)
+            self._work *= progress
+            np.add(self._start, self._work, out=self._current)
+        else:
+            self._current[:] = self._target
+            self._settled = True
+
+    def frame(self, now=None):
+        """
+        Return the output frame.
+
+        The array is reused by the next call: send or copy it before.
+
+        :param now: clock value of the frame, None -> now
+        :return: numpy uint8 array of shape (ledcount, 3)
+        """
+        now = self._clock() if now is None else now
+        with self._lock:
+            self._update(now)
+            np.add(self._current, 0.5, out=self._work)
+            np.copyto(self._output, self._work, casting="unsafe")
+        return self._output
+
+# -OUTPUT-
+    def start(self, sink, fps=None):
+        """
+        Send the output frames from a background thread.
+
+        The frames are sent while the colors move and once more when they settle, an unchanged
+        output is not sent again.
+
+        :param sink: callable sending a frame, e.g. hyperion_client.send_led_data or OPCclient.put_pixels
+        :param fps: output frames per second, None -> update_frequency
+        """
+        if self._running:
+            return
+        self._running = True
+        self._pacer = frame_pacer(fps or self.update_frequency)
+        self._thread = threading.Thread(target=self._run, args=(sink,), name="hyperion_smoothing", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """
+        Stop the output thread.
+
+        :param timeout: maximum time in seconds to wait for the thread
+        """
+        self._running = False
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+        self._thread = None
+
+    def pacing_stats(self):
+        """
+        Return the pacing statistics of the output thread.
+
+        :return: dict of hyperion_pacer.frame_pacer.stats, None if never started
+        """
+        return self._pacer.stats() if self._pacer is not None else None
+
+    def _run(self, sink):
+        """Output thread: send the frames at the output rate."""
+        sent = None
+        while self._running:
+            self._pacer.wait()
+            if self._keyframes == 0 or (self._settled and sent == self._keyframes):
+                self._pacer.resync()
+                continue
+            keyframes = self._keyframes
+            frame = self.frame()
+            # the settled frame of this keyframe is being sent
+            sent = keyframes if self._settled else None
+            try:
+                sink(frame)
+            except Exception as exc:
+                _log.error("Smoothing output failed: %s", exc)
+
+
+def benchmark_smoothing(led_count=100000, repeat=100):
+    """
+    Measure the time to compute an output frame.
+
+    :param led_count: number of leds
+    :param repeat: number of output frames
+    :return: dict of smoothing types -> milliseconds per frame
+    """
+    keyframe = np.random.default_rng(0).integers(0, 256, led_count * 3, dtype=np.uint8)
+    results = {}
+    for smoothing_type in (LINEAR, EXPONENTIAL):
+        # a settling time longer than the measure, so that every frame interpolates
+        smoothing = color_smoothing(led_count, smoothing_type, time_ms=3600000)
+        smoothing.push(bytes(led_count * 3), now=0.0)
+        smoothing.push(keyframe, now=0.0)
+        begin = time.perf_counter()
+        for index in range(repeat):
+            smoothing.frame(now=index / 60.0)
+        results[smoothing_type] = (time.perf_counter() - begin) / repeat * 1000.0
+    return results
+
+
+if __name__ == '__main__':
+    for smoothing_type, milliseconds in benchmark_smoothing().items():
+        print("%-12s %8.3f ms per 100k leds frame" % (smoothing_type, milliseconds))
@@ -0,0 +1,373 @@
+"""
+hyperion_watcher.py module.
+
+Watch the state of a hyperion json server and report its changes.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import select
+import socket
+import threading
+import time
+
+from hyperion_catalog import effect_catalog
+from hyperion_encoder import encode_command
+
+_log = logging.getLogger(__name__)
+
+# serverinfo sections reported as a whole when they change
+CALIBRATION_SECTIONS = ("transform", "correction", "temperature", "adjustment")
+# keys of a priority that count down while it runs: they are not reported as changes
+_VOLATILE_PRIORITY_KEYS = frozenset(("duration_ms", "remaining"))
+
+
+def _priorities(info):
+    """Return the priorities of a serverinfo snapshot by priority, without the countdown keys."""
+    return {int(entry["priority"]): {key: value for key, value in entry.items() if key not in _VOLATILE_PRIORITY_KEYS}
+            for entry in info.get("priorities", ())}
+
+
+def _active_color(info):
+    """Return the active color of a serverinfo snapshot, None if no color is set."""
+    colors = info.get("activeLedColor") or ()
+    for color in colors:
+        if "RGB Value" in color:
+            return tuple(color["RGB Value"])
+    return None
+
+
+class hyperion_watcher:
+    """
+    Poll the serverinfo of a hyperion server on its own connection and report the changes.
+
+    The polling interval drops to min_interval after a change and grows by backoff up to
+    max_interval while nothing changes.
+
+    The hyperion json server has neither subscriptions nor partial serverinfo requests: every
+    poll still transfers the whole serverinfo, effects catalog included. The watcher saves the
+    work on the client instead. A reply identical to the previous one is recognised by its digest
+    and not parsed, so a server whose priorities have no duration costs one hash per poll. While
+    a priority with a duration runs, its countdown changes every reply, which is then parsed,
+    without reporting the countdown. The effects catalog is only rebuilt when the effects list
+    changes.
+
+    The changes are reported as events, dicts with the keys:
+
+    - "event": "priority_added", "priority_removed", "priority_changed", "effect_started",
+      "effect_stopped", "effect_changed", "color_changed", "<section>_changed" for the
+      calibration sections, "connected" or "disconnected"
+    - "priority": priority concerned by the event, None for the server wide events
+    - "old", "new": previous and current value
+    - "time": time.monotonic() of the poll that found the change
+
+    One watcher can serve any number of subscribers: callbacks run in the polling thread,
+    the async iterators of events() in their event loop.
+    """
+
+    def __init__(self, host='127.0.0.1', port=19444, min_interval=0.1, max_interval=2.0, backoff=1.5, timeout=2.0):
+        """
+        Hyperion_watcher initializer.
+
+        :param host: ip address of the host
+        :param port: port number
+        :param min_interval: polling interval in seconds after a change
+        :param max_interval: maximum polling interval in seconds while nothing changes
+        :param backoff: factor applied to the polling interval after every poll without change
+        :param timeout: maximum time in seconds to wait for the server
+        """
+        self._host = str(host)
+        self._port = int(port)
+        self.min_interval = float(min_interval)
+        self.max_interval = float(max_interval)
+        self.backoff = float(backoff)
+        self.timeout = float(timeout)
+        self._interval = self.min_interval
+        self._socket = None
+        self._recv_buffer = bytearray()
+        self._callbacks = []
+        self._callbacks_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._running = False
+        self._digest = None
+        self._state = None
+        self._effects = None
+        self._catalog = effect_catalog(())
+        self._polls = 0
+        self._parsed = 0
+        self._last_error = None
+
+    @property
+    def host(self):
+        """
+        Return ip address.
+
+        :return: ip address of the hyperion server host
+        """
+        return self._host
+
+    @property
+    def port(self):
+        """
+        Return port.
+
+        :return: port of the hyperion server host
+        """
+        return self._port
+
+    @property
+    def interval(self):
+        """
+        Return the current polling interval.
+
+        :return: polling interval in seconds
+        """
+        return self._interval
+
+    @property
+    def running(self):
+        """
+        Return the polling status.
+
+        :return: True if the polling thread runs
+        """
+        return self._running
+
+    def stats(self):
+        """
+        Return the polling statistics.
+
+        :return: dict with the number of polls, the number of parsed replies, the current interval
+                 in seconds, the connection status and the last error
+        """
+        return {"polls": self._polls,
+                "parsed": self._parsed,
+                "interval": self._interval,
+                "connected": self._socket is not None,
+                "last_error": self._last_error}
+
+# -SUBSCRIBERS-
+    def subscribe(self, callback):
+        """
+        Call a function with every event.
+
+        :param callback: function taking the event dict, called in the polling thread
+        :return: the callback, to unsubscribe it later
+        """
+        with self._callbacks_lock:
+            self._callbacks.append(callback)
+        return callback
+
+    def unsubscribe(self, callback):
+        """
+        Stop calling a function with the events.
+
+        :param callback: function given to subscribe
+        """
+        with self._callbacks_lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    async def events(self, maxsize=256):
+        """
+        Iterate over the events in the running event loop.
+
+        When the consumer falls more than maxsize events behind, the oldest events are dropped.
+
+        :param maxsize: maximum number of events waiting for the consumer
+        :return: async iterator of the event dicts
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize)
+
+        def put(event):
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(event)
+
+        def push(event):
+            loop.call_soon_threadsafe(put, event)
+
+        self.subscribe(push)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self.unsubscribe(push)
+
+    def _emit(self, events):
+        """Pass events to the subscribers."""
+        with self._callbacks_lock:
+            callbacks = list(self._callbacks)
+        for event in events:
+            for callback in callbacks:
+                try:
+                    callback(event)
+                except Exception as exc:
+                    _log.exception("Error in hyperion_watcher callback: %s", exc)
+
+# -POLLING-
+    def start(self):
+        """Start the polling thread."""
+        if self._running:
+            return
+        self._running = True
+        self._wake.clear()
+        self._thread = threading.Thread(target=self._run, name="hyperion_watcher %s" % self._host, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """
+        Stop the polling thread and close its connection.
+
+        :param timeout: maximum time in seconds to wait for the thread
+        """
+        self._running = False
+        self._wake.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+        self._thread = None
+
+    def wake(self):
+        """Poll now and restart from the minimum interval, e.g. after sending a command."""
+        self._interval = self.min_interval
+        self._wake.set()
+
+    def _run(self):
+        """Polling thread: poll, report the changes and wait for the next poll."""
+        while self._running:
+            try:
+                changed = self.poll()
+            except (socket.error, ValueError) as exc:
+                self._disconnect(exc)
+                changed = False
+            if changed:
+                self._interval = self.min_interval
+            else:
+                self._interval = min(self._interval * self.backoff, self.max_interval)
+            self._wake.wait(self._interval)
+            self._wake.clear()
+        self._disconnect(None)
+
+    def poll(self):
+        """
+        Query the serverinfo once and report its changes.
+
+        :return: True if the state changed since the previous poll
+        """
+        if self._socket is None:
+            self._connect()
+        self._socket.sendall(encode_command("serverinfo"))
+        line = self._read_line()
+        self._polls += 1
+        digest = hashlib.blake2b(line, digest_size=16).digest()
+        if digest == self._digest:
+            return False
+        self._digest = digest
+        reply = json.loads(line)
+        self._parsed += 1
+        if not reply.get("success", True) or "info" not in reply:
+            raise ValueError("Serverinfo request failed: %s" % reply.get("error"))
+        events = self._update(reply["info"])
+        self._emit(events)
+        return bool(events)
+
+    def _connect(self):
+        """Open the connection of the watcher."""
+        sock = socket.create_connection((self._host, self._port), self.timeout)
+        self._socket = sock
+        del self._recv_buffer[:]
+        self._last_error = None
+        self._emit([self._event("connected")])
+
+    def _disconnect(self, exc):
+        """Close the connection of the watcher after an error or on stop."""
+        if exc is not None:
+            self._last_error = exc.with_traceback(None)
+        if self._socket is None:
+            return
+        self._socket.close()
+        self._socket = None
+        self._digest = None
+        self._emit([self._event("disconnected", old=None, new=self._last_error)])
+
+    def _read_line(self):
+        """Read the next reply line of the server."""
+        deadline = time.monotonic() + self.timeout
+        while True:
+            end = self._recv_buffer.find(b'\n')
+            if end >= 0:
+                line = bytes(self._recv_buffer[:end])
+                del self._recv_buffer[:end + 1]
+                return line
+            remaining = deadline - time.monotonic()
+            readable = remaining > 0 and select.select([self._socket], [], [], remaining)[0]
+            if not readable:
+                raise socket.timeout("No serverinfo reply from %s:%d" % (self._host, self._port))
+            data = self._socket.recv(65536)
+            if not data:
+                raise socket.error("Connection closed by the hyperion server")
+            self._recv_buffer += data
+
+# -DIFF-
+    def _event(self, name, priority=None, old=None, new=None):
+        return {"event": name, "priority": priority, "old": old, "new": new, "time": time.monotonic()}
+
+    def _resolve_effects(self, info):
+        """Return the active effects of a serverinfo snapshot by priority, resolved to their names."""
+        effects = info.get("effects", ())
+        if effects != self._effects:
+            self._effects = effects
+            self._catalog = effect_catalog(effects)
+        resolved = {}
+        for active in info.get("activeEffects", ()):
+            effect, diff = self._catalog.resolve(active["script"], active.get("args"))
+            resolved[int(active["priority"])] = {"name": str(effect["name"]) if effect is not None else None,
+                                                 "script": active["script"],
+                                                 "args": diff}
+        return resolved
+
+    def _update(self, info):
+        """
+        Replace the watched state with a serverinfo snapshot.
+
+        :param info: "info" object of the serverinfo reply
+        :return: list of the events between the previous and the new state
+        """
+        state = {"priorities": _priorities(info),
+                 "effects": self._resolve_effects(info),
+                 "color": _active_color(info)}
+        for section in CALIBRATION_SECTIONS:
+            state[section] = info.get(section)
+        previous, self._state = self._state, state
+        if previous is None:
+            # first snapshot: report everything as added
+            previous = {"priorities": {}, "effects": {}, "color": None}
+        events = []
+        for name, added, removed, changed in (("priorities", "priority_added", "priority_removed", "priority_changed"),
+                                              ("effects", "effect_started", "effect_stopped", "effect_changed")):
+            old, new = previous[name], state[name]
+            for priority in sorted(old.keys() | new.keys()):
+                if priority not in old:
+                    events.append(self._event(added, priority, None, new[priority]))
+                elif priority not in new:
+                    events.append(self._event(removed, priority, old[priority], None))
+                elif old[priority] != new[priority]:
+                    events.append(self._event(changed, priority, old[priority], new[priority]))
+        if previous["color"] != state["color"]:
+            events.append(self._event("color_changed", None, previous["color"], state["color"]))
+        for section in CALIBRATION_SECTIONS:
+            if section in previous and previous[section] != state[section]:
+                events.append(self._event(section + "_changed", None, previous[section], state[section]))
+        return events
+
+    def state(self):
+        """
+        Return the last watched state.
+
+        :return: dict with the priorities and the resolved active effects by priority, the active
+                 color and the calibration sections, None before the first poll
+        """
+        return self._state
@@ -0,0 +1,22 @@
+"""
+Shared fixtures of the tests.
+
+The modules of the package are top-level modules: the tests import them from the repository root.
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hyperion_emulator import hyperion_emulator  # noqa: E402
+
+
+@pytest.fixture
+def emulator():
+    """Emulator without leds on a free port, with the default effects."""
+    server = hyperion_emulator(None, PORT=0)
+    server.start()
+    yield server
+    server.stop()
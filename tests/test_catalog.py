@@ -0,0 +1,48 @@
+"""Resolution of the running effects to the effects of the server."""
+from hyperion_catalog import args_distance, effect_catalog
+from hyperion_client import hyperion_client
+from hyperion_emulator import DEFAULT_EFFECTS
+
+
+def test_exact_args_resolve_to_their_effect():
+    catalog = effect_catalog(DEFAULT_EFFECTS)
+    effect, diff = catalog.resolve("rainbow-swirl.py", {"rotation-time": 3, "brightness": 1.0, "reverse": False})
+    assert effect["name"] == "Rainbow swirl fast"
+    assert diff == {}
+
+
+def test_tie_goes_to_the_closest_values():
+    catalog = effect_catalog(DEFAULT_EFFECTS)
+    args = {"rotation-time": 5.0, "brightness": 1.0, "reverse": False}
+    effect, diff = catalog.resolve("rainbow-swirl.py", args)
+    assert effect["name"] == "Rainbow swirl fast"
+    assert diff == {"rotation-time": 5.0}
+    args["rotation-time"] = 15.0
+    assert catalog.resolve("rainbow-swirl.py", args)[0]["name"] == "Rainbow swirl"
+
+
+def test_unknown_script_resolves_to_none():
+    effect, diff = effect_catalog(DEFAULT_EFFECTS).resolve("fire.py", {"speed": 1})
+    assert effect is None
+    assert diff == {"speed": 1}
+
+
+def test_args_distance():
+    assert args_distance(3, 3.0) == 0.0
+    assert args_distance(5.0, 3.0) < args_distance(5.0, 20.0)
+    assert args_distance([0, 0, 255], [0, 0, 200]) < args_distance([0, 0, 255], [255, 255, 255])
+    assert args_distance("a", "b") == 1.0
+    assert args_distance(True, False) == 1.0
+
+
+def test_custom_args_effect_name(emulator):
+    client = hyperion_client("127.0.0.1", emulator.address[1])
+    client.open_connection(timeout=2)
+    try:
+        client.set_effect("Rainbow swirl", priority=50,
+                          effectArgs={"rotation-time": 5.0, "brightness": 1.0, "reverse": False})
+        client.invalidate_serverinfo()
+        assert client.active_effects_names() == ["Rainbow swirl fast"]
+        assert client.active_effects_resolved()[0]["args"] == {"rotation-time": 5.0}
+    finally:
+        client.close_connection()
@@ -0,0 +1,49 @@
+"""Hyperion_client against the emulator."""
+import json
+
+import pytest
+
+from hyperion_client import hyperion_client
+
+
+@pytest.fixture
+def client(emulator):
+    client = hyperion_client("127.0.0.1", emulator.address[1])
+    client.open_connection(timeout=2)
+    yield client
+    client.close_connection()
+
+
+def test_raw_image_is_mirrored_once_sent(client):
+    client.set_image(bytes(4 * 4 * 3), 4, 4, priority=60)
+    client.clear(70)
+    assert 60 in client.priority_stack
+    assert client.serverinfo()["info"]["priorities"][0]["priority"] == 60
+
+
+def test_image_failing_to_encode_is_not_mirrored(client):
+    # 2 bytes are not a 4x4 RGB888 image: the worker fails to encode it
+    client.set_image(bytes(2), 4, 4, priority=60)
+    client.clear(70)
+    assert 60 not in client.priority_stack
+    assert client.serverinfo()["info"]["priorities"] == []
+
+
+def test_frames_are_tagged_once(client):
+    for index in range(20):
+        client.send_led_data(bytes([index, 0, 0]), priority=50)
+    # every reply echoes the tan of its frame and resolves its request
+    assert client.serverinfo()["info"]["priorities"][0]["priority"] == 50
+    assert client.pending_requests == 0
+
+
+def test_recv_timeout_returns_the_unmatched_replies(client):
+    assert client.recv_timeout(0.05) == ""
+    # written behind the client: no pending command waits for this reply
+    client._hyperion_client__socket.sendall(b'{"command":"clear","priority":80,"tan":999999}\n')
+    reply = json.loads(client.recv_timeout(2))
+    assert reply["tan"] == 999999
+    assert reply["success"]
+    # the replies to send_message still resolve their futures only
+    assert client.request({"command": "serverinfo"})["success"]
+    assert client.recv_timeout(0.05) == ""
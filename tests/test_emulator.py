@@ -0,0 +1,88 @@
+"""Hyperion_emulator over raw json lines."""
+import json
+import socket
+import time
+
+import pytest
+
+
+@pytest.fixture
+def connection(emulator):
+    sock = socket.create_connection(emulator.address[:2], timeout=2)
+    stream = sock.makefile('rb')
+    yield sock, stream
+    stream.close()
+    sock.close()
+
+
+def send(connection, **command):
+    sock, stream = connection
+    sock.sendall(json.dumps(command).encode('utf-8') + b'\n')
+    return json.loads(stream.readline())
+
+
+def test_lowest_priority_value_is_visible(emulator, connection):
+    send(connection, command="color", color=[255, 0, 0], priority=100)
+    send(connection, command="color", color=[0, 255, 0], priority=50)
+    send(connection, command="color", color=[0, 0, 255], priority=150)
+    assert emulator.visible_priority() == 50
+    info = send(connection, command="serverinfo")["info"]
+    assert [entry["priority"] for entry in info["priorities"]] == [50, 100, 150]
+    assert info["activeLedColor"][0]["RGB Value"] == [0, 255, 0]
+
+
+def test_duration_expires(emulator, connection):
+    send(connection, command="color", color=[255, 0, 0], priority=100)
+    send(connection, command="color", color=[0, 255, 0], priority=50, duration=100)
+    info = send(connection, command="serverinfo")["info"]
+    assert 0 < info["priorities"][0]["duration_ms"] <= 100
+    assert "duration_ms" not in info["priorities"][1]
+    time.sleep(0.15)
+    assert emulator.visible_priority() == 100
+    assert [entry["priority"] for entry in send(connection, command="serverinfo")["info"]["priorities"]] == [100]
+
+
+def test_clear_reveals_the_next_priority(emulator, connection):
+    send(connection, command="color", color=[255, 0, 0], priority=100)
+    send(connection, command="color", color=[0, 255, 0], priority=50)
+    assert send(connection, command="clear", priority=50)["success"]
+    assert emulator.visible_priority() == 100
+    # clearing a priority that is not set succeeds and keeps the others
+    assert send(connection, command="clear", priority=50)["success"]
+    assert emulator.visible_priority() == 100
+
+
+def test_clearall_then_set(emulator, connection):
+    send(connection, command="color", color=[255, 0, 0], priority=100)
+    send(connection, command="color", color=[0, 255, 0], priority=50)
+    send(connection, command="clearall")
+    assert emulator.visible_priority() is None
+    send(connection, command="color", color=[0, 0, 255], priority=150)
+    assert emulator.visible_priority() == 150
+
+
+def test_tan_is_echoed(connection):
+    assert send(connection, command="clear", priority=10, tan=7) == {"success": True, "tan": 7}
+    reply = send(connection, command="nope", tan=8)
+    assert reply["tan"] == 8 and not reply["success"]
+    assert "tan" not in send(connection, command="clear", priority=10)
+
+
+def test_client_stats(emulator, connection):
+    send(connection, command="clear", priority=10)
+    send(connection, command="nope")
+    clients = emulator.clients()
+    assert len(clients) == 1
+    assert clients[0]["commands"] == 2
+    assert clients[0]["errors"] == 1
+    assert clients[0]["bytes_in"] > 0 and clients[0]["bytes_out"] > 0
+    sock, stream = connection
+    stream.close()
+    sock.close()
+    deadline = time.monotonic() + 2
+    while emulator.stats()["connected"] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    stats = emulator.stats()
+    assert stats["connected"] == 0
+    assert stats["closed"] == 1
+    assert stats["closed_clients"][0]["commands"] == 2
@@ -0,0 +1,36 @@
+"""Reconciliation of the mirrored priority stack with the serverinfo snapshots."""
+import time
+
+from hyperion_priorities import COLOR, priority_stack
+
+
+def _info(*priorities):
+    return {"priorities": [{"priority": priority} for priority in priorities], "activeEffects": [],
+            "activeLedColor": []}
+
+
+def test_snapshot_before_a_clear_does_not_restore_it():
+    stack = priority_stack()
+    stack.set(50, COLOR, (1, 2, 3))
+    requested = time.monotonic()
+    stack.clear(50)
+    stack.reconcile(_info(50), requested)
+    assert 50 not in stack
+
+
+def test_clear_all_after_an_older_clear_wins():
+    stack = priority_stack()
+    stack.set(50, COLOR, (1, 2, 3))
+    stack.clear(50)
+    requested = time.monotonic()
+    stack.clear_all()
+    stack.reconcile(_info(50, 60), requested)
+    assert 50 not in stack
+    assert 60 not in stack
+
+
+def test_snapshot_after_the_clears_is_taken():
+    stack = priority_stack()
+    stack.clear_all()
+    stack.reconcile(_info(70))
+    assert 70 in stack
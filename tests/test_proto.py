@@ -0,0 +1,72 @@
+"""Hyperion_proto_client against the local stand-in of the proto server."""
+import pytest
+
+from hyperion_proto_client import (_HEADER, decode_message, decode_request, encode_clear_request,
+                                   encode_color_request, hyperion_proto_client, hyperion_proto_server)
+
+
+@pytest.fixture
+def server():
+    server = hyperion_proto_server(PORT=0)
+    server.start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def client(server):
+    client = hyperion_proto_client("127.0.0.1", server.address[1])
+    client.open_connection(timeout=2)
+    yield client
+    client.close_connection()
+
+
+def test_requests_are_length_prefixed():
+    framed = encode_clear_request(42)
+    assert _HEADER.unpack_from(framed)[0] == len(framed) - _HEADER.size
+    # command CLEAR, extension 12 holding the priority
+    assert framed[_HEADER.size:] == bytes([0x08, 3, 0x62, 2, 0x08, 42])
+
+
+def test_color_request_fields():
+    framed = encode_color_request(1, 2, 3, priority=300, duration=1000)
+    fields = decode_message(framed[_HEADER.size:])
+    assert fields[1] == 1
+    color = decode_message(fields[10])
+    # priority 300 and duration 1000 are multi-byte varints, the color is packed as 0x00RRGGBB
+    assert color == {1: 300, 2: 0x010203, 3: 1000}
+    assert decode_request(framed[_HEADER.size:])["color"] == [1, 2, 3]
+
+
+def test_color_image_clear_through_the_server(client, server):
+    assert client.set_RGBcolor(255, 128, 0, priority=50, duration=200, wait=True) == \
+        {"type": 1, "success": True, "error": None}
+    image = bytes(range(2 * 2 * 3))
+    assert client.set_image(image, 2, 2, priority=60, wait=True)["success"]
+    assert client.clear(50, wait=True)["success"]
+    assert client.clear_all(wait=True)["success"]
+    assert server.requests == [
+        {"command": "color", "priority": 50, "color": [255, 128, 0], "duration": 200},
+        {"command": "image", "priority": 60, "imagewidth": 2, "imageheight": 2, "imagedata": image,
+         "duration": -1},
+        {"command": "clear", "priority": 50},
+        {"command": "clearall"},
+    ]
+
+
+def test_replies_of_unwaited_requests_are_skipped(client, server):
+    for priority in range(10):
+        client.set_RGBcolor(0, 0, priority, priority=priority)
+    assert client.clear(5, wait=True)["success"]
+    assert len(server.requests) == 11
+    assert client.last_error is None
+
+
+def test_undecodable_request_is_reported(client, server):
+    # a COLOR command without its extension
+    client._socket.sendall(_HEADER.pack(2) + bytes([0x08, 1]))
+    client._unread_replies += 1
+    reply = client.recv_reply()
+    assert not reply["success"]
+    assert client.last_error == reply["error"]
+    assert server.requests == []